@@ -0,0 +1,118 @@
+"""
+Measure start-up import cost of the CLI entry points with ``python -X importtime``.
+
+For each module the benchmark runs a fresh interpreter several times, reports
+the median cumulative import time and the slowest imported packages, and
+fails (exit code 1) when a module is over its budget or pulls in a dependency
+its import should not need:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 150 --runs 7 --output imports.json
+
+Budgets are for importing the module only; the stages then load what they use
+(SQLAlchemy and pydantic for extraction and saving, Tesseract only for OCR,
+the OpenAI SDK only when the LLM is actually called).
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> (budget in ms, top-level packages its import must not load)
+TARGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    "src.main": (150.0, ("pytesseract", "PIL", "pandas", "pdf2image", "openai", "langchain",
+                         "sqlalchemy", "pydantic")),
+    "src.utils.helpers": (100.0, ("pytesseract", "PIL", "numpy", "pandas", "pdf2image", "pdfminer")),
+    "src.agents.extraction_agent": (800.0, ("pytesseract", "PIL", "pandas", "openai", "langchain")),
+}
+
+LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module: str) -> List[Tuple[str, int, int, int]]:
+    """(package, self us, cumulative us, depth) for every import done by `import module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2)),
+                         (len(match.group(3)) - 1) // 2))  # two spaces per nesting level
+    return rows
+
+
+def direct_children(profile: List[Tuple[str, int, int, int]], module: str) -> List[Tuple[str, float]]:
+    """Packages imported directly by `module`, slowest first, in ms."""
+    index = max(i for i, row in enumerate(profile) if row[0] == module)
+    depth = profile[index][3]
+    children = []
+    # -X importtime prints a module's imports right before the module itself
+    for name, _, cumulative, row_depth in reversed(profile[:index]):
+        if row_depth <= depth:
+            break
+        if row_depth == depth + 1:
+            children.append((name, cumulative / 1000))
+    return sorted(children, key=lambda item: -item[1])
+
+
+def measure(module: str, runs: int) -> Dict[str, object]:
+    totals = []
+    profile: List[Tuple[str, int, int, int]] = []
+    for _ in range(runs):
+        profile = import_profile(module)
+        totals.append(next((cum for name, _, cum, _ in reversed(profile) if name == module), 0) / 1000)
+    return {
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "loaded": sorted({name.split(".")[0] for name, _, _, _ in profile}),
+        "slowest": [(name, round(ms, 1)) for name, ms in direct_children(profile, module)[:8]],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import-time benchmark with budgets.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="override the budget for src.main")
+    parser.add_argument("--output", help="save results JSON here")
+    args = parser.parse_args(argv)
+
+    failures = []
+    results = {}
+    for module, (budget, forbidden) in TARGETS.items():
+        if module == "src.main" and args.budget_ms is not None:
+            budget = args.budget_ms
+        result = measure(module, args.runs)
+        leaked = [pkg for pkg in forbidden if pkg in result["loaded"]]
+        result.update(budget_ms=budget, unexpected_imports=leaked)
+        results[module] = result
+        status = "ok" if result["median_ms"] <= budget and not leaked else "FAIL"
+        print(f"{module}: {result['median_ms']} ms median (budget {budget:g} ms) [{status}]")
+        for name, ms in result["slowest"]:
+            print(f"    {ms:8.1f} ms  {name}")
+        if result["median_ms"] > budget:
+            failures.append(f"{module} took {result['median_ms']} ms, budget {budget:g} ms")
+        if leaked:
+            failures.append(f"{module} imported {', '.join(leaked)} at import time")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
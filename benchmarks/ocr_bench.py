@@ -0,0 +1,166 @@
+"""
+OCR time vs accuracy with and without image preprocessing (src.utils.preprocess).
+
+Runs every image through Tesseract twice: the raw image as before, and the
+cropped/downscaled/deskewed/binarized one. Accuracy is the character
+similarity to a ground-truth transcript (difflib ratio on whitespace-normalized
+text) plus the share of ground-truth words found.
+
+    python benchmarks/ocr_bench.py --images path/to/receipts   # a.jpg + a.txt ground truth pairs
+    python benchmarks/ocr_bench.py --synthetic 10 --output ocr.json
+
+--synthetic draws receipt-like photos: a tilted strip of paper on a large
+textured, unevenly lit background. Without the tesseract binary only the
+preprocessing time and pixel counts are reported.
+"""
+import argparse
+import difflib
+import glob
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.utils import preprocess  # noqa: E402
+
+VENDORS = ["GREEN MART", "CITY PHARMACY", "BLUE CAFE", "QUICK FUEL", "CORNER BAKERY"]
+ITEMS = ["MILK 1L", "BREAD", "EGGS 12", "COFFEE", "APPLES", "RICE 5KG", "TEA", "SOAP", "WATER", "BUTTER"]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has only the fixed bitmap font
+        return ImageFont.load_default()
+
+
+def synthetic_receipt(seed: int) -> Tuple[Image.Image, str]:
+    """A 4000x3000 colour 'photo' of a receipt and its transcript."""
+    rng = random.Random(seed)
+    lines = [rng.choice(VENDORS), f"{rng.randint(1, 999)} MAIN STREET", f"DATE {rng.randint(1, 28):02d}/0{rng.randint(1, 9)}/2024", ""]
+    total = 0.0
+    for _ in range(rng.randint(5, 12)):
+        price = round(rng.uniform(0.5, 40), 2)
+        total += price
+        lines.append(f"{rng.choice(ITEMS):<14}{price:>8.2f}")
+    lines += ["", f"{'TOTAL':<14}{total:>8.2f}", "THANK YOU"]
+    font = _font(34)
+    paper = Image.new("L", (560, 90 + 48 * len(lines)), 245)
+    draw = ImageDraw.Draw(paper)
+    for i, line in enumerate(lines):
+        draw.text((50, 45 + 48 * i), line, fill=25, font=font)
+
+    h, w = 3000, 4000
+    grid_y, grid_x = np.mgrid[0:h, 0:w]
+    shade = 90 + 50 * (grid_x / w) + 30 * np.sin(grid_y / 170.0)  # wood-ish, unevenly lit table
+    noise = np.random.default_rng(seed).normal(0, 6, (h, w))
+    table = np.clip(np.stack([shade + noise, shade * 0.75 + noise, shade * 0.5 + noise], axis=-1), 0, 255)
+    photo = Image.fromarray(table.astype(np.uint8), "RGB")
+    scale = rng.uniform(2.0, 2.6)  # receipt fills most of the frame height, as in a phone photo
+    paper = paper.resize((int(paper.width * scale), int(paper.height * scale)), Image.Resampling.BICUBIC)
+    if paper.height > h - 100:
+        paper.thumbnail((w, h - 100))
+    angle = rng.uniform(-6, 6)
+    mask = Image.new("L", paper.size, 255).rotate(angle, expand=True)
+    paper = paper.rotate(angle, expand=True, fillcolor=245, resample=Image.Resampling.BICUBIC)
+    photo.paste(paper.convert("RGB"), ((w - paper.width) // 2, (h - paper.height) // 2), mask)
+    return photo.filter(ImageFilter.GaussianBlur(0.8)), "\n".join(lines)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.upper().split())
+
+
+def accuracy(ocr: str, truth: str) -> Dict[str, float]:
+    ocr_n, truth_n = _normalize(ocr), _normalize(truth)
+    words = truth_n.split()
+    found = set(ocr_n.split())
+    return {
+        "char_similarity": round(difflib.SequenceMatcher(None, ocr_n, truth_n).ratio(), 3),
+        "word_recall": round(sum(1 for word in words if word in found) / max(1, len(words)), 3),
+    }
+
+
+def run_one(image: Image.Image, truth: Optional[str], has_tesseract: bool) -> Dict[str, Dict[str, float]]:
+    result: Dict[str, Dict[str, float]] = {}
+    started = time.perf_counter()
+    cleaned, info = preprocess.preprocess_image(image)
+    prep_ms = (time.perf_counter() - started) * 1000
+    result["preprocessed"] = {"preprocess_ms": round(prep_ms, 1), "pixels": info["pixels_after"],
+                              "skew": info["skew"], "cropped": info["cropped"]}
+    result["raw"] = {"preprocess_ms": 0.0, "pixels": info["pixels_before"]}
+    if not has_tesseract:
+        return result
+    import pytesseract
+
+    for name, img, config in (("raw", image, ""),
+                              ("preprocessed", cleaned, preprocess.tesseract_config(info["layout"]))):
+        started = time.perf_counter()
+        text = pytesseract.image_to_string(img, config=config)
+        result[name]["ocr_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if truth is not None:
+            result[name].update(accuracy(text, truth))
+    return result
+
+
+def load_images(directory: str) -> List[Tuple[str, Image.Image, Optional[str]]]:
+    samples = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        if os.path.splitext(path)[1].lower() not in (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"):
+            continue
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        truth = open(truth_path, encoding="utf-8").read() if os.path.exists(truth_path) else None
+        samples.append((os.path.basename(path), Image.open(path), truth))
+    return samples
+
+
+def summarize(rows: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    summary: Dict[str, Dict[str, float]] = {}
+    for variant in ("raw", "preprocessed"):
+        keys = {k for row in rows for k, v in row[variant].items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        summary[variant] = {k: round(statistics.median(row[variant][k] for row in rows if k in row[variant]), 3)
+                            for k in sorted(keys)}
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="OCR preprocessing benchmark.")
+    parser.add_argument("--images", help="directory of images with optional same-name .txt transcripts")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate N synthetic receipt photos")
+    parser.add_argument("--output", help="save per-image results and medians as JSON")
+    args = parser.parse_args(argv)
+    if not args.images and not args.synthetic:
+        args.synthetic = 5
+
+    samples = load_images(args.images) if args.images else []
+    samples += [(f"synthetic-{i}", *synthetic_receipt(i)) for i in range(args.synthetic)]
+    has_tesseract = shutil.which(os.getenv("TESSERACT_CMD") or "tesseract") is not None
+    if not has_tesseract:
+        print("⚠️ tesseract not found: reporting preprocessing cost only")
+
+    rows = []
+    for name, image, truth in samples:
+        row = run_one(image, truth, has_tesseract)
+        rows.append(row)
+        print(f"{name}: {json.dumps(row)}")
+    summary = summarize(rows)
+    print("median:", json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({"images": rows, "median": summary}, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
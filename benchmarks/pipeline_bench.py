@@ -0,0 +1,330 @@
+"""
+Benchmark the extraction pipeline stage by stage on a synthetic corpus.
+
+Stages measured:
+    text   extract_document_text (pdfminer for text PDFs, Tesseract for images)
+    llm    extraction_agent, served by the local fake server from recorded fixtures
+    parse  results.parse_reply + local repair and validation on the recorded replies
+    date   _parse_date on the date formats found in real documents (plus a bulk
+           rate for src.utils.dates.normalize_series, as used by backfills)
+    db     processing_agent (one commit per row) and BulkWriter (batched)
+
+Results (per-stage p50/p95 latency, docs/sec, DB rows/sec, peak RSS) are printed
+and saved as JSON so runs can be compared:
+
+    python benchmarks/pipeline_bench.py --docs 50 --output before.json
+    python benchmarks/pipeline_bench.py --docs 50 --output after.json --compare before.json
+
+The LLM replies come from benchmarks/fixtures/llm_responses.json; each entry is
+served when its "match" string (the synthetic document number) appears in the
+prompt. Run with --record and a real OPENAI_API_KEY to capture fresh replies.
+Image OCR is skipped when the tesseract binary is not installed.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures", "llm_responses.json")
+sys.path.insert(0, ROOT)
+
+VENDORS = ["Acme Supplies Ltd", "Globex Trading", "Initech Stationers", "Umbrella Foods", "Stark Hardware"]
+PRODUCTS = ["A4 Paper Ream", "Stapler", "Toner Cartridge", "Coffee Beans 1kg", "HDMI Cable",
+            "Desk Lamp", "Whiteboard Marker", "Cleaning Spray", "Printer Ink", "USB Drive 32GB"]
+DATE_FORMATS = ["%Y-%m-%d", "%d %b %Y", "%d %B %Y", "%m/%d/%Y", "%d/%m/%Y"]
+BOILERPLATE = ("Payment is due within 30 days. Late payments incur 1.5% monthly interest. "
+               "Goods remain our property until paid in full. ")
+
+
+# --- synthetic corpus ------------------------------------------------------
+
+def synthetic_document(index: int, rng: random.Random, max_pages: int) -> Dict[str, Any]:
+    """A fake invoice with known ground truth; spans 1..max_pages pages."""
+    number = f"INV-{index:05d}"
+    vendor = rng.choice(VENDORS)
+    day = datetime(2024, rng.randint(1, 12), rng.randint(1, 28))
+    products = []
+    for _ in range(rng.randint(1, 8)):
+        quantity = rng.randint(1, 10)
+        unit_price = round(rng.uniform(1, 200), 2)
+        products.append({"name": rng.choice(PRODUCTS), "quantity": quantity,
+                         "unit_price": unit_price, "total": round(quantity * unit_price, 2)})
+    amount = round(sum(p["total"] for p in products), 2)
+    total = round(amount * 1.075, 2)
+
+    lines = [vendor, f"Invoice {number}", f"Date: {day.strftime(rng.choice(DATE_FORMATS))}", ""]
+    lines += [f"{p['name']}  {p['quantity']} x {p['unit_price']:.2f}  {p['total']:.2f}" for p in products]
+    lines += ["", f"Subtotal: {amount:.2f}", f"Total: {total:.2f}"]
+    pages = [lines]
+    for _ in range(rng.randint(1, max_pages) - 1):
+        pages.append([vendor, f"Invoice {number} (continued)"] + [BOILERPLATE] * 20)
+    return {
+        "number": number,
+        "pages": pages,
+        "truth": {"vendor_name": vendor, "amount": amount, "products": products,
+                  "total_amount": total, "date": day.strftime("%Y-%m-%d")},
+    }
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path: str, pages: List[List[str]]) -> None:
+    """Write a minimal text PDF (Helvetica, one text block per page) without extra dependencies."""
+    objects: List[bytes] = []
+    page_ids = []
+    font_id = 3
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(
+            f"({_pdf_escape(line[:110])}) Tj T*" for line in lines) + " ET"
+        content_id = 4 + len(objects)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode("latin-1"))
+        page_ids.append(4 + len(objects))
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode("latin-1"))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    header = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(header + objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as fh:
+        fh.write(out)
+
+
+def write_receipt_image(path: str, lines: List[str]) -> None:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (900, 40 + 28 * len(lines)), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((30, 20 + 28 * i), line, fill="black")
+    image.save(path, quality=90)
+
+
+def build_corpus(directory: str, docs: int, images: int, max_pages: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(docs + images):
+        doc = synthetic_document(i, rng, max_pages if i < docs else 1)
+        if i < docs:
+            doc["path"] = os.path.join(directory, f"{doc['number']}.pdf")
+            write_text_pdf(doc["path"], doc["pages"])
+        else:
+            doc["path"] = os.path.join(directory, f"{doc['number']}.jpg")
+            write_receipt_image(doc["path"], doc["pages"][0])
+        corpus.append(doc)
+    return corpus
+
+
+# --- fixtures ----------------------------------------------------------------
+
+def load_fixtures(path: str = FIXTURES) -> List[Dict[str, str]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)["responses"]
+
+
+def fixture_responder(fixtures: List[Dict[str, str]]) -> Callable[[str], str]:
+    default = fixtures[0]["response"] if fixtures else json.dumps({})
+
+    def respond(prompt: str) -> str:
+        for entry in fixtures:
+            if entry["match"] in prompt:
+                return entry["response"]
+        return default
+
+    return respond
+
+
+# --- measurement ---------------------------------------------------------------
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+        except ImportError:
+            return None
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "count": len(samples),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "total_s": round(sum(ordered), 4),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run(args) -> Dict[str, Any]:
+    work_dir = tempfile.mkdtemp(prefix="pipeline_bench_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["EXTRACTION_CACHE"] = "0"
+    # the llm stage measures the LLM path; run with TEMPLATES=1 to measure the vendor template fast path
+    os.environ.setdefault("TEMPLATES", "0")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+    server = None
+    if not args.record:
+        from src.llm.fake_server import start_fake_server
+        server = start_fake_server(latency=args.llm_latency, responder=fixture_responder(load_fixtures()))
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+
+    # imported only now so the DB URL and LLM endpoint above take effect
+    from src.database.connection import init_db
+    from src.agents.extraction_agent import extraction_agent
+    from src.agents.processing_agent import BulkWriter, _parse_date, processing_agent
+    from src.extractors import results as extraction_results
+    import pandas as pd
+    from src.utils.dates import normalize_series
+    from src.utils.helpers import extract_document_text
+
+    init_db()
+    corpus = build_corpus(work_dir, args.docs, args.images, args.max_pages, args.seed)
+    has_tesseract = shutil.which(os.getenv("TESSERACT_CMD") or "tesseract") is not None
+    stages: Dict[str, List[float]] = {"text": [], "llm": [], "parse": [], "date": [], "db_row": []}
+    skipped = []
+    extracted = []
+    recorded = []
+    started = time.perf_counter()
+
+    for doc in corpus:
+        if doc["path"].endswith(".jpg") and not has_tesseract:
+            skipped.append(doc["number"])
+            continue
+        text, elapsed = timed(extract_document_text, doc["path"])
+        stages["text"].append(elapsed)
+        data, elapsed = timed(extraction_agent, text, "invoice")
+        stages["llm"].append(elapsed)
+        extracted.append((data, doc["path"]))
+        if args.record:
+            raw = data.json() if hasattr(data, "json") else json.dumps(data)
+            recorded.append({"match": doc["number"], "response": raw})
+
+    for entry in load_fixtures() * args.repeat:
+        _, elapsed = timed(lambda raw: extraction_results.finalize(extraction_results.parse_reply(raw), "invoice"),
+                           entry["response"])
+        stages["parse"].append(elapsed)
+
+    rng = random.Random(args.seed)
+    for _ in range(200 * args.repeat):
+        value = datetime(2024, rng.randint(1, 12), rng.randint(1, 28)).strftime(rng.choice(DATE_FORMATS))
+        _, elapsed = timed(_parse_date, value)
+        stages["date"].append(elapsed)
+    bulk_dates = pd.Series([datetime(rng.randint(1990, 2030), rng.randint(1, 12), rng.randint(1, 28))
+                            .strftime(rng.choice(DATE_FORMATS)) for _ in range(10000 * args.repeat)])
+    _, bulk_dates_elapsed = timed(normalize_series, bulk_dates)
+
+    for data, path in extracted:
+        _, elapsed = timed(processing_agent, data, source_file_path=path)
+        stages["db_row"].append(elapsed)
+    pipeline_elapsed = time.perf_counter() - started
+
+    bulk_rows = [pair for pair in extracted for _ in range(args.repeat)]
+    writer = BulkWriter(flush_size=args.flush_size, flush_interval=float("inf"))
+    bulk_started = time.perf_counter()
+    for data, path in bulk_rows:
+        writer.add(data, path)
+    writer.flush()
+    bulk_elapsed = time.perf_counter() - bulk_started
+
+    if server is not None:
+        server.stop()
+    if args.record:
+        os.makedirs(os.path.dirname(FIXTURES), exist_ok=True)
+        with open(FIXTURES, "w", encoding="utf-8") as fh:
+            json.dump({"responses": recorded}, fh, indent=1)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    processed = len(extracted)
+    db_row_total = sum(stages["db_row"])
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "documents": processed,
+        "skipped_image_ocr": len(skipped),
+        "docs_per_sec": round(processed / pipeline_elapsed, 2) if pipeline_elapsed else None,
+        "stages": {name: summarize(samples) for name, samples in stages.items()},
+        "db_rows_per_sec": {
+            "per_row_commit": round(processed / db_row_total, 1) if db_row_total else None,
+            "bulk_writer": round(len(bulk_rows) / bulk_elapsed, 1) if bulk_elapsed and bulk_rows else None,
+        },
+        "bulk_dates_per_sec": round(len(bulk_dates) / bulk_dates_elapsed) if bulk_dates_elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"\nCompared with {baseline.get('timestamp')}:")
+    for name, stats in current["stages"].items():
+        old = baseline.get("stages", {}).get(name, {})
+        if stats.get("p50_ms") and old.get("p50_ms"):
+            change = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            print(f"  {name:<7} p50 {old['p50_ms']:>9.3f} -> {stats['p50_ms']:>9.3f} ms ({change:+.1f}%)")
+    if current.get("docs_per_sec") and baseline.get("docs_per_sec"):
+        print(f"  docs/sec {baseline['docs_per_sec']} -> {current['docs_per_sec']}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline stages.")
+    parser.add_argument("--docs", type=int, default=24, help="synthetic text PDFs")
+    parser.add_argument("--images", type=int, default=4, help="synthetic receipt images (need tesseract)")
+    parser.add_argument("--max-pages", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions for the micro stages and bulk DB run")
+    parser.add_argument("--flush-size", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds added per fake LLM reply")
+    parser.add_argument("--record", action="store_true", help="call the real LLM and rewrite the fixtures")
+    parser.add_argument("--output", help="save results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to diff against")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
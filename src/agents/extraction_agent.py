@@ -1,13 +1,52 @@
+from typing import Any, List
+from src.extractors import classifier, templates
+from src.extractors.batch_extractor import extract_batch
 from src.extractors.invoice_extractor import extract_invoice_data
 from src.extractors.receipt_extractor import extract_receipt_data
 from src.types.schemas import ExtractedData
 
 def extraction_agent(document_text: str, document_type: str) -> ExtractedData:
-    """Route document to appropriate extractor"""
-    
-    if document_type.lower() == "invoice":
-        return extract_invoice_data(document_text)
-    elif document_type.lower() == "receipt":
-        return extract_receipt_data(document_text)
+    """Route document to appropriate extractor, trying the vendor's learned template first"""
+
+    doc_type = document_type.lower()
+    if doc_type == "auto":
+        doc_type = classifier.classify_text(document_text).document_type
+    if doc_type == "invoice":
+        extract = extract_invoice_data
+    elif doc_type == "receipt":
+        extract = extract_receipt_data
     else:
-        raise ValueError(f"Unknown document type: {document_type}")
\ No newline at end of file
+        raise ValueError(f"Unknown document type: {document_type}")
+
+    fast = templates.try_extract(document_text, doc_type)
+    if fast is not None:
+        return _from_template(fast)
+
+    # templates learn from this result once it has passed validation (src.main, src.batch)
+    return extract(document_text)
+
+def _from_template(fields) -> ExtractedData:
+    data = ExtractedData(**fields)
+    data._from_template = True  # never learned from: it would only confirm itself
+    return data
+
+def extraction_agent_many(document_texts: List[str], document_type: str) -> List[Any]:
+    """
+    Extract several documents of one type, packing the ones no template covers
+    into shared LLM requests. Returns one ExtractedData (or dict) per text, or
+    the exception that document failed with.
+    """
+    doc_type = document_type.lower()
+    results: List[Any] = [None] * len(document_texts)
+    pending = []
+    for index, text in enumerate(document_texts):
+        fast = templates.try_extract(text, doc_type)
+        if fast is not None:
+            results[index] = _from_template(fast)
+        else:
+            pending.append(index)
+
+    extracted = extract_batch([document_texts[i] for i in pending], doc_type)
+    for index, result in zip(pending, extracted):
+        results[index] = result
+    return results
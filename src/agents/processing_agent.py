@@ -1,86 +1,192 @@
-from typing import Optional, Any
+from typing import Optional, Any, Iterable, List, Tuple
 import json
-from datetime import datetime, date
+import os
+import time
+from datetime import datetime
 from src.types.schemas import ExtractedData
+from sqlalchemy import insert
 from src.database.connection import SessionLocal
-from src.database.models import InvoiceModel, ReceiptModel
-
-# optional: nicer parsing if python-dateutil is installed
-try:
-    from dateutil import parser as date_parser  # type: ignore
-except Exception:
-    date_parser = None  # fallback to manual formats
+from src.database.models import InvoiceModel, ReceiptModel, LineItemModel
+from src.database.line_items import line_item_rows
+from src.utils import dates, metrics
 
 def _parse_date(value: Any) -> Optional[datetime]:
-    if value is None:
-        return None
-    if isinstance(value, datetime):
-        return value
-    if isinstance(value, date):
-        return datetime.combine(value, datetime.min.time())
-    if date_parser:
-        try:
-            return date_parser.parse(str(value))
-        except Exception:
-            pass
-    # try common formats
-    formats = ("%Y-%m-%d", "%d %b %Y", "%d %B %Y", "%m/%d/%Y", "%d/%m/%Y")
-    for fmt in formats:
-        try:
-            return datetime.strptime(str(value), fmt)
-        except Exception:
-            continue
-    # last resort: try numeric timestamp
-    try:
-        ts = float(value)
-        return datetime.fromtimestamp(ts)
-    except Exception:
-        return None
+    return dates.parse_date(value)
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    """Read a field from a pydantic model or a dict."""
+    value = getattr(obj, name, None)
+    if value is None and isinstance(obj, dict):
+        value = obj.get(name)
+    return default if value is None else value
+
+def _build_record(extracted_data: ExtractedData, source_file_path: Optional[str] = None):
+    """Normalize extracted data into (model class, column values) for insertion."""
+    # normalize products to list of dicts
+    products = _field(extracted_data, "products", [])
+    products_json = json.dumps([p.dict() if hasattr(p, "dict") else p for p in products])
+
+    # normalize doc_type and common fields
+    doc_type = str(_field(extracted_data, "document_type", "")).lower()
+    if doc_type == "invoice":
+        model = InvoiceModel
+    elif doc_type == "receipt":
+        model = ReceiptModel
+    else:
+        raise ValueError(f"Unknown document_type: {doc_type}")
+
+    vendor_name = _field(extracted_data, "vendor_name")
+    parsed = dates.get_normalizer().parse(_field(extracted_data, "date"), vendor=vendor_name)
+    if parsed.ambiguous:
+        dates.report_ambiguous(_field(extracted_data, "date"), vendor_name, parsed, document_type=doc_type)
+    parsed_date = parsed.value
+    values = dict(
+        vendor_name=vendor_name,
+        amount=_field(extracted_data, "amount"),
+        products=products_json,
+        total_amount=_field(extracted_data, "total_amount"),
+        date=parsed_date if parsed_date is not None else datetime.now(),
+        file_path=source_file_path
+    )
+    return model, doc_type, values
 
 def processing_agent(extracted_data: ExtractedData, source_file_path: Optional[str] = None) -> dict:
     """Process and validate extracted data, then save to database."""
     db = SessionLocal()
     try:
-        # normalize products to list of dicts
-        if hasattr(extracted_data, "products"):
-            products = extracted_data.products
-        else:
-            products = extracted_data.get("products", [])
-        products_json = json.dumps([p.dict() if hasattr(p, "dict") else p for p in products])
-
-        # normalize doc_type and common fields
-        doc_type = (getattr(extracted_data, "document_type", None)
-                    or extracted_data.get("document_type", "")).lower()
-
-        vendor = getattr(extracted_data, "vendor_name", None) or extracted_data.get("vendor_name")
-        amount = getattr(extracted_data, "amount", None) or extracted_data.get("amount")
-        total_amount = getattr(extracted_data, "total_amount", None) or extracted_data.get("total_amount")
-        raw_date = getattr(extracted_data, "date", None) or extracted_data.get("date")
-        parsed_date = _parse_date(raw_date)
-
-        common_kwargs = dict(
-            vendor_name=vendor,
-            amount=amount,
-            products=products_json,
-            total_amount=total_amount,
-            date=parsed_date if parsed_date is not None else datetime.now(),
-            file_path=source_file_path
-        )
-
-        if doc_type == "invoice":
-            record = InvoiceModel(**common_kwargs)
-        elif doc_type == "receipt":
-            record = ReceiptModel(**common_kwargs)
-        else:
-            return {"status": "error", "message": f"Unknown document_type: {doc_type}"}
-
-        db.add(record)
-        db.commit()
-        db.refresh(record)
+        try:
+            model, doc_type, values = _build_record(extracted_data, source_file_path)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+
+        with metrics.span("db_commit"):
+            record = model(**values)
+            db.add(record)
+            db.flush()
+            items = line_item_rows(doc_type, record.id, values)
+            if items:
+                db.execute(insert(LineItemModel), items)
+            db.commit()
+            db.refresh(record)
+        metrics.inc("db_rows_total", document_type=doc_type)
         return {"status": "success", "type": doc_type, "id": record.id}
 
     except Exception as e:
         db.rollback()
         return {"status": "error", "message": str(e)}
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+class BulkWriter:
+    """
+    Buffer extracted records and insert them in batched transactions.
+
+    Rows are grouped per table and written with one multi-row INSERT ... RETURNING
+    per group, so a flush of N documents costs one commit instead of N. If a
+    batch fails, its rows are retried one by one inside savepoints so only the
+    bad rows are reported as errors.
+
+    add() returns the results of any flush it triggered; every result is a
+    (tag, {"status": ..., ...}) pair using the same dicts as processing_agent.
+    """
+
+    def __init__(self, flush_size: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.flush_size = flush_size or int(os.getenv("DB_FLUSH_SIZE", "200"))
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv("DB_FLUSH_INTERVAL", "2.0"))
+        self._pending: List[Tuple[Any, Any, str, dict]] = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, extracted_data: ExtractedData, source_file_path: Optional[str] = None,
+            tag: Any = None) -> List[Tuple[Any, dict]]:
+        try:
+            model, doc_type, values = _build_record(extracted_data, source_file_path)
+        except Exception as e:
+            return [(tag, {"status": "error", "message": str(e)})] + self.maybe_flush()
+        self._pending.append((tag, model, doc_type, values))
+        if len(self._pending) >= self.flush_size:
+            return self.flush()
+        return self.maybe_flush()
+
+    def maybe_flush(self) -> List[Tuple[Any, dict]]:
+        """Flush if the buffer is non-empty and flush_interval has passed."""
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[Any, dict]]:
+        pending, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if not pending:
+            return []
+        db = SessionLocal()
+        try:
+            with metrics.span("db_commit", mode="bulk"):
+                try:
+                    results = self._insert_batches(db, pending)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    results = self._insert_one_by_one(db, pending)
+                    db.commit()
+            for _, result in results:
+                if result["status"] == "success":
+                    metrics.inc("db_rows_total", document_type=result["type"])
+            return results
+        except Exception as e:
+            db.rollback()
+            return [(tag, {"status": "error", "message": str(e)}) for tag, _, _, _ in pending]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _insert_batches(db, pending) -> List[Tuple[Any, dict]]:
+        results: List[Tuple[Any, dict]] = []
+        for model in (InvoiceModel, ReceiptModel):
+            group = [item for item in pending if item[1] is model]
+            if not group:
+                continue
+            stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+            ids = db.execute(stmt, [values for _, _, _, values in group]).scalars().all()
+            items = []
+            for (tag, _, doc_type, values), record_id in zip(group, ids):
+                items.extend(line_item_rows(doc_type, record_id, values))
+                results.append((tag, {"status": "success", "type": doc_type, "id": record_id}))
+            if items:
+                db.execute(insert(LineItemModel), items)
+        return results
+
+    @staticmethod
+    def _insert_one_by_one(db, pending) -> List[Tuple[Any, dict]]:
+        results: List[Tuple[Any, dict]] = []
+        for tag, model, doc_type, values in pending:
+            savepoint = db.begin_nested()
+            try:
+                record_id = db.execute(insert(model).returning(model.id), values).scalar_one()
+                items = line_item_rows(doc_type, record_id, values)
+                if items:
+                    db.execute(insert(LineItemModel), items)
+                savepoint.commit()
+                results.append((tag, {"status": "success", "type": doc_type, "id": record_id}))
+            except Exception as e:
+                savepoint.rollback()
+                results.append((tag, {"status": "error", "message": str(e)}))
+        return results
+
+def bulk_processing_agent(items: Iterable[Tuple[ExtractedData, Optional[str]]],
+                          flush_size: Optional[int] = None) -> List[dict]:
+    """Save many (extracted_data, source_file_path) pairs; results come back in input order."""
+    writer = BulkWriter(flush_size=flush_size, flush_interval=float("inf"))
+    results: List[Tuple[Any, dict]] = []
+    for index, (extracted_data, source_file_path) in enumerate(items):
+        results.extend(writer.add(extracted_data, source_file_path, tag=index))
+    results.extend(writer.flush())
+    return [result for _, result in sorted(results, key=lambda item: item[0])]
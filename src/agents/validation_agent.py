@@ -0,0 +1,324 @@
+"""
+Arithmetic validation between extraction_agent and processing_agent.
+
+Every extracted document is reconciled before it is saved:
+
+- each line: quantity x unit price = line total
+- the line totals add up to ``amount`` (the subtotal) or to ``total_amount``
+  (tax-inclusive receipts)
+- ``total_amount`` - ``amount`` is a plausible tax: between 0 and
+  VALIDATION_MAX_TAX_RATE of the subtotal
+- totals are positive and a date was found
+
+all within VALIDATION_TOLERANCE (relative, with a 0.02 floor for rounding).
+``validate_many`` checks a whole batch at once on flattened NumPy arrays of
+every line item; ``validate`` is the one-document form. Each failed check
+lowers a 0..1 confidence score.
+
+Documents under VALIDATION_MIN_CONFIDENCE get one targeted re-extraction with
+VALIDATION_RETRY_MODEL: only the fields that failed are re-asked, with what
+did not add up, so the cheap model does the bulk of the work and the stronger
+one only sees the few documents that fail. If the result still does not
+reconcile, the document goes to the review queue (``review_queue`` table):
+
+    VALIDATION_REVIEW=hold   keep it out of invoices/receipts until approved
+    VALIDATION_REVIEW=flag   save it anyway and queue it for a look
+
+A document whose numbers reconcile but whose date reads both as dd/mm and
+mm/dd (``date_ambiguous``, see src.utils.dates) is saved in the default
+order and queued for a look, whatever VALIDATION_REVIEW says.
+
+    python -m src.agents.validation_agent list
+    python -m src.agents.validation_agent approve <id>     # saves a held document
+    python -m src.agents.validation_agent reject <id>
+
+    VALIDATION=1                      set to 0 to skip the checks
+    VALIDATION_MIN_CONFIDENCE=0.8
+    VALIDATION_RETRY_MODEL=gpt-4o     empty: no re-extraction, straight to review
+    VALIDATION_TOLERANCE=0.01
+    VALIDATION_MAX_TAX_RATE=0.3
+"""
+import argparse
+import os
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src.utils import metrics
+
+ABS_TOLERANCE = 0.02  # rounding of printed amounts
+# confidence lost per failed check
+PENALTIES = {"line": 0.25, "line_share": 0.25, "subtotal": 0.35, "tax": 0.15, "total": 0.3, "date": 0.05}
+
+
+class Validation(NamedTuple):
+    confidence: float
+    issues: List[str]  # human-readable, for logs and the review queue
+    problems: Dict[str, str]  # field path -> what is wrong, for a targeted re-ask
+
+    @property
+    def passed(self) -> bool:
+        return self.confidence >= min_confidence()
+
+
+def enabled() -> bool:
+    return os.getenv("VALIDATION", "1").lower() not in ("0", "false", "no", "off")
+
+
+def min_confidence() -> float:
+    return float(os.getenv("VALIDATION_MIN_CONFIDENCE", "0.8"))
+
+
+def retry_model() -> str:
+    return os.getenv("VALIDATION_RETRY_MODEL", "gpt-4o")
+
+
+def review_mode() -> str:
+    mode = os.getenv("VALIDATION_REVIEW", "hold").lower()
+    return mode if mode in ("hold", "flag") else "hold"
+
+
+def _tolerance() -> float:
+    return float(os.getenv("VALIDATION_TOLERANCE", "0.01"))
+
+
+def _field(obj: Any, name: str) -> Any:
+    """A field of a pydantic model or a dict (products included)."""
+    value = getattr(obj, name, None)
+    if value is None and isinstance(obj, dict):
+        value = obj.get(name)
+    return value
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _close(actual: np.ndarray, expected: np.ndarray, rel: float) -> np.ndarray:
+    """Elementwise |actual - expected| within tolerance; NaN (a missing value) never is."""
+    return np.abs(actual - expected) <= np.maximum(ABS_TOLERANCE, rel * np.abs(expected))
+
+
+def validate_many(documents: List[Any]) -> List[Validation]:
+    """Reconcile the numbers of many extracted documents (ExtractedData or dicts) in one pass."""
+    n = len(documents)
+    if not n:
+        return []
+    rel = _tolerance()
+    max_tax = float(os.getenv("VALIDATION_MAX_TAX_RATE", "0.3"))
+
+    amount = np.array([_number(_field(d, "amount")) for d in documents])
+    total = np.array([_number(_field(d, "total_amount")) for d in documents])
+    has_date = np.array([_field(d, "date") is not None for d in documents])
+    owner, lines = [], []
+    for index, document in enumerate(documents):
+        for product in _field(document, "products") or []:
+            owner.append(index)
+            lines.append((_number(_field(product, "quantity")), _number(_field(product, "unit_price")),
+                          _number(_field(product, "total"))))
+    owner = np.array(owner, dtype=np.int64)
+    quantity, unit_price, line_total = np.array(lines, dtype=np.float64).reshape(-1, 3).T
+
+    # per line: quantity x unit price = total (allowing the unit price to be rounded to the cent)
+    expected = quantity * unit_price
+    line_ok = _close(line_total, expected, rel) | (np.abs(line_total - expected) <= 0.005 * np.abs(quantity))
+    line_count = np.bincount(owner, minlength=n)
+    bad_lines = np.bincount(owner, weights=(~line_ok).astype(np.float64), minlength=n)
+    line_sum = np.bincount(owner, weights=np.nan_to_num(line_total), minlength=n)
+
+    # per document: lines add up to the subtotal or the total, tax is plausible, totals positive
+    subtotal_ok = (line_count == 0) | _close(line_sum, amount, rel) | _close(line_sum, total, rel)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tax_rate = (total - amount) / amount
+    tax_ok = (amount <= 0) | _close(total, amount, rel) | ((tax_rate >= 0) & (tax_rate <= max_tax))
+    total_ok = (total > 0) & (amount > 0)
+
+    penalty = (
+        np.where(bad_lines > 0, PENALTIES["line"] + PENALTIES["line_share"] * bad_lines / np.maximum(line_count, 1), 0)
+        + np.where(subtotal_ok, 0, PENALTIES["subtotal"])
+        + np.where(tax_ok, 0, PENALTIES["tax"])
+        + np.where(total_ok, 0, PENALTIES["total"])
+        + np.where(has_date, 0, PENALTIES["date"])
+    )
+    confidence = np.clip(1.0 - penalty, 0.0, 1.0).round(3)
+
+    # messages only for what failed (a few documents out of many)
+    issues: List[List[str]] = [[] for _ in range(n)]
+    problems: List[Dict[str, str]] = [{} for _ in range(n)]
+    first_line = np.concatenate(([0], np.cumsum(line_count)[:-1]))
+    for position in np.flatnonzero(~line_ok):
+        index = int(owner[position])
+        line = int(position - first_line[index])
+        text = (f"line {line + 1}: {quantity[position]:g} x {unit_price[position]:.2f} = "
+                f"{expected[position]:.2f}, but the line total is {line_total[position]:.2f}")
+        issues[index].append(text)
+        problems[index][f"products[{line}]"] = text
+    for index in np.flatnonzero(~subtotal_ok):
+        text = (f"line totals add up to {line_sum[index]:.2f}, but amount is {amount[index]:.2f} "
+                f"and total_amount is {total[index]:.2f}")
+        issues[index].append(text)
+        problems[index]["amount"] = text
+        problems[index]["products"] = text
+    for index in np.flatnonzero(~tax_ok):
+        text = f"total_amount {total[index]:.2f} vs amount {amount[index]:.2f} implies a tax rate of {tax_rate[index]:.0%}"
+        issues[index].append(text)
+        problems[index]["total_amount"] = text
+    for index in np.flatnonzero(~total_ok):
+        text = f"amount {amount[index]:.2f} / total_amount {total[index]:.2f} should be positive"
+        issues[index].append(text)
+        problems[index].setdefault("total_amount", text)
+    for index in np.flatnonzero(~has_date):
+        issues[index].append("no date")
+    return [Validation(float(confidence[i]), issues[i], problems[i]) for i in range(n)]
+
+
+def validate(extracted_data: Any) -> Validation:
+    return validate_many([extracted_data])[0]
+
+
+def _re_extract(extracted_data: Any, check: Validation, document_text: str, document_type: str) -> Any:
+    """Re-ask the stronger model for just the fields that failed; the repaired, validated result."""
+    from src.extractors import results
+    from src.utils.compaction import compact_for_llm
+
+    if not isinstance(document_text, str):
+        document_text = compact_for_llm(document_text, document_type)  # spilled to disk
+    data = results.as_cache_entry(extracted_data) if hasattr(extracted_data, "dict") else dict(extracted_data)
+    # problems on single lines are fixed by re-reading the products list
+    problems = {("products" if path.startswith("products[") else path): text for path, text in check.problems.items()}
+    merged = dict(data)
+    merged.update(results.reask(document_text, document_type, data, problems, model=retry_model()))
+    return results.finalize(merged, document_type)
+
+
+def validation_agent(extracted_data: Any, document_text: Optional[str], document_type: str,
+                     check: Optional[Validation] = None) -> Tuple[Any, Validation]:
+    """
+    Check an extraction and, when it does not reconcile, try once with the
+    stronger model. Returns the better of the two results and its Validation;
+    the caller sends documents that still fail (``not check.passed``) to review.
+    Pass ``check`` when the document was already validated with validate_many.
+    """
+    if not enabled():
+        return extracted_data, Validation(1.0, [], {})
+    if check is None:
+        with metrics.span("reconcile", document_type=document_type):
+            check = validate(extracted_data)
+    if check.passed:
+        metrics.inc("documents_validated_total", document_type=document_type, result="passed")
+        return extracted_data, check
+    print(f"⚠️ Numbers do not reconcile (confidence {check.confidence:.2f}): {'; '.join(check.issues)}")
+    if retry_model() and document_text and check.problems:
+        try:
+            retried = _re_extract(extracted_data, check, document_text, document_type)
+            retry_check = validate(retried)
+        except Exception as e:
+            print(f"⚠️ Re-extraction with {retry_model()} failed: {e}")
+        else:
+            if retry_check.confidence > check.confidence:
+                extracted_data, check = retried, retry_check
+            if check.passed:
+                print(f"✅ Re-extracted with {retry_model()} (confidence {check.confidence:.2f})")
+                metrics.inc("documents_validated_total", document_type=document_type, result="retried")
+                return extracted_data, check
+    metrics.inc("documents_validated_total", document_type=document_type, result="review")
+    return extracted_data, check
+
+
+def date_review(extracted_data: Any, check: Optional[Validation] = None) -> Optional[Validation]:
+    """`check` plus an issue for a date that reads both as dd/mm and mm/dd; None if the date is not ambiguous."""
+    date = _field(extracted_data, "date")
+    if not enabled() or not _field(extracted_data, "date_ambiguous") or not isinstance(date, datetime):
+        return None
+    check = check or Validation(1.0, [], {})
+    issue = f"date {date:%Y-%m-%d} could also be {date.year}-{date.day:02d}-{date.month:02d} (day/month order)"
+    return Validation(check.confidence, check.issues + [issue], dict(check.problems, date="ambiguous day/month order"))
+
+
+# --- review queue --------------------------------------------------------------
+
+def review_rows(items: List[Tuple[Any, Validation, str, Optional[str], Optional[int]]]) -> List[Any]:
+    """ReviewItemModel rows for (extracted data, validation, document type, file path, record id) tuples."""
+    from src.database.models import ReviewItemModel
+    from src.extractors import results
+
+    rows = []
+    for extracted_data, check, document_type, file_path, record_id in items:
+        data = results.as_cache_entry(extracted_data) if hasattr(extracted_data, "dict") else dict(extracted_data)
+        data["document_type"] = document_type
+        rows.append(ReviewItemModel(document_type=document_type, record_id=record_id, file_path=file_path,
+                                    data=data, confidence=check.confidence, issues=check.issues))
+    return rows
+
+
+def queue_for_review(items: List[Tuple[Any, Validation, str, Optional[str], Optional[int]]]) -> List[int]:
+    """Add documents to the review queue in one transaction; returns their review ids."""
+    from src.database.connection import SessionLocal
+
+    if not items:
+        return []
+    with SessionLocal() as db:
+        rows = review_rows(items)
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+
+
+def resolve(review_id: int, approve: bool) -> Dict[str, Any]:
+    """Approve (saving a held document) or reject a review item."""
+    from src.agents.processing_agent import processing_agent
+    from src.database.connection import SessionLocal
+    from src.database.models import ReviewItemModel
+
+    with SessionLocal() as db:
+        item = db.get(ReviewItemModel, review_id)
+        if item is None or item.status != "open":
+            return {"status": "error", "message": f"No open review item {review_id}"}
+        result: Dict[str, Any] = {"status": "success", "review_id": review_id}
+        if approve and item.record_id is None:
+            saved = processing_agent(dict(item.data), source_file_path=item.file_path)
+            if saved.get("status") != "success":
+                return saved
+            item.record_id = saved["id"]
+            result["id"] = saved["id"]
+        item.status = "approved" if approve else "rejected"
+        item.resolved_at = datetime.now()
+        db.commit()
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from sqlalchemy import select
+
+    from src.database.connection import SessionLocal, init_db
+    from src.database.models import ReviewItemModel
+
+    parser = argparse.ArgumentParser(description="Documents whose numbers did not reconcile.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="open review items")
+    listing.add_argument("--limit", type=int, default=50)
+    for name in ("approve", "reject"):
+        commands.add_parser(name).add_argument("review_id", type=int)
+    args = parser.parse_args(argv)
+    init_db()
+
+    if args.command == "list":
+        with SessionLocal() as db:
+            rows = db.execute(select(ReviewItemModel).where(ReviewItemModel.status == "open")
+                              .order_by(ReviewItemModel.id).limit(args.limit)).scalars().all()
+        for row in rows:
+            saved = f"saved as #{row.record_id}" if row.record_id else "held"
+            print(f"#{row.id} {row.document_type} {row.data.get('vendor_name')} "
+                  f"{row.data.get('total_amount')} confidence {row.confidence:.2f} ({saved}): {'; '.join(row.issues)}")
+        return 0
+    result = resolve(args.review_id, approve=args.command == "approve")
+    print(result)
+    return 0 if result.get("status") == "success" else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
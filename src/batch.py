@@ -0,0 +1,528 @@
+"""
+Batch ingestion: run many documents through the pipeline in one process.
+
+The stages are connected by bounded queues, so a slow stage pushes back on
+the stages in front of it instead of piling work up in memory:
+
+    files -> [process pool: text extraction; OCR in a limited child process, see src.utils.limits]
+          -> [threads: extraction_agent (LLM), validation_agent]
+          -> [single DB writer: batched inserts via BulkWriter]
+
+Usage:
+    python -m src.batch <directory|glob|manifest> [invoice|receipt|auto] [options]
+
+A manifest is a .txt/.csv/.lst file with one document per line, either
+``path`` or ``path,document_type``. With document type ``auto`` each file is
+classified locally and multi-document scans are split (src.extractors.classifier);
+every document found becomes its own job for the LLM workers.
+A document over its page/pixel/time/memory limits is reported as an error
+and the run carries on. Relative paths are resolved against the
+manifest's directory and lines starting with ``#`` are ignored.
+
+Each batch of extractions is reconciled in one vectorized pass
+(src.agents.validation_agent); documents that still do not add up after the
+targeted retry are reported as ``review`` and, with VALIDATION_REVIEW=hold,
+are not saved until approved.
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.main import bootstrap, store_upload, _get_field
+from src.agents.extraction_agent import extraction_agent, extraction_agent_many
+from src.agents.processing_agent import BulkWriter
+from src.agents import validation_agent as validation
+from src.extractors import batch_extractor, templates
+from src.extractors.classifier import segment_document
+from src.llm.client import estimate_tokens
+from src.utils import dedup, metrics
+from src.utils.cache import get_cache
+from src.utils.helpers import SUPPORTED_EXTENSIONS, extract_document_text
+
+MANIFEST_EXTENSIONS = (".txt", ".csv", ".lst")
+
+_DONE = object()  # end-of-stream marker passed between stages
+
+
+def _read_manifest(manifest_path: str, default_type: str) -> List[Tuple[str, str]]:
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    documents = []
+    with open(manifest_path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path, _, doc_type = line.partition(",")
+            path = path.strip()
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            documents.append((path, doc_type.strip() or default_type))
+    return documents
+
+
+def collect_documents(source: str, document_type: str = "invoice") -> List[Tuple[str, str]]:
+    """Resolve a directory, glob pattern or manifest file to (path, document_type) pairs."""
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, files in os.walk(source)
+            for name in files
+            if name.lower().endswith(SUPPORTED_EXTENSIONS)
+        )
+        return [(p, document_type) for p in paths]
+    if os.path.isfile(source) and source.lower().endswith(MANIFEST_EXTENSIONS):
+        return _read_manifest(source, document_type)
+    paths = sorted(glob.glob(source, recursive=True))
+    return [(p, document_type) for p in paths if p.lower().endswith(SUPPORTED_EXTENSIONS)]
+
+
+class _SeenInBatch:
+    """
+    Fingerprints of documents accepted earlier in this run. They are only
+    registered in the DB once their rows are written, so duplicates inside one
+    batch have to be caught here.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = set()
+        self._phashes: List[int] = []
+        self._contents = set()
+
+    def file_seen(self, file_hash: str, phash: Optional[int]) -> Optional[str]:
+        with self._lock:
+            if file_hash in self._files:
+                return "file (same batch)"
+            if phash is not None and any(
+                dedup.phash_distance(phash, other) <= dedup.PHASH_MAX_DISTANCE for other in self._phashes
+            ):
+                return "image (same batch)"
+            self._files.add(file_hash)
+            if phash is not None:
+                self._phashes.append(phash)
+            return None
+
+    def content_seen(self, content_fp: Optional[str]) -> bool:
+        if not content_fp:
+            return False
+        with self._lock:
+            if content_fp in self._contents:
+                return True
+            self._contents.add(content_fp)
+            return False
+
+
+class BatchReport:
+    """Thread-safe collector for per-file results."""
+
+    def __init__(self, on_result: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self._lock = threading.Lock()
+        self._on_result = on_result
+        self.results: List[Dict[str, Any]] = []
+        self.elapsed = 0.0
+
+    def add(self, job: Dict[str, Any], status: str, stage: str, **fields) -> None:
+        result = {
+            "file": job["file"],
+            "document_type": job["document_type"],
+            "status": status,
+            "stage": stage,
+            "seconds": round(time.perf_counter() - job["started"], 3),
+        }
+        if "pages" in job:
+            result["pages"] = job["pages"]
+        result.update(fields)
+        metrics.inc("documents_total", document_type=job["document_type"], status=status)
+        with self._lock:
+            self.results.append(result)
+            if self._on_result:
+                self._on_result(result)
+
+    def error(self, job: Dict[str, Any], stage: str, exc: Exception) -> None:
+        self.add(job, "error", stage, message=str(exc))
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {"total": len(self.results)}
+            for r in self.results:
+                counts[r["status"]] = counts.get(r["status"], 0) + 1
+            return counts
+
+
+def _extract_in_worker(path: str):
+    """Process-pool task: extract text and ship this task's metrics back to the parent."""
+    metrics.reset()
+    text = extract_document_text(path)
+    return text, metrics.snapshot()
+
+
+def _drain_text_futures(pending, text_q, report, cache, return_when=FIRST_COMPLETED) -> None:
+    done, _ = wait(list(pending), return_when=return_when)
+    for future in done:
+        job = pending.pop(future)
+        try:
+            job["text"], worker_metrics = future.result()
+        except Exception as e:
+            metrics.inc("stage_errors_total", stage="text")
+            report.error(job, "text", e)
+            continue
+        metrics.merge(worker_metrics)
+        if cache is not None and isinstance(job["text"], str):
+            cache.put_text(job["file_hash"], job["text"])
+        _queue_text(job, text_q)  # blocks while the LLM stage is saturated
+
+
+def _queue_text(job, text_q) -> None:
+    """Hand a job to the LLM workers; an "auto" job becomes one job per document found in its text."""
+    if job["document_type"] != "auto":
+        text_q.put(job)
+        return
+    with metrics.span("classify"):
+        segments = segment_document(job.pop("text"))
+    for segment in segments:
+        part = dict(job, text=segment.text, document_type=segment.document_type)
+        if len(segments) > 1:
+            part["pages"] = [segment.first_page, segment.last_page]
+        text_q.put(part)
+
+
+def _text_stage(jobs, text_q, report, seen, workers: int, window: int, llm_workers: int) -> None:
+    """Store uploads and extract text in a process pool, at most `window` files in flight."""
+    cache = get_cache()
+    mode = dedup.policy()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for job in jobs:
+                try:
+                    job["file_hash"], job["phash"], job["duplicate"] = dedup.check_file(
+                        job["file"], job["document_type"])
+                    if job["duplicate"] and mode in ("skip", "link"):
+                        _report_duplicate(report, job, mode, job["file"])
+                        continue
+                    reason = seen.file_seen(job["file_hash"], job["phash"]) if mode in ("skip", "link") else None
+                    if reason:
+                        report.add(job, "duplicate", "dedup", id=None, action="skip", reason=reason)
+                        continue
+                    job["stored_path"] = store_upload(job["file"], job["file_hash"])
+                    if cache is not None:
+                        job["text"] = cache.get_text(job["file_hash"])
+                except Exception as e:
+                    report.error(job, "store", e)
+                    continue
+                if job.get("text") is not None:
+                    _queue_text(job, text_q)  # cached: skip the pool entirely
+                    continue
+                pending[pool.submit(_extract_in_worker, job["stored_path"])] = job
+                while len(pending) >= window:
+                    _drain_text_futures(pending, text_q, report, cache)
+            while pending:
+                _drain_text_futures(pending, text_q, report, cache)
+    finally:
+        for _ in range(llm_workers):
+            text_q.put(_DONE)
+
+
+def _report_duplicate(report, job, mode: str, file_path: str, content_fp: Optional[str] = None) -> None:
+    result = dedup.resolve_duplicate(job["duplicate"], mode, job["file_hash"], job["document_type"],
+                                     file_path=file_path, phash=job["phash"], content_fp=content_fp)
+    report.add(job, "duplicate", "dedup", id=result["id"], action=mode, reason=result["reason"])
+
+
+def _next_jobs(text_q, batch_tokens: int, max_docs: int):
+    """
+    One job, or, when prompt batching is on, as many as are ready (up to the
+    token budget) so they can share LLM requests. Returns (jobs, finished).
+    """
+    job = text_q.get()
+    if job is _DONE:
+        return [], True
+    jobs = [job]
+    tokens = estimate_tokens(job["text"])
+    while batch_tokens and len(jobs) < max_docs and tokens < batch_tokens:
+        try:
+            job = text_q.get(timeout=0.05)
+        except queue.Empty:
+            break
+        if job is _DONE:
+            return jobs, True
+        jobs.append(job)
+        tokens += estimate_tokens(job["text"])
+    return jobs, False
+
+
+def _extract_jobs(jobs) -> None:
+    """Fill job["data"] (or job["error"]) for each job, batching LLM calls per document type."""
+    if len(jobs) == 1:
+        job = jobs[0]
+        try:
+            job["data"] = extraction_agent(job["text"], job["document_type"])
+        except Exception as e:
+            job["error"] = e
+        return
+    by_type: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        by_type.setdefault(job["document_type"], []).append(job)
+    for doc_type, group in by_type.items():
+        try:
+            results = extraction_agent_many([j["text"] for j in group], doc_type)
+        except Exception as e:
+            results = [e] * len(group)
+        for job, result in zip(group, results):
+            job["error" if isinstance(result, Exception) else "data"] = result
+
+
+def _validate_jobs(jobs) -> None:
+    """Reconcile every extracted job at once; retry the failures and mark the ones left for review."""
+    done = [job for job in jobs if "data" in job]
+    if done and validation.enabled():
+        with metrics.span("reconcile", document_type="batch"):
+            checks = validation.validate_many([job["data"] for job in done])
+        for job, check in zip(done, checks):
+            try:
+                job["data"], check = validation.validation_agent(job["data"], job["text"], job["document_type"], check)
+            except Exception as e:
+                job["error"] = e
+                continue
+            if not check.passed:
+                job["review"] = check
+    for job in jobs:
+        text = job.pop("text", None)
+        if ("data" in job and "review" not in job and isinstance(text, str) and templates.enabled()
+                and not getattr(job["data"], "_from_template", False)):
+            job["template_text"] = text  # learned from by the writer once saved
+
+
+def _extraction_worker(text_q, data_q, report, seen, llm_batch: bool = False) -> None:
+    mode = dedup.policy()
+    batch_tokens = batch_extractor.token_budget() if llm_batch else 0
+    max_docs = batch_extractor.max_docs()
+    finished = False
+    while not finished:
+        jobs, finished = _next_jobs(text_q, batch_tokens, max_docs)
+        _extract_jobs(jobs)
+        _validate_jobs(jobs)
+        for job in jobs:
+            try:
+                if "error" in job:
+                    raise job.pop("error")
+                job["content_fp"] = dedup.content_fingerprint(job["data"])
+                if job["duplicate"] is None and mode != "off":
+                    job["duplicate"] = dedup.find_content_duplicate(job["content_fp"], job["document_type"])
+                    if job["duplicate"] and mode in ("skip", "link"):
+                        _report_duplicate(report, job, mode, job["stored_path"], job["content_fp"])
+                        continue
+                    if mode in ("skip", "link") and seen.content_seen(job["content_fp"]):
+                        report.add(job, "duplicate", "dedup", id=None, action="skip",
+                                   reason="content (same batch)")
+                        continue
+            except Exception as e:
+                report.error(job, "extract", e)
+                continue
+            data_q.put(job)
+    data_q.put(_DONE)
+
+
+def _report_saved(report, saved) -> None:
+    """Report flushed rows and store the fingerprints and review items of the new records in one transaction each."""
+    fingerprints, reviews = [], []
+    for job, result in saved:
+        if result.get("status") != "success":
+            report.add(job, "error", "save", message=result.get("message"))
+            continue
+        data, duplicate = job["data"], job["duplicate"]
+        fingerprints.append(dedup.fingerprint_row(
+            job["file_hash"], job["document_type"], record_id=result["id"],
+            file_path=job["stored_path"], phash=job["phash"], content_fp=job["content_fp"],
+            status="flagged" if duplicate else "unique",
+            duplicate_of=duplicate["fingerprint_id"] if duplicate else None,
+        ))
+        review = validation.date_review(data, job.get("review")) or job.get("review")
+        if review is not None:
+            reviews.append((data, review, job["document_type"], job["stored_path"], result["id"]))
+        elif "template_text" in job:
+            templates.learn_validated(job.pop("template_text"), data, job["document_type"])
+        report.add(
+            job, "success", "save",
+            id=result.get("id"),
+            vendor_name=_get_field(data, "vendor_name"),
+            total_amount=_get_field(data, "total_amount"),
+            **({"duplicate_of": duplicate["record_id"]} if duplicate else {}),
+            **({"confidence": review.confidence} if review is not None else {}),
+            **({"date_ambiguous": True} if _get_field(data, "date_ambiguous") else {}),
+        )
+    try:
+        dedup.register_many(fingerprints)
+    except Exception as e:
+        print(f"⚠️ Failed to store duplicate-detection fingerprints: {e}")
+    try:
+        validation.queue_for_review(reviews)
+    except Exception as e:
+        print(f"⚠️ Failed to queue {len(reviews)} documents for review: {e}")
+    templates.flush_hits()
+
+
+def _hold_for_review(report, job) -> None:
+    """VALIDATION_REVIEW=hold: the document goes to the review queue instead of its table."""
+    check = validation.date_review(job["data"], job["review"]) or job["review"]
+    try:
+        review_id = validation.queue_for_review(
+            [(job["data"], check, job["document_type"], job["stored_path"], None)])[0]
+    except Exception as e:
+        report.error(job, "validate", e)
+        return
+    report.add(job, "review", "validate", review_id=review_id, confidence=check.confidence,
+               vendor_name=_get_field(job["data"], "vendor_name"), message="; ".join(check.issues))
+
+
+def _writer_stage(data_q, report, llm_workers: int, flush_size: Optional[int],
+                  flush_interval: Optional[float]) -> None:
+    """Single DB writer so SQLite never sees concurrent write transactions."""
+    writer = BulkWriter(flush_size=flush_size, flush_interval=flush_interval)
+    finished = 0
+    while finished < llm_workers:
+        try:
+            job = data_q.get(timeout=writer.flush_interval or None)
+        except queue.Empty:
+            saved = writer.maybe_flush()
+        else:
+            if job is _DONE:
+                finished += 1
+                continue
+            if "review" in job and validation.review_mode() == "hold":
+                _hold_for_review(report, job)
+                continue
+            saved = writer.add(job["data"], source_file_path=job["stored_path"], tag=job)
+        _report_saved(report, saved)
+    _report_saved(report, writer.flush())
+
+
+def run_batch(
+    documents: List[Tuple[str, str]],
+    ocr_workers: Optional[int] = None,
+    llm_workers: int = 4,
+    queue_size: int = 16,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    flush_size: Optional[int] = None,
+    flush_interval: Optional[float] = None,
+    llm_batch: bool = False,
+) -> BatchReport:
+    """
+    Run (path, document_type) pairs through text extraction, the LLM and the DB writer.
+    With llm_batch, documents waiting for the LLM are packed into shared requests.
+    """
+    bootstrap()
+    ocr_workers = ocr_workers or os.cpu_count() or 1
+    llm_workers = max(1, llm_workers)
+    report = BatchReport(on_result)
+    seen = _SeenInBatch()
+    started = time.perf_counter()
+    jobs = (
+        {"file": os.path.abspath(path), "document_type": doc_type, "started": time.perf_counter()}
+        for path, doc_type in documents
+    )
+
+    text_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    data_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+
+    text_thread = threading.Thread(
+        target=_text_stage,
+        args=(jobs, text_q, report, seen, ocr_workers, ocr_workers * 2, llm_workers),
+        name="batch-text",
+        daemon=True,
+    )
+    extract_threads = [
+        threading.Thread(target=_extraction_worker, args=(text_q, data_q, report, seen, llm_batch),
+                         name=f"batch-llm-{i}", daemon=True)
+        for i in range(llm_workers)
+    ]
+    text_thread.start()
+    for t in extract_threads:
+        t.start()
+
+    _writer_stage(data_q, report, llm_workers, flush_size, flush_interval)
+
+    text_thread.join()
+    for t in extract_threads:
+        t.join()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    name = result["file"]
+    if "pages" in result:
+        name += f" (pages {result['pages'][0]}-{result['pages'][1]})"
+    if result["status"] == "success":
+        flagged = f", queued for review (confidence {result['confidence']:.2f})" if "confidence" in result else ""
+        flagged += " with an ambiguous date" if result.get("date_ambiguous") else ""
+        print(f"✅ {name} -> id={result['id']} "
+              f"({result['vendor_name']} - ${result['total_amount']}) in {result['seconds']}s{flagged}")
+    elif result["status"] == "duplicate":
+        print(f"⏭️ {name} duplicate of #{result['id']} ({result['reason']} match, {result['action']})")
+    elif result["status"] == "review":
+        print(f"⚠️ {name} held for review as #{result['review_id']} "
+              f"(confidence {result['confidence']:.2f}): {result['message']}")
+    else:
+        print(f"❌ {name} failed at {result['stage']}: {result.get('message')}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process many invoices/receipts in one run.")
+    parser.add_argument("source", help="directory, glob pattern or manifest file")
+    parser.add_argument("document_type", nargs="?", default="invoice",
+                        help="invoice, receipt or auto (manifest lines may override)")
+    parser.add_argument("--ocr-workers", type=int, default=None,
+                        help="processes for text extraction (default: CPU count)")
+    parser.add_argument("--llm-workers", type=int, default=4,
+                        help="concurrent LLM extraction calls")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="max documents buffered between stages")
+    parser.add_argument("--flush-size", type=int, default=None,
+                        help="rows per DB transaction (default: DB_FLUSH_SIZE or 200)")
+    parser.add_argument("--flush-interval", type=float, default=None,
+                        help="max seconds a row waits before being written (default: DB_FLUSH_INTERVAL or 2)")
+    parser.add_argument("--llm-batch", action="store_true",
+                        help="pack short documents into shared LLM requests (budget: LLM_BATCH_TOKENS)")
+    parser.add_argument("--report", help="write per-file results as JSON lines to this path")
+    args = parser.parse_args(argv)
+
+    metrics.start_exporters_from_env()
+    documents = collect_documents(args.source, args.document_type)
+    if not documents:
+        print(f"No documents found for: {args.source}")
+        return 1
+    print(f"Processing {len(documents)} documents...")
+
+    report = run_batch(
+        documents,
+        ocr_workers=args.ocr_workers,
+        llm_workers=args.llm_workers,
+        queue_size=args.queue_size,
+        on_result=_print_result,
+        flush_size=args.flush_size,
+        flush_interval=args.flush_interval,
+        llm_batch=args.llm_batch,
+    )
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fh:
+            for result in report.results:
+                fh.write(json.dumps(result, default=str) + "\n")
+
+    summary = report.summary()
+    print(f"Done in {report.elapsed:.1f}s: {summary}")
+    cache = get_cache()
+    if cache is not None:
+        print(f"Cache: {cache.stats()}")
+    return 0 if summary.get("error", 0) == 0 else 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
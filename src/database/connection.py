@@ -1,16 +1,68 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from src.database.models import Base
 import os
+import threading
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invoices.db")
+# The engine is created on first use, not at import: DATABASE_URL may come
+# from .env, which is only loaded then (or by init_db / src.main.bootstrap).
+_engine = None
+_engine_lock = threading.Lock()
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _load_env() -> None:
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune SQLite for write throughput. WAL lets readers run during writes and,
+    with synchronous=NORMAL, fsyncs on checkpoint rather than every commit.
+    Set SQLITE_WAL=0 to keep the default rollback journal.
+    """
+    cursor = dbapi_connection.cursor()
+    if os.getenv("SQLITE_WAL", "1").lower() not in ("0", "false", "no", "off"):
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000'))}")
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', '65536'))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def get_engine():
+    """The process-wide engine, created from DATABASE_URL on first call."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _load_env()
+            engine = create_engine(os.getenv("DATABASE_URL", "sqlite:///./invoices.db"), echo=False, future=True)
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _set_sqlite_pragmas)
+            _engine = engine
+        return _engine
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker that binds to get_engine() when the first session is opened."""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+
+def __getattr__(name):
+    # `from src.database.connection import engine` still works, without creating it at import
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def init_db() -> None:
-    """Create database tables (call at startup)."""
-    Base.metadata.create_all(bind=engine)
+    """Load .env and create database tables (call at startup)."""
+    _load_env()
+    Base.metadata.create_all(bind=get_engine())
 
 def get_db():
     """Yield a DB session (use in contexts)."""
@@ -18,4 +70,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
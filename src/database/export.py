@@ -0,0 +1,232 @@
+"""
+Incremental export of invoices, receipts and their line items to Parquet or CSV.
+
+Each run only writes rows added since the previous run: the highest exported
+``id`` (and its ``created_at``) per document type is kept as a watermark in
+``_export_state.json`` inside the output directory. Rows are read in id order
+in chunks of EXPORT_CHUNK_ROWS with a keyset query on the primary key, so
+memory stays bounded however large the database is. The ``products`` JSON is
+flattened into one row per line item.
+
+Output is partitioned by the document's month (Hive style, readable by
+pandas/pyarrow/DuckDB/Spark as one dataset), and every run adds new part
+files instead of rewriting old ones:
+
+    exports/invoices/month=2024-03/part-20240401T020000-0.parquet
+    exports/invoice_items/month=2024-03/part-20240401T020000-0.parquet
+    exports/receipts/...   exports/receipt_items/...
+
+Files are written under a temporary name and renamed when the run finishes;
+the watermark only moves after that, so an interrupted run is simply redone.
+
+    python -m src.database.export exports/                  # Parquet (needs pyarrow)
+    python -m src.database.export exports/ --format csv
+    python -m src.database.export fresh/ --full             # ignore the watermark (use an empty directory)
+    python -m src.database.export exports/ --since 2024-01-01
+
+    EXPORT_CHUNK_ROWS=5000   documents read per query
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+from sqlalchemy import select
+
+from src.database.connection import SessionLocal
+from src.database.line_items import line_item_rows
+from src.database.models import InvoiceModel, ReceiptModel
+from src.utils import metrics
+
+MODELS = {"invoice": InvoiceModel, "receipt": ReceiptModel}
+STATE_FILE = "_export_state.json"
+FORMATS = ("parquet", "csv")
+
+DOCUMENT_COLUMNS = {
+    "id": "int64", "vendor_name": "string", "amount": "float64", "total_amount": "float64",
+    "date": "datetime64[us]", "created_at": "datetime64[us]", "file_path": "string", "item_count": "int64",
+}
+ITEM_COLUMNS = {
+    "document_id": "int64", "line": "int64", "vendor_name": "string", "date": "datetime64[us]",
+    "name": "string", "quantity": "float64", "unit_price": "float64", "total": "float64",
+}
+
+
+def chunk_rows() -> int:
+    return int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+
+def load_state(output_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_state(output_dir: str, state: Dict[str, Dict[str, Any]]) -> None:
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def iter_chunks(document_type: str, after_id: int = 0, since: Optional[datetime] = None,
+                size: Optional[int] = None) -> Iterator[List[Any]]:
+    """Rows with id > after_id (and created_at >= since), `size` at a time, in id order."""
+    model = MODELS[document_type]
+    size = size or chunk_rows()
+    while True:
+        stmt = select(model).where(model.id > after_id).order_by(model.id).limit(size)
+        if since is not None:
+            stmt = stmt.where(model.created_at >= since)
+        with SessionLocal() as db:
+            rows = db.execute(stmt).scalars().all()
+            db.expunge_all()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
+
+
+def frames(document_type: str, rows: List[Any]):
+    """(documents, line items) DataFrames for one chunk, with fixed dtypes so every chunk shares a schema."""
+    documents, items = [], []
+    for row in rows:
+        values = {"vendor_name": row.vendor_name, "date": row.date, "products": row.products}
+        lines = line_item_rows(document_type, row.id, values)
+        documents.append({
+            "id": row.id, "vendor_name": row.vendor_name, "amount": row.amount,
+            "total_amount": row.total_amount, "date": row.date, "created_at": row.created_at,
+            "file_path": row.file_path, "item_count": len(lines),
+        })
+        for n, line in enumerate(lines):
+            items.append({"document_id": row.id, "line": n, "vendor_name": line["vendor_name"],
+                          "date": line["date"], "name": line["name"], "quantity": line["quantity"],
+                          "unit_price": line["unit_price"], "total": line["total"]})
+    docs_df = pd.DataFrame.from_records(documents, columns=list(DOCUMENT_COLUMNS)).astype(DOCUMENT_COLUMNS)
+    items_df = pd.DataFrame.from_records(items, columns=list(ITEM_COLUMNS)).astype(ITEM_COLUMNS)
+    for df in (docs_df, items_df):
+        df["month"] = df["date"].dt.strftime("%Y-%m").fillna("unknown")
+    return docs_df, items_df
+
+
+class PartitionWriter:
+    """Appends DataFrame chunks to one temporary part file per partition; commit() renames them into place."""
+
+    def __init__(self, root: str, fmt: str, run_id: str):
+        self.root, self.fmt, self.run_id = root, fmt, run_id
+        self.open: Dict[str, Any] = {}  # partition -> (tmp path, final path, parquet writer or None)
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        for month, part in df.groupby("month", sort=False):
+            part = part.drop(columns="month")
+            if month not in self.open:
+                directory = os.path.join(self.root, f"month={month}")
+                os.makedirs(directory, exist_ok=True)
+                n = 0
+                while os.path.exists(os.path.join(directory, f"part-{self.run_id}-{n}.{self.fmt}")):
+                    n += 1  # two runs in the same second
+                final = os.path.join(directory, f"part-{self.run_id}-{n}.{self.fmt}")
+                # dot-prefixed so dataset readers skip it until it is renamed
+                self.open[month] = [os.path.join(directory, f".{os.path.basename(final)}.tmp"), final, None]
+            entry = self.open[month]
+            if self.fmt == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(part, preserve_index=False)
+                if entry[2] is None:
+                    entry[2] = pq.ParquetWriter(entry[0], table.schema, compression="snappy")
+                entry[2].write_table(table)  # one row group per chunk
+            else:
+                part.to_csv(entry[0], mode="a", header=not os.path.exists(entry[0]), index=False,
+                            date_format="%Y-%m-%dT%H:%M:%S")
+            self.rows += len(part)
+
+    def _close(self) -> None:
+        for entry in self.open.values():
+            if entry[2] is not None:
+                entry[2].close()
+                entry[2] = None
+
+    def commit(self) -> List[str]:
+        self._close()
+        for tmp, final, _ in self.open.values():
+            os.replace(tmp, final)
+        return [final for _, final, _ in self.open.values()]
+
+    def abort(self) -> None:
+        self._close()
+        for tmp, _, _ in self.open.values():
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def export(output_dir: str, fmt: str = "parquet", document_types=("invoice", "receipt"),
+           full: bool = False, since: Optional[datetime] = None, size: Optional[int] = None) -> Dict[str, Any]:
+    """Export rows added since the last run; returns per-type row counts and the new watermarks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), or use --format csv")
+    os.makedirs(output_dir, exist_ok=True)
+    state = {} if full else load_state(output_dir)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    summary: Dict[str, Any] = {}
+
+    for document_type in document_types:
+        mark = state.get(document_type, {})
+        writers = [PartitionWriter(os.path.join(output_dir, f"{document_type}s"), fmt, run_id),
+                   PartitionWriter(os.path.join(output_dir, f"{document_type}_items"), fmt, run_id)]
+        last = None
+        try:
+            for rows in iter_chunks(document_type, mark.get("last_id", 0), since, size):
+                docs_df, items_df = frames(document_type, rows)
+                writers[0].write(docs_df)
+                writers[1].write(items_df)
+                last = rows[-1]
+            files = writers[0].commit() + writers[1].commit()
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        if last is not None:
+            state[document_type] = {
+                "last_id": last.id,
+                "last_created_at": last.created_at.isoformat() if last.created_at else None,
+                "exported_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            save_state(output_dir, state)
+        metrics.inc("export_rows_total", writers[0].rows, document_type=document_type)
+        summary[document_type] = {"documents": writers[0].rows, "line_items": writers[1].rows,
+                                  "files": len(files), "watermark": state.get(document_type)}
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export new invoices/receipts to partitioned Parquet or CSV.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--types", nargs="+", choices=sorted(MODELS), default=sorted(MODELS))
+    parser.add_argument("--full", action="store_true", help="ignore the saved watermark")
+    parser.add_argument("--since", help="only rows created on/after YYYY-MM-DD")
+    parser.add_argument("--chunk-rows", type=int, help="rows per query (default EXPORT_CHUNK_ROWS)")
+    args = parser.parse_args(argv)
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    summary = export(args.output_dir, args.format, args.types, full=args.full, since=since,
+                     size=args.chunk_rows)
+    for document_type, stats in summary.items():
+        print(f"✅ {document_type}: {stats['documents']} documents, {stats['line_items']} line items "
+              f"in {stats['files']} files (watermark: {stats['watermark']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import json
+from typing import Any, Dict, List
+
+
+def decode_products(value: Any) -> List[Dict[str, Any]]:
+    """
+    Decode the products column into a list of dicts.
+
+    processing_agent stores a JSON string in a JSON column, so older rows hold
+    JSON-encoded JSON; keep decoding while the value is still a string.
+    """
+    for _ in range(3):
+        if not isinstance(value, str):
+            break
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    if not isinstance(value, list):
+        return []
+    return [p for p in value if isinstance(p, dict)]
+
+
+def _to_float(value: Any):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def line_item_rows(document_type: str, document_id: int, values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build line_items rows for one saved invoice/receipt from its column values."""
+    return [
+        dict(
+            document_type=document_type,
+            document_id=document_id,
+            vendor_name=values.get("vendor_name"),
+            date=values.get("date"),
+            name=str(p.get("name") or "")[:500],
+            quantity=_to_float(p.get("quantity")),
+            unit_price=_to_float(p.get("unit_price")),
+            total=_to_float(p.get("total")),
+        )
+        for p in decode_products(values.get("products"))
+    ]
@@ -0,0 +1,93 @@
+"""
+Schema migrations for databases created before the reporting layer.
+
+``Base.metadata.create_all`` creates missing tables but never adds indexes or
+columns to tables that already exist, so older ``invoices.db`` files need this
+once:
+
+    python -m src.database.migrations
+
+It is idempotent: indexes and (nullable) columns are added only if missing,
+and the line_items backfill only picks up invoices/receipts that have no line
+items yet.
+"""
+from typing import Dict
+
+from sqlalchemy import inspect, insert, select, text
+
+from src.database.connection import SessionLocal, get_engine
+from src.database.line_items import line_item_rows
+from src.database.models import Base, InvoiceModel, LineItemModel, ReceiptModel
+
+BACKFILL_CHUNK = 2000
+
+
+def create_indexes(bind=None) -> None:
+    """Create any declared index that is missing from an existing table."""
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind=bind)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def add_missing_columns(bind=None) -> None:
+    """ALTER TABLE ... ADD COLUMN for nullable columns declared after the table was created."""
+    bind = bind or get_engine()
+    existing_tables = set(inspect(bind).get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present and column.nullable:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def backfill_line_items(chunk_size: int = BACKFILL_CHUNK) -> Dict[str, int]:
+    """Normalize products JSON into line_items for rows not yet backfilled."""
+    inserted = {}
+    db = SessionLocal()
+    try:
+        for doc_type, model in (("invoice", InvoiceModel), ("receipt", ReceiptModel)):
+            has_items = (
+                select(LineItemModel.id)
+                .where(LineItemModel.document_type == doc_type, LineItemModel.document_id == model.id)
+                .exists()
+            )
+            last_id = 0
+            inserted[doc_type] = 0
+            while True:
+                rows = db.execute(
+                    select(model.id, model.vendor_name, model.date, model.products)
+                    .where(model.id > last_id, ~has_items)
+                    .order_by(model.id)
+                    .limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                items = []
+                for row in rows:
+                    items.extend(line_item_rows(doc_type, row.id, dict(
+                        vendor_name=row.vendor_name, date=row.date, products=row.products)))
+                if items:
+                    db.execute(insert(LineItemModel), items)
+                db.commit()
+                inserted[doc_type] += len(items)
+                last_id = rows[-1].id
+        return inserted
+    finally:
+        db.close()
+
+
+def migrate() -> Dict[str, int]:
+    add_missing_columns()
+    create_indexes()
+    return backfill_line_items()
+
+
+if __name__ == "__main__":
+    counts = migrate()
+    print(f"Columns and indexes up to date; backfilled line items: {counts}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -6,7 +6,12 @@ Base = declarative_base()
 
 class InvoiceModel(Base):
     __tablename__ = "invoices"
-    
+    __table_args__ = (
+        Index("ix_invoices_vendor_date", "vendor_name", "date"),
+        Index("ix_invoices_date", "date"),
+        Index("ix_invoices_total_amount", "total_amount"),
+    )
+
     id = Column(Integer, primary_key=True)
     vendor_name = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
@@ -18,7 +23,12 @@ class InvoiceModel(Base):
 
 class ReceiptModel(Base):
     __tablename__ = "receipts"
-    
+    __table_args__ = (
+        Index("ix_receipts_vendor_date", "vendor_name", "date"),
+        Index("ix_receipts_date", "date"),
+        Index("ix_receipts_total_amount", "total_amount"),
+    )
+
     id = Column(Integer, primary_key=True)
     vendor_name = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
@@ -26,4 +36,142 @@ class ReceiptModel(Base):
     total_amount = Column(Float, nullable=False)
     date = Column(DateTime, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
-    file_path = Column(String, nullable=True)  # <-- added
\ No newline at end of file
+    file_path = Column(String, nullable=True)  # <-- added
+
+class LineItemModel(Base):
+    """One row per product line, normalized out of the products JSON for reporting."""
+    __tablename__ = "line_items"
+    __table_args__ = (
+        Index("ix_line_items_document", "document_type", "document_id"),
+        Index("ix_line_items_name", "name"),
+        Index("ix_line_items_date", "date"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    document_type = Column(String, nullable=False)  # "invoice" or "receipt"
+    document_id = Column(Integer, nullable=False)
+    # copied from the parent row so product reports need no join
+    vendor_name = Column(String, nullable=True)
+    date = Column(DateTime, nullable=True)
+    name = Column(String, nullable=False)
+    quantity = Column(Float, nullable=True)
+    unit_price = Column(Float, nullable=True)
+    total = Column(Float, nullable=True)
+
+class DocumentFingerprintModel(Base):
+    """Hashes of every ingested document, used to detect duplicates before OCR/LLM work."""
+    __tablename__ = "document_fingerprints"
+
+    id = Column(Integer, primary_key=True)
+    document_type = Column(String, nullable=True)
+    record_id = Column(Integer, nullable=True)  # id in invoices/receipts
+    file_path = Column(String, nullable=True)
+    file_sha256 = Column(String(64), nullable=False, index=True)
+    # 64-bit difference hash of image uploads, plus its four 16-bit bands:
+    # two hashes within 3 bits of each other always share at least one band
+    phash = Column(String(16), nullable=True)
+    phash_band0 = Column(Integer, nullable=True, index=True)
+    phash_band1 = Column(Integer, nullable=True, index=True)
+    phash_band2 = Column(Integer, nullable=True, index=True)
+    phash_band3 = Column(Integer, nullable=True, index=True)
+    content_fingerprint = Column(String(64), nullable=True, index=True)
+    status = Column(String, nullable=False, default="unique")  # unique | linked | flagged
+    duplicate_of = Column(Integer, nullable=True)  # document_fingerprints.id of the original
+    created_at = Column(DateTime, default=datetime.now)
+
+class VendorTemplateModel(Base):
+    """Field locators learned from earlier LLM extractions of one vendor's layout."""
+    __tablename__ = "vendor_templates"
+    __table_args__ = (
+        Index("ix_vendor_templates_type_vendor", "document_type", "vendor_key", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    document_type = Column(String, nullable=False)
+    vendor_key = Column(String, nullable=False)  # normalized vendor name
+    vendor_name = Column(String, nullable=False)
+    keywords = Column(JSON, nullable=False)
+    locators = Column(JSON, nullable=False)
+    samples = Column(Integer, nullable=False, default=1)  # LLM results the locators agreed with
+    hits = Column(Integer, nullable=False, default=0)  # documents extracted without the LLM
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class JobModel(Base):
+    """A document submitted to the service (src.service); the table doubles as the work queue."""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_created", "status", "created_at"),
+    )
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    file_path = Column(String, nullable=False)
+    document_type = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued | running | done | failed
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String, nullable=True)  # host:pid:nonce of the service process running it
+    heartbeat_at = Column(DateTime, nullable=True)  # refreshed by that process while the job runs
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class ReviewItemModel(Base):
+    """A document whose numbers did not reconcile (src.agents.validation_agent), waiting for a person."""
+    __tablename__ = "review_queue"
+    __table_args__ = (
+        Index("ix_review_queue_status_created", "status", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    document_type = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=True)  # id in invoices/receipts once saved (VALIDATION_REVIEW=flag or approved)
+    file_path = Column(String, nullable=True)
+    data = Column(JSON, nullable=False)  # the extracted fields as validated
+    confidence = Column(Float, nullable=False)
+    issues = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="open")  # open | approved | rejected
+    created_at = Column(DateTime, default=datetime.now)
+    resolved_at = Column(DateTime, nullable=True)
+
+class DocumentVersionModel(Base):
+    """An invoice/receipt re-extracted by src.reprocess under a new prompt, model or normalizer version."""
+    __tablename__ = "document_versions"
+    __table_args__ = (
+        Index("ix_document_versions_version_record", "version", "document_type", "record_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    version = Column(String, nullable=False)  # e.g. "prompt2-gpt-4o-mini"
+    document_type = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)  # id in invoices/receipts
+    stages = Column(String, nullable=False)  # what was re-run: "ocr,llm,normalize", "llm,normalize" or "normalize"
+    status = Column(String, nullable=False)  # changed | unchanged | error | missing
+    vendor_name = Column(String, nullable=True)
+    amount = Column(Float, nullable=True)
+    products = Column(JSON, nullable=True)
+    total_amount = Column(Float, nullable=True)
+    date = Column(DateTime, nullable=True)
+    confidence = Column(Float, nullable=True)  # validation_agent score of the new extraction
+    changes = Column(JSON, nullable=True)  # field -> [old, new]
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+class ReprocessCheckpointModel(Base):
+    """How far a reprocessing run has got: every id up to last_id is in document_versions."""
+    __tablename__ = "reprocess_checkpoints"
+    __table_args__ = (
+        Index("ix_reprocess_checkpoints_version_type", "version", "document_type", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    version = Column(String, nullable=False)
+    document_type = Column(String, nullable=False)
+    stages = Column(String, nullable=False)
+    last_id = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    changed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,226 @@
+"""
+Indexed queries and aggregate reports over invoices and receipts.
+
+Every list query is served from an index (see models.py / migrations.py) and
+paginated with a keyset cursor: pass ``next_cursor`` from one page as
+``cursor`` to get the next. Unlike OFFSET, keyset pages cost the same no matter
+how deep into the result set they are.
+
+    python -m src.database.reports documents invoice --vendor "ACME Ltd" --from 2024-01-01
+    python -m src.database.reports spend receipt --from 2024-01-01 --to 2024-12-31
+    python -m src.database.reports top-products --limit 20
+"""
+import argparse
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, select
+
+from src.database.connection import SessionLocal
+from src.database.models import InvoiceModel, LineItemModel, ReceiptModel
+
+MODELS = {"invoice": InvoiceModel, "receipt": ReceiptModel}
+MAX_PAGE_SIZE = 1000
+
+
+def _model(document_type: str):
+    try:
+        return MODELS[document_type.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown document type: {document_type}")
+
+
+def _encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> List[Any]:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+
+
+def _month(column, dialect_name: str):
+    """Calendar month of a datetime column as 'YYYY-MM', per backend."""
+    if dialect_name == "sqlite":
+        return func.strftime("%Y-%m", column)
+    if dialect_name == "mysql":
+        return func.date_format(column, "%Y-%m")
+    return func.to_char(column, "YYYY-MM")
+
+
+def _date_filters(column, date_from: Optional[datetime], date_to: Optional[datetime]) -> list:
+    filters = []
+    if date_from is not None:
+        filters.append(column >= date_from)
+    if date_to is not None:
+        filters.append(column <= date_to)
+    return filters
+
+
+def find_documents(
+    document_type: str = "invoice",
+    vendor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Documents filtered by vendor, date range and total amount, newest first."""
+    model = _model(document_type)
+    filters = _date_filters(model.date, date_from, date_to)
+    if vendor is not None:
+        filters.append(model.vendor_name == vendor)
+    if min_amount is not None:
+        filters.append(model.total_amount >= min_amount)
+    if max_amount is not None:
+        filters.append(model.total_amount <= max_amount)
+    if cursor:
+        last_date, last_id = _decode_cursor(cursor)
+        last_date = datetime.fromisoformat(last_date)
+        filters.append(or_(model.date < last_date, and_(model.date == last_date, model.id < last_id)))
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    stmt = (
+        select(model.id, model.vendor_name, model.amount, model.total_amount,
+               model.date, model.file_path)
+        .where(*filters)
+        .order_by(model.date.desc(), model.id.desc())
+        .limit(limit + 1)
+    )
+    with SessionLocal() as db:
+        rows = db.execute(stmt).all()
+
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_cursor([items[-1]["date"], items[-1]["id"]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def spend_per_vendor_per_month(
+    document_type: str = "invoice",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    vendor: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Total spend and document count grouped by (month, vendor), ordered by month then vendor."""
+    model = _model(document_type)
+    with SessionLocal() as db:
+        month = _month(model.date, db.get_bind().dialect.name).label("month")
+        filters = _date_filters(model.date, date_from, date_to)
+        if vendor is not None:
+            filters.append(model.vendor_name == vendor)
+        stmt = (
+            select(
+                month,
+                model.vendor_name,
+                func.count(model.id).label("documents"),
+                func.sum(model.total_amount).label("total_spend"),
+            )
+            .where(*filters)
+            .group_by(month, model.vendor_name)
+        )
+        if cursor:
+            last_month, last_vendor = _decode_cursor(cursor)
+            stmt = stmt.having(or_(month > last_month,
+                                   and_(month == last_month, model.vendor_name > last_vendor)))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = db.execute(stmt.order_by(month, model.vendor_name).limit(limit + 1)).all()
+
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_cursor([items[-1]["month"], items[-1]["vendor_name"]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def top_products(
+    document_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    vendor: Optional[str] = None,
+    limit: int = 20,
+    order_by: str = "spend",
+) -> List[Dict[str, Any]]:
+    """Products ranked by total spend (or quantity) from the normalized line_items table."""
+    filters = _date_filters(LineItemModel.date, date_from, date_to)
+    if document_type is not None:
+        filters.append(LineItemModel.document_type == document_type.lower())
+    if vendor is not None:
+        filters.append(LineItemModel.vendor_name == vendor)
+    spend = func.sum(LineItemModel.total).label("total_spend")
+    quantity = func.sum(LineItemModel.quantity).label("total_quantity")
+    stmt = (
+        select(
+            LineItemModel.name,
+            func.count(LineItemModel.id).label("lines"),
+            quantity,
+            spend,
+        )
+        .where(*filters)
+        .group_by(LineItemModel.name)
+        .order_by((quantity if order_by == "quantity" else spend).desc(), LineItemModel.name)
+        .limit(max(1, min(limit, MAX_PAGE_SIZE)))
+    )
+    with SessionLocal() as db:
+        return [dict(row._mapping) for row in db.execute(stmt).all()]
+
+
+def _parse_day(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Query invoices and receipts.")
+    sub = parser.add_subparsers(dest="report", required=True)
+
+    docs = sub.add_parser("documents", help="filtered list, newest first")
+    docs.add_argument("document_type", choices=sorted(MODELS))
+    docs.add_argument("--vendor")
+    docs.add_argument("--min-amount", type=float)
+    docs.add_argument("--max-amount", type=float)
+
+    spend = sub.add_parser("spend", help="spend per vendor per month")
+    spend.add_argument("document_type", choices=sorted(MODELS))
+    spend.add_argument("--vendor")
+
+    products = sub.add_parser("top-products", help="top products by spend or quantity")
+    products.add_argument("--document-type", choices=sorted(MODELS))
+    products.add_argument("--vendor")
+    products.add_argument("--by", choices=("spend", "quantity"), default="spend")
+
+    for p in (docs, spend, products):
+        p.add_argument("--from", dest="date_from", help="YYYY-MM-DD")
+        p.add_argument("--to", dest="date_to", help="YYYY-MM-DD")
+        p.add_argument("--limit", type=int, default=50)
+    for p in (docs, spend):
+        p.add_argument("--cursor", help="next_cursor from the previous page")
+
+    args = parser.parse_args(argv)
+    date_from, date_to = _parse_day(args.date_from), _parse_day(args.date_to)
+
+    if args.report == "documents":
+        result = find_documents(args.document_type, vendor=args.vendor, date_from=date_from,
+                                date_to=date_to, min_amount=args.min_amount,
+                                max_amount=args.max_amount, limit=args.limit, cursor=args.cursor)
+    elif args.report == "spend":
+        result = spend_per_vendor_per_month(args.document_type, date_from=date_from, date_to=date_to,
+                                            vendor=args.vendor, limit=args.limit, cursor=args.cursor)
+    else:
+        result = {"items": top_products(args.document_type, date_from=date_from, date_to=date_to,
+                                        vendor=args.vendor, limit=args.limit, order_by=args.by)}
+
+    for item in result["items"]:
+        print(item)
+    if result.get("next_cursor"):
+        print(f"\nMore results: --cursor {result['next_cursor']}")
+
+
+if __name__ == "__main__":
+    main()
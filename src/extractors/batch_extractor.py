@@ -0,0 +1,177 @@
+"""
+Batched extraction: several short documents per LLM request.
+
+The fixed instructions are sent once per request instead of once per
+document, and each request counts once against the requests-per-minute
+limit. Documents are packed greedily up to LLM_BATCH_TOKENS (estimated
+prompt tokens, plus room for each reply) and LLM_BATCH_MAX_DOCS. The model
+answers with a ``documents`` array (schema-constrained, see
+src.extractors.results) keyed by the document ids given in the prompt; each
+entry is repaired and validated on its own, broken fields are re-asked for that
+document only, and only the documents that are missing or still invalid are
+re-sent alone through the single-document extractor.
+
+Results share the LLM cache layer with the single-document extractors, so a
+document extracted in a batch is a cache hit when processed alone later.
+
+    LLM_BATCH_TOKENS=6000   prompt token budget per batched request
+    LLM_BATCH_MAX_DOCS=10   documents per batched request
+"""
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.extractors import results as extraction_results
+from src.extractors.invoice_extractor import MODEL_NAME, PROMPT_VERSION, extract_invoice_data
+from src.extractors.receipt_extractor import extract_receipt_data
+from src.llm.client import estimate_tokens, get_client
+from src.utils import metrics
+from src.utils.cache import get_cache
+from src.utils.compaction import compact_for_llm
+
+# estimated reply tokens per document (one JSON object with a few line items)
+REPLY_TOKENS_PER_DOC = 200
+
+SINGLE_EXTRACTORS: Dict[str, Callable[[str], Any]] = {
+    "invoice": extract_invoice_data,
+    "receipt": extract_receipt_data,
+}
+
+INSTRUCTIONS = """Extract {document_type} information from each of the {count} documents below.
+
+Return a JSON object {{"documents": [...]}} with exactly one entry per document, each with:
+- id (the document id from its "=== Document <id> ===" header)
+- vendor_name (string)
+- amount (float)
+- products (list of {{name, quantity, unit_price, total}})
+- total_amount (float)
+- date (string or null)
+
+Treat every document separately; never mix fields between documents.
+"""
+
+
+def token_budget() -> int:
+    return int(os.getenv("LLM_BATCH_TOKENS", "6000"))
+
+
+def max_docs() -> int:
+    return int(os.getenv("LLM_BATCH_MAX_DOCS", "10"))
+
+
+def build_prompt(documents: List[Tuple[str, str]], document_type: str) -> str:
+    """One prompt for (id, text) pairs."""
+    parts = [INSTRUCTIONS.format(document_type=document_type, count=len(documents))]
+    for doc_id, text in documents:
+        parts.append(f"=== Document {doc_id} ===\n{text.strip()}\n=== End of document {doc_id} ===\n")
+    parts.append("JSON Response:")
+    return "\n".join(parts)
+
+
+def pack(texts: List[str], budget: Optional[int] = None, limit: Optional[int] = None) -> List[List[int]]:
+    """Group document indexes so each group's prompt fits the token budget (first-fit, in order)."""
+    budget = budget or token_budget()
+    limit = limit or max_docs()
+    overhead = estimate_tokens(INSTRUCTIONS)
+    groups: List[List[int]] = []
+    current: List[int] = []
+    used = overhead
+    for index, text in enumerate(texts):
+        cost = estimate_tokens(text) + REPLY_TOKENS_PER_DOC
+        if overhead + cost > budget // 2:
+            groups.append([index])  # long documents gain little from sharing a request
+            continue
+        if current and (used + cost > budget or len(current) >= limit):
+            groups.append(current)
+            current, used = [], overhead
+        current.append(index)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def parse_batch_reply(raw: str) -> Dict[str, Dict[str, Any]]:
+    """Map document id -> fields from a reply holding {"documents": [...]} (or a bare JSON array)."""
+    parsed = extraction_results.loads(raw)
+    if isinstance(parsed, dict):
+        parsed = parsed.get("documents") or parsed.get("results") or []
+    entries = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if isinstance(entry, dict) and entry.get("id") is not None:
+            entries[str(entry.pop("id"))] = entry
+    return entries
+
+
+def _extract_alone(text: str, document_type: str) -> Any:
+    try:
+        return SINGLE_EXTRACTORS[document_type](text)
+    except Exception as e:
+        return e
+
+
+def extract_batch(texts: List[str], document_type: str) -> List[Any]:
+    """
+    Extract many documents of one type. Returns one item per text, in order:
+    ExtractedData, or the exception that made the document fail.
+    """
+    document_type = document_type.lower()
+    if document_type not in SINGLE_EXTRACTORS:
+        raise ValueError(f"Unknown document type: {document_type}")
+    originals = texts
+    texts = [compact_for_llm(t, document_type) for t in texts]
+    results: List[Any] = [None] * len(texts)
+    cache = get_cache()
+    keys = [cache.llm_key(t, document_type, MODEL_NAME, PROMPT_VERSION) if cache else None for t in texts]
+
+    pending = []
+    for index, text in enumerate(texts):
+        cached = cache.get_llm(keys[index]) if cache else None
+        if cached is not None:
+            try:
+                results[index] = extraction_results.finalize(cached, document_type)
+                continue
+            except Exception:
+                pass
+        pending.append(index)
+
+    groups = [[pending[i] for i in group] for group in pack([texts[i] for i in pending])]
+    multi = [g for g in groups if len(g) > 1]
+    retry = [g[0] for g in groups if len(g) == 1]
+
+    prompts = [build_prompt([(f"d{n}", texts[i]) for n, i in enumerate(g)], document_type) for g in multi]
+    with metrics.span("llm", document_type=document_type, batched="true"):
+        replies = get_client().complete_many(
+            prompts, model=MODEL_NAME,
+            **extraction_results.response_format(extraction_results.batch_schema(), "extracted_documents"),
+        ) if prompts else []
+
+    for group, reply in zip(multi, replies):
+        metrics.inc("llm_batched_documents_total", len(group), document_type=document_type)
+        try:
+            if isinstance(reply, Exception):
+                raise reply
+            with metrics.span("parse"):
+                entries = parse_batch_reply(reply)
+        except Exception as e:
+            print(f"Batched request for {len(group)} documents failed ({e}); retrying them one by one")
+            retry.extend(group)
+            continue
+        for n, index in enumerate(group):
+            data = entries.get(f"d{n}")
+            if data is None:
+                retry.append(index)
+                continue
+            try:
+                results[index] = extraction_results.finalize(data, document_type, texts[index], MODEL_NAME)
+            except Exception:
+                retry.append(index)
+                continue
+            if cache:
+                cache.put_llm(keys[index], extraction_results.as_cache_entry(results[index]))
+
+    batched = {i for g in multi for i in g}
+    for index in sorted(retry):
+        if index in batched:
+            metrics.inc("llm_batch_retries_total", document_type=document_type)
+        results[index] = _extract_alone(originals[index], document_type)
+    return results
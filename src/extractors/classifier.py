@@ -0,0 +1,245 @@
+"""
+Local document classification and splitting, without the LLM.
+
+A scanned stack of mixed paperwork arrives as one PDF. With document type
+``auto`` every page's text is scored on keyword and layout features:
+
+    invoice: "invoice", "bill to", "due date", "payment terms", "PO number",
+             bank details, "balance due", wide lines
+    receipt: "receipt", "cash"/"change"/"tendered", card brands, "auth code",
+             "terminal", register/transaction numbers, times, narrow lines
+
+and the pages are cut into documents. A page starts a new document when
+
+- it says "Page 1 of N" (and "Page 3 of N" continues the current one)
+- its invoice/receipt number differs from the one on the pages before it
+- a blank separator sheet comes before it
+- it is confidently the other type, or it opens with a title ("Invoice",
+  "Receipt") right after a page that closed with a total
+- it is a receipt following a receipt page that closed with a total
+
+A change of type only counts when the page has keyword evidence of its own
+(MIN_EVIDENCE) or a title/total anchor: layout alone never splits, so a
+trailing terms or disclaimer page stays with the document before it.
+
+Text too large to keep in memory (spilled to disk, see src.utils.limits) is
+classified from its first pages and kept as one document.
+
+Each document is then classified on all of its pages together and sent to
+the invoice or receipt extractor (in parallel, see src.main / src.batch).
+To see how a file would be split:
+
+    python -m src.extractors.classifier path/to/stack.pdf
+
+    CLASSIFIER_DEFAULT=invoice   type used when a page has no evidence either way
+"""
+import os
+import re
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from src.utils import limits, metrics
+from src.utils.limits import Text
+
+DOCUMENT_TYPES = ("invoice", "receipt")
+
+# (pattern, weight); each pattern counts once per page
+FEATURES: Dict[str, List[Tuple[str, float]]] = {
+    "invoice": [
+        (r"\binvoice\b", 3.0),
+        (r"\binvoice\s*(?:no\b|number|#|date)", 2.0),
+        (r"\b(?:bill|sold|ship)(?:ed)?\s*to\b", 2.0),
+        (r"\bdue\s*date\b|\bpayment\s+due\b|\bdue\s+(?:on|by)\b", 2.0),
+        (r"\bpayment\s+terms\b|\bterms\s*:|\bnet\s*\d{1,2}\b", 1.5),
+        (r"\b(?:po|p\.o\.|purchase\s+order)\s*(?:no\b|number|#)", 1.5),
+        (r"\b(?:iban|swift|bic|sort\s*code|routing|remit(?:tance)?)\b|\baccount\s*(?:no\b|number|name)", 1.5),
+        (r"\b(?:balance|amount)\s+due\b", 1.5),
+        (r"\b(?:vat|tax|gst)\s*(?:reg(?:istration)?|no\b|number|id)", 1.0),
+        (r"\bquote\b|\bestimate\b|\bstatement\b", 0.5),
+    ],
+    "receipt": [
+        (r"\breceipt\b", 3.0),
+        (r"\bcash(?:ier)?\b", 2.0),
+        (r"\bchange\s*(?:due)?\s*[:$€£]?\s*\d", 2.0),
+        (r"\btender(?:ed)?\b", 2.0),
+        (r"\b(?:visa|mastercard|amex|maestro|debit|contactless)\b|\bcard\s*(?:no\b|number|type)", 1.5),
+        (r"\b(?:auth(?:orization)?|approval)\s*(?:code|no\b|#)|\bterminal\b|\b[tm]id\s*[:#]", 1.5),
+        (r"\b(?:store|register|till|lane|trans(?:action)?|trx)\s*(?:#|no\b|id\b|:)", 1.5),
+        (r"\bitems?\s+sold\b|\bno\.?\s+of\s+items\b", 1.0),
+        (r"\bthank\s*you\b|\bplease\s+come\s+again\b", 1.0),
+        (r"\b\d{1,2}:\d{2}(?::\d{2})?\s*(?:am|pm)?\b", 1.0),
+    ],
+}
+COMPILED = {kind: [(re.compile(p, re.IGNORECASE), w) for p, w in rules] for kind, rules in FEATURES.items()}
+
+PAGE_RE = re.compile(r"\bpage\s*(\d{1,3})\s*(?:of|/)\s*(\d{1,3})\b", re.IGNORECASE)
+NUMBER_RE = re.compile(
+    r"\b(?:invoice|receipt|bill|order|inv|trans(?:action)?)\s*(?:no\b\.?|number|num\b|#|id\b)\s*[:#.]?\s*"
+    r"([A-Z0-9][A-Z0-9\-/]{2,})",
+    re.IGNORECASE,
+)
+TITLE_RE = re.compile(r"\b(?:tax\s+)?(?:invoice|receipt)\b", re.IGNORECASE)
+TOTAL_RE = re.compile(r"\b(?:grand\s+)?total\b|\b(?:balance|amount)\s+due\b", re.IGNORECASE)
+CLOSING_RE = re.compile(TOTAL_RE.pattern + r"|\bthank\s*you\b", re.IGNORECASE)
+
+NARROW_LINES = 42  # median characters per line of a till receipt
+WIDE_LINES = 60
+HEADER_LINES = 8  # lines at the top of a page that count as its header
+FOOTER_LINES = 15
+BLANK_CHARS = 20  # fewer non-space characters than this: a blank or separator sheet
+SURE = 0.3  # confidence needed before a change of type alone splits documents
+MIN_EVIDENCE = 2.0  # keyword score a page needs before its type can split documents
+
+
+class Classification(NamedTuple):
+    document_type: str
+    confidence: float  # 0 (no evidence either way) .. 1
+    scores: Dict[str, float]
+
+
+class Segment(NamedTuple):
+    document_type: str
+    confidence: float
+    first_page: int  # 1-based, inclusive
+    last_page: int
+    text: Text
+
+
+def default_type() -> str:
+    value = os.getenv("CLASSIFIER_DEFAULT", "invoice").lower()
+    return value if value in DOCUMENT_TYPES else "invoice"
+
+
+def _lines(text: str) -> List[str]:
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def keyword_scores(text: str) -> Dict[str, float]:
+    """Keyword evidence only for each document type."""
+    return {kind: sum(w for pattern, w in rules if pattern.search(text)) for kind, rules in COMPILED.items()}
+
+
+def scores(text: str) -> Dict[str, float]:
+    """Keyword and layout evidence for each document type."""
+    result = keyword_scores(text)
+    lengths = sorted(len(line) for line in _lines(text))
+    if len(lengths) >= 5:
+        median = lengths[len(lengths) // 2]
+        if median <= NARROW_LINES:
+            result["receipt"] += 1.0
+        elif median >= WIDE_LINES:
+            result["invoice"] += 1.0
+    return result
+
+
+def classify_text(text: Text) -> Classification:
+    """Invoice or receipt, with a confidence; CLASSIFIER_DEFAULT when there is nothing to go on."""
+    points = scores(text if isinstance(text, str) else limits.head(text))
+    invoice, receipt = points["invoice"], points["receipt"]
+    if invoice == receipt:
+        return Classification(default_type(), 0.0, points)
+    confidence = round(abs(invoice - receipt) / (invoice + receipt + 1.0), 3)
+    return Classification("invoice" if invoice > receipt else "receipt", confidence, points)
+
+
+def split_pages(text: str) -> List[str]:
+    """Pages of extracted text (pdfminer and Tesseract end each page with a form feed)."""
+    pages = (text or "").split("\f")
+    if len(pages) > 1 and not pages[-1].strip():
+        pages.pop()  # the form feed after the last page
+    return pages
+
+
+def _page_marker(page: str) -> Optional[int]:
+    """n from "Page n of m" near the top or bottom of the page."""
+    lines = _lines(page)
+    for line in lines[:HEADER_LINES] + lines[-HEADER_LINES:]:
+        match = PAGE_RE.search(line)
+        if match and int(match.group(1)) <= int(match.group(2)):
+            return int(match.group(1))
+    return None
+
+
+def _document_number(page: str) -> Optional[str]:
+    match = NUMBER_RE.search(page)
+    return match.group(1).upper() if match else None
+
+
+def _has_evidence(page: str, label: Classification) -> bool:
+    """Whether the page says what it is: enough keywords for its type, or a title or total."""
+    if keyword_scores(page)[label.document_type] >= MIN_EVIDENCE:
+        return True
+    return bool(TITLE_RE.search("\n".join(_lines(page)[:HEADER_LINES])) or TOTAL_RE.search(page))
+
+
+def _starts_document(page: str, label: Classification, current: Dict[str, object]) -> bool:
+    """Whether `page` begins a new document, given what the current document looks like so far."""
+    marker = _page_marker(page)
+    if marker is not None:
+        return marker == 1
+    number = _document_number(page)
+    if number and current["number"]:
+        return number != current["number"]
+    if current["after_blank"]:
+        return True
+    if not current["evidence"]:
+        return False  # layout alone (terms, disclaimers, continuation sheets) never starts a document
+    if label.confidence >= SURE and current["confidence"] >= SURE and label.document_type != current["type"]:
+        return True
+    if not CLOSING_RE.search("\n".join(current["last_lines"])):
+        return False
+    if label.document_type == current["type"] == "receipt" and label.confidence >= SURE:
+        return True  # till receipts fit on a page: after a total, another receipt is another purchase
+    return bool(TITLE_RE.search("\n".join(_lines(page)[:HEADER_LINES])))
+
+
+def segment_document(text: "Text") -> List[Segment]:
+    """Split extracted text into documents; always at least one."""
+    if not isinstance(text, str):
+        # spilled to disk (src.utils.limits): too large to split, classified from its first pages
+        label = classify_text(text)
+        metrics.inc("documents_classified_total", document_type=label.document_type)
+        return [Segment(label.document_type, label.confidence, 1, max(1, text.page_count), text)]
+    pages = split_pages(text)
+    groups: List[List[int]] = []
+    current: Dict[str, object] = {}
+    after_blank = False
+    for index, page in enumerate(pages):
+        if len(re.sub(r"\s", "", page)) < BLANK_CHARS:
+            after_blank = bool(groups)
+            continue
+        label = classify_text(page)
+        current["after_blank"] = after_blank
+        evidence = current["evidence"] = _has_evidence(page, label)
+        if not groups or _starts_document(page, label, current):
+            groups.append([])
+            current = {"number": None, "type": label.document_type, "confidence": label.confidence}
+        groups[-1].append(index)
+        current["number"] = current["number"] or _document_number(page)
+        if evidence and label.confidence > current["confidence"]:
+            current["type"], current["confidence"] = label.document_type, label.confidence
+        current["last_lines"] = _lines(page)[-FOOTER_LINES:]
+        after_blank = False
+
+    if not groups:  # nothing but blank pages
+        label = classify_text(text or "")
+        return [Segment(label.document_type, label.confidence, 1, max(1, len(pages)), text or "")]
+    segments = []
+    for group in groups:
+        segment_text = "\f".join(pages[group[0]:group[-1] + 1])
+        label = classify_text(segment_text)
+        segments.append(Segment(label.document_type, label.confidence, group[0] + 1, group[-1] + 1, segment_text))
+        metrics.inc("documents_classified_total", document_type=label.document_type)
+    return segments
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m src.extractors.classifier <file.pdf|image>")
+        raise SystemExit(1)
+    from src.utils.helpers import extract_document_text
+
+    for found in segment_document(extract_document_text(sys.argv[1])):
+        first_line = (_lines(limits.head(found.text, 2000)) or [""])[0][:60]
+        print(f"pages {found.first_page}-{found.last_page}: {found.document_type} "
+              f"(confidence {found.confidence:.2f})  {first_line}")
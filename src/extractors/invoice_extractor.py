@@ -1,28 +1,33 @@
 # ...existing code...
-import os
-import json
-from typing import Any, Dict
-
-def _parse_response_text(raw: str) -> Dict[str, Any]:
-    raw = (raw or "").strip()
-    try:
-        return json.loads(raw)
-    except Exception:
-        start = raw.find("{")
-        end = raw.rfind("}") + 1
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(raw[start:end])
-            except Exception:
-                pass
-    raise ValueError("LLM response did not contain valid JSON")
-
-def extract_invoice_data(document_text: str):
+from typing import Any, Dict, Optional
+from src.extractors import results
+from src.llm.client import get_client
+from src.utils import metrics
+from src.utils.cache import get_cache
+from src.utils.compaction import compact_for_llm
+
+MODEL_NAME = "gpt-4o-mini"
+# bump whenever the prompt below changes so cached LLM results are not reused
+PROMPT_VERSION = "2"
+
+def _call_llm(prompt: str, model: str = MODEL_NAME) -> Dict[str, Any]:
+    """Send the prompt through the shared LLM client, asking for schema-constrained JSON, and parse the reply."""
+    with metrics.span("llm", document_type="invoice"):
+        raw = get_client().complete(prompt, model=model, **results.response_format())
+    with metrics.span("parse"):
+        return results.parse_reply(raw)
+
+def extract_invoice_data(document_text: str, model: Optional[str] = None, use_cache: bool = True):
     """
     Extract structured invoice data from text.
-    Uses LangChain ChatOpenAI if available; otherwise falls back to openai client.
-    Returns a dict or a pydantic ExtractedData instance when available.
+    Calls the LLM through the shared pooled client in src.llm.client.
+    Returns a validated ExtractedData; raises results.ExtractionError if the reply cannot be repaired.
+    model overrides MODEL_NAME; with use_cache=False the LLM is always asked (the answer is still cached).
     """
+    model = model or MODEL_NAME
+    # whitespace, repeated headers/footers and boilerplate cost tokens but carry no fields
+    document_text = compact_for_llm(document_text, "invoice")
+
     prompt = f"""Extract invoice information from the following text.
 
 Return a JSON object with:
@@ -37,82 +42,16 @@ Document:
 
 JSON Response:"""
 
-    # Try LangChain first (avoid imports that may not exist)
-    try:
-        try:
-            from langchain.chat_models import ChatOpenAI  # common import
-        except Exception:
-            from langchain_openai import ChatOpenAI  # older wrapper
-
-        llm = ChatOpenAI(model="gpt-4o-mini")
-        # try common calling patterns
-        try:
-            response = llm.invoke([{"role": "user", "content": prompt}])
-            raw = getattr(response, "content", None) or getattr(response, "text", None) or str(response)
-        except Exception:
-            response = llm([{"role": "user", "content": prompt}])
-            raw = getattr(response, "content", None) or getattr(response, "text", None) or str(response)
-
-        data = _parse_response_text(raw)
-    except ModuleNotFoundError:
-        # fallback to openai
-        try:
-            import openai
-        except Exception as e:
-            raise ImportError(
-                "Neither langchain nor openai is available. Install with: python -m pip install langchain openai"
-            ) from e
-
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key:
-            try:
-                openai.api_key = api_key
-            except Exception:
-                pass
-
-        # try legacy ChatCompletion
-        try:
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            raw = resp["choices"][0]["message"]["content"]
-            data = _parse_response_text(raw)
-        except Exception:
-            # try newer OpenAI client
-            try:
-                from openai import OpenAI
-                client = OpenAI()
-                resp = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0
-                )
-                raw = resp.choices[0].message.content
-                data = _parse_response_text(raw)
-            except Exception as e2:
-                raise RuntimeError("Failed to call LLM via openai client") from e2
-
-    # Try to return a pydantic model if available
-    try:
-        from src.types.schemas import ExtractedData
-        products = data.get("products", [])
-        return ExtractedData(
-            vendor_name=data.get("vendor_name"),
-            amount=data.get("amount"),
-            products=products,
-            total_amount=data.get("total_amount"),
-            date=data.get("date"),
-            document_type="invoice"
-        )
-    except Exception:
-        return {
-            "vendor_name": data.get("vendor_name"),
-            "amount": data.get("amount"),
-            "products": data.get("products", []),
-            "total_amount": data.get("total_amount"),
-            "date": data.get("date"),
-            "document_type": "invoice"
-        }
+    cache = get_cache()
+    cache_key = cache.llm_key(document_text, "invoice", model, PROMPT_VERSION) if cache else None
+    data = cache.get_llm(cache_key) if cache and use_cache else None
+    cached = data is not None
+    if data is None:
+        data = _call_llm(prompt, model)
+
+    # repaired and validated, re-asking only for fields that cannot be fixed locally
+    extracted = results.finalize(data, "invoice", document_text, model)
+    if cache and not cached:
+        cache.put_llm(cache_key, results.as_cache_entry(extracted))
+    return extracted
 # ...existing code...
\ No newline at end of file
@@ -1,35 +1,37 @@
 # ...existing code...
 """
-Receipt extractor with lazy imports and fallback to the OpenAI client if LangChain
-components aren't available. This avoids import-time failures and gives a clear
-error message when dependencies are missing.
+Receipt extractor. The LLM is reached through the shared pooled client in
+src.llm.client, which owns connection reuse, rate limiting and retries.
 """
-import json
-import os
-from typing import Any, Dict
-
-def _parse_response_text(raw: str) -> Dict[str, Any]:
-    # attempt to parse JSON from the LLM output
-    raw = raw.strip()
-    try:
-        return json.loads(raw)
-    except Exception:
-        # try to locate a JSON block in the text
-        start = raw.find("{")
-        end = raw.rfind("}") + 1
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(raw[start:end])
-            except Exception:
-                pass
-    raise ValueError("LLM response did not contain valid JSON")
-
-def extract_receipt_data(document_text: str):
+from typing import Any, Dict, Optional
+from src.extractors import results
+from src.llm.client import get_client
+from src.utils import metrics
+from src.utils.cache import get_cache
+from src.utils.compaction import compact_for_llm
+
+MODEL_NAME = "gpt-4o-mini"
+# bump whenever the prompt below changes so cached LLM results are not reused
+PROMPT_VERSION = "2"
+
+def _call_llm(prompt: str, model: str = MODEL_NAME) -> Dict[str, Any]:
+    """Send the prompt through the shared LLM client, asking for schema-constrained JSON, and parse the reply."""
+    with metrics.span("llm", document_type="receipt"):
+        raw = get_client().complete(prompt, model=model, **results.response_format())
+    with metrics.span("parse"):
+        return results.parse_reply(raw)
+
+def extract_receipt_data(document_text: str, model: Optional[str] = None, use_cache: bool = True):
     """
     Extract structured data from a receipt text.
-    Tries to use LangChain if available; otherwise falls back to openai.ChatCompletion.
-    Returns either a dict or a pydantic ExtractedData instance when available.
+    Calls the LLM through the shared pooled client in src.llm.client.
+    Returns a validated ExtractedData; raises results.ExtractionError if the reply cannot be repaired.
+    model overrides MODEL_NAME; with use_cache=False the LLM is always asked (the answer is still cached).
     """
+    model = model or MODEL_NAME
+    # whitespace, repeated headers/footers and boilerplate cost tokens but carry no fields
+    document_text = compact_for_llm(document_text, "receipt")
+
     prompt_template = """Extract receipt information from the following text.
 
 Return a JSON object with:
@@ -44,104 +46,16 @@ Document:
 
 JSON Response:""".format(document_text=document_text)
 
-    # Try LangChain first (some versions expose different import paths)
-    try:
-        try:
-            from langchain.chat_models import ChatOpenAI  # new-style import
-        except Exception:
-            from langchain_openai import ChatOpenAI  # older package wrapper
-
-        try:
-            from langchain.prompts import PromptTemplate
-        except Exception:
-            # PromptTemplate may be in different locations on very old/new versions;
-            # we don't strictly need it here since we assemble the prompt manually.
-            PromptTemplate = None  # type: ignore
-
-        llm = ChatOpenAI(model="gpt-4o-mini")
-        # LangChain wrapper APIs differ; try a couple of common ways:
-        try:
-            # some ChatOpenAI objects allow a simple call with messages or text
-            response = llm.invoke([{"role": "user", "content": prompt_template}])
-            raw = getattr(response, "content", None) or getattr(response, "text", None) or str(response)
-        except Exception:
-            # fallback: call llm with direct call if supported
-            response = llm([{"role": "user", "content": prompt_template}])
-            raw = getattr(response, "content", None) or getattr(response, "text", None) or str(response)
-
-        data = _parse_response_text(raw)
-    except ModuleNotFoundError:
-        # LangChain not installed, fallback to openai
-        try:
-            import openai
-        except Exception as e:
-            raise ImportError(
-                "Neither langchain nor openai client is available in this environment. "
-                "Install with: python -m pip install langchain openai"
-            ) from e
-
-        # ensure API key is set
-        api_key = os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY".lower())
-        if api_key:
-            try:
-                openai.api_key = api_key
-            except Exception:
-                pass
-
-        # Use legacy openai.ChatCompletion if available
-        try:
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt_template}],
-                temperature=0
-            )
-            raw = resp["choices"][0]["message"]["content"]
-            data = _parse_response_text(raw)
-        except Exception as e:
-            # Newer openai client variants may use OpenAI() client
-            try:
-                from openai import OpenAI
-                client = OpenAI()
-                resp = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt_template}],
-                    temperature=0
-                )
-                raw = resp.choices[0].message.content
-                data = _parse_response_text(raw)
-            except Exception as e2:
-                raise RuntimeError(
-                    "Failed to call LLM via openai client. Original error: "
-                    f"{e}; fallback error: {e2}"
-                ) from e2
-
-    # Try to return a pydantic model if available
-    try:
-        from src.types.schemas import ExtractedData, Product
-        products = data.get("products", [])
-        # normalize product items to list of dicts if necessary
-        normalized_products = []
-        for p in products:
-            if isinstance(p, dict):
-                normalized_products.append(p)
-            else:
-                normalized_products.append({"name": str(p), "quantity": 1, "unit_price": 0.0, "total": 0.0})
-        return ExtractedData(
-            vendor_name=data.get("vendor_name"),
-            amount=data.get("amount"),
-            products=normalized_products,
-            total_amount=data.get("total_amount"),
-            date=data.get("date"),
-            document_type="receipt"
-        )
-    except Exception:
-        # return raw dict if ExtractedData is unavailable
-        return {
-            "vendor_name": data.get("vendor_name"),
-            "amount": data.get("amount"),
-            "products": data.get("products", []),
-            "total_amount": data.get("total_amount"),
-            "date": data.get("date"),
-            "document_type": "receipt"
-        }
+    cache = get_cache()
+    cache_key = cache.llm_key(document_text, "receipt", model, PROMPT_VERSION) if cache else None
+    data = cache.get_llm(cache_key) if cache and use_cache else None
+    cached = data is not None
+    if data is None:
+        data = _call_llm(prompt_template, model)
+
+    # repaired and validated, re-asking only for fields that cannot be fixed locally
+    extracted = results.finalize(data, "receipt", document_text, model)
+    if cache and not cached:
+        cache.put_llm(cache_key, results.as_cache_entry(extracted))
+    return extracted
 # ...existing code...
\ No newline at end of file
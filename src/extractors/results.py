@@ -0,0 +1,329 @@
+"""
+Shared handling of LLM extraction replies for every extractor.
+
+1. Requests ask for schema-constrained output: ``response_format`` carries a
+   strict JSON schema generated from the pydantic ``ExtractedData``/``Product``
+   models, so the reply is a bare JSON object with exactly those fields
+   (LLM_RESPONSE_FORMAT=json_object falls back to plain JSON mode, ``off``
+   sends no response_format for endpoints without support).
+2. Replies are parsed with orjson when it is installed (json otherwise);
+   code fences and text around the object are only stripped if that fails.
+3. Common slips are repaired locally instead of re-prompting: numbers sent as
+   strings with currency symbols, codes or thousands separators ("$1,234.50",
+   "1.234,50 EUR", "(12.00)"), a product's missing quantity/price/total when
+   the other two give it, products sent as bare strings, dates in any printed
+   format (src.utils.dates, with the vendor's learned order). A date that
+   reads both as dd/mm and mm/dd is kept in the default order and marked
+   ``date_ambiguous``, which sends the saved document to the review queue.
+4. Fields that still do not fit are re-asked on their own: one short request
+   naming only those fields and what was wrong, answered with a schema for
+   just those fields. If they are still wrong, ``ExtractionError`` is raised;
+   extractors never hand back an unvalidated dict.
+
+    LLM_RESPONSE_FORMAT=json_schema   json_schema | json_object | off
+    LLM_REASK=1                       set to 0 to fail instead of re-asking for broken fields
+"""
+import copy
+import json
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.llm.client import get_client
+from src.utils import dates, metrics
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+NUMBER_FIELDS = ("amount", "total_amount")
+PRODUCT_NUMBERS = ("quantity", "unit_price", "total")
+OWN_FIELDS = ("document_type", "date_ambiguous")  # set by us, never asked of the LLM
+FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+CURRENCY_RE = re.compile(r"[$€£¥₦₹₩₽¢]|\b(?:USD|EUR|GBP|NGN|JPY|CAD|AUD|INR|CHF|ZAR|KES|GHS)\b",
+                         re.IGNORECASE)
+
+
+class ExtractionError(ValueError):
+    """The reply could not be turned into a valid ExtractedData, even after repair and a re-ask."""
+
+    def __init__(self, message: str, problems: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.problems = problems or {}
+
+
+@lru_cache(maxsize=None)
+def _models():
+    from src.types.schemas import ExtractedData, Product
+    return ExtractedData, Product
+
+
+# --- schema ----------------------------------------------------------------
+
+def _model_schema(model) -> Dict[str, Any]:
+    return model.model_json_schema() if hasattr(model, "model_json_schema") else model.schema()
+
+
+def _strict(node: Any, definitions: Dict[str, Any]) -> Any:
+    """Inline $refs and make objects strict (all fields required, nothing extra), as structured outputs need."""
+    if isinstance(node, list):
+        return [_strict(item, definitions) for item in node]
+    if not isinstance(node, dict):
+        return node
+    if "$ref" in node:
+        return _strict(definitions[node["$ref"].rsplit("/", 1)[-1]], definitions)
+    if "anyOf" in node:  # Optional[X] -> {"type": [X, "null"]}
+        types = [option.get("type") for option in node["anyOf"]]
+        if all(isinstance(t, str) for t in types):
+            return {"type": types}
+    out = {k: _strict(v, definitions) for k, v in node.items()
+           if k not in ("title", "format", "default", "$defs", "definitions")}
+    if out.get("type") == "object" and "properties" in out:
+        out["required"] = list(out["properties"])
+        out["additionalProperties"] = False
+    return out
+
+
+@lru_cache(maxsize=None)
+def _field_schemas() -> Tuple[Tuple[str, str], ...]:
+    """(field, JSON-encoded schema) for each field the LLM fills in (not OWN_FIELDS)."""
+    ExtractedData, _ = _models()
+    schema = _model_schema(ExtractedData)
+    definitions = dict(schema.get("$defs") or schema.get("definitions") or {})
+    return tuple((name, json.dumps(_strict(prop, definitions)))
+                 for name, prop in schema["properties"].items() if name not in OWN_FIELDS)
+
+
+def json_schema(fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Strict object schema for the extracted fields (or just `fields`)."""
+    properties = {name: json.loads(prop) for name, prop in _field_schemas() if fields is None or name in fields}
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def batch_schema() -> Dict[str, Any]:
+    """A ``documents`` array of extracted objects, each with the id it was given in the prompt."""
+    item = json_schema()
+    item["properties"] = dict({"id": {"type": "string"}}, **item["properties"])
+    item["required"] = ["id"] + item["required"]
+    return {"type": "object", "properties": {"documents": {"type": "array", "items": item}},
+            "required": ["documents"], "additionalProperties": False}
+
+
+def response_format(schema: Optional[Dict[str, Any]] = None, name: str = "extracted_data") -> Dict[str, Any]:
+    """Keyword arguments for the chat completion call: the response_format for LLM_RESPONSE_FORMAT."""
+    mode = os.getenv("LLM_RESPONSE_FORMAT", "json_schema").lower()
+    if mode in ("0", "off", "none", "false"):
+        return {}
+    if mode == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    return {"response_format": {"type": "json_schema", "json_schema": {
+        "name": name, "strict": True, "schema": schema or json_schema()}}}
+
+
+# --- parsing ---------------------------------------------------------------
+
+def loads(raw: Any) -> Any:
+    """Parse JSON text (orjson when available), tolerating code fences or prose around the value."""
+    if isinstance(raw, (dict, list)):
+        return raw
+    raw = (raw or "").strip()
+    try:
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        pass
+    text = FENCE_RE.sub("", raw)
+    for opener, closer in (("{", "}"), ("[", "]")):
+        start, end = text.find(opener), text.rfind(closer) + 1
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end])
+            except ValueError:
+                continue
+    raise ValueError("LLM response did not contain valid JSON")
+
+
+def parse_reply(raw: Any) -> Dict[str, Any]:
+    """The JSON object in a single-document reply."""
+    data = loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("LLM response was not a JSON object")
+    return data
+
+
+# --- repair ----------------------------------------------------------------
+
+def to_number(value: Any) -> Optional[float]:
+    """A float from numbers and number-like strings ("$1,234.50", "1.234,50 EUR", "(12.00)"), else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = re.sub(r"\s", "", CURRENCY_RE.sub("", value))
+    negative = (text.startswith("(") and text.endswith(")")) or text.endswith("-")
+    text = text.strip("()+").rstrip("-")
+    if text.startswith("-"):
+        negative, text = True, text[1:]
+    if not re.fullmatch(r"\d[\d.,']*", text or ""):
+        return None
+    text = text.replace("'", "")
+    if "," in text and "." in text:  # the later one is the decimal mark
+        text = text.replace(".", "").replace(",", ".") if text.rfind(",") > text.rfind(".") else text.replace(",", "")
+    elif "," in text:
+        whole, _, tail = text.rpartition(",")
+        thousands = len(tail) == 3 and whole.strip("0")  # "1,234" but not "0,500"
+        text = text.replace(",", "") if thousands else whole.replace(",", "") + "." + tail
+    elif text.count(".") > 1:
+        text = text.replace(".", "")  # 1.234.567
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def _number(value: Any, path: str, repaired: List[str]) -> Optional[float]:
+    number = to_number(value)
+    if number is not None and not isinstance(value, (int, float)):
+        repaired.append(path)
+    return number
+
+
+def _repair_product(item: Any, index: int, problems: Dict[str, str], repaired: List[str]) -> Dict[str, Any]:
+    path = f"products[{index}]"
+    if not isinstance(item, dict):
+        # a bare name: keep the line, without prices
+        repaired.append(path)
+        return {"name": str(item), "quantity": 1.0, "unit_price": 0.0, "total": 0.0}
+    fixed = dict(item)
+    fixed["name"] = str(fixed.get("name") or "").strip()
+    for field in PRODUCT_NUMBERS:
+        fixed[field] = _number(fixed.get(field), f"{path}.{field}", repaired)
+    quantity, unit_price, total = (fixed[f] for f in PRODUCT_NUMBERS)
+    # any two of quantity, unit price and total give the third
+    if total is None and quantity is not None and unit_price is not None:
+        fixed["total"] = round(quantity * unit_price, 2)
+        repaired.append(f"{path}.total")
+    elif unit_price is None and total is not None:
+        fixed["quantity"] = quantity = 1.0 if quantity is None else quantity
+        fixed["unit_price"] = round(total / quantity, 4) if quantity else total
+        repaired.append(f"{path}.unit_price")
+    elif quantity is None and total is not None and unit_price:
+        fixed["quantity"] = round(total / unit_price, 3)
+        repaired.append(f"{path}.quantity")
+    if not fixed["name"]:
+        problems[f"products[{index}].name"] = "missing"
+    for field in PRODUCT_NUMBERS:
+        if fixed[field] is None:
+            problems[f"products[{index}].{field}"] = f"not a number: {item.get(field)!r}"
+    return {k: fixed[k] for k in ("name",) + PRODUCT_NUMBERS}
+
+
+def repair(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str], List[str]]:
+    """
+    Locally fixed copy of the reply, {field path: problem} for what could not
+    be fixed, and the paths of the fields that were fixed.
+    """
+    problems: Dict[str, str] = {}
+    repaired: List[str] = []
+    fixed: Dict[str, Any] = {}
+    vendor = data.get("vendor_name")
+    fixed["vendor_name"] = str(vendor).strip() if vendor is not None else ""
+    if not fixed["vendor_name"]:
+        problems["vendor_name"] = "missing"
+    for field in NUMBER_FIELDS:
+        fixed[field] = _number(data.get(field), field, repaired)
+        if fixed[field] is None:
+            problems[field] = f"not a number: {data.get(field)!r}"
+    products = data.get("products")
+    if isinstance(products, dict):
+        products = products.get("items") or [products]
+    fixed["products"] = [_repair_product(p, i, problems, repaired) for i, p in enumerate(products or [])]
+
+    raw_date = data.get("date")
+    fixed["date"] = None
+    fixed["date_ambiguous"] = data.get("date_ambiguous") is True  # kept from a cached result
+    if isinstance(raw_date, datetime):
+        fixed["date"] = raw_date
+    elif raw_date not in (None, "", "null"):
+        parsed = dates.get_normalizer().parse(raw_date, vendor=fixed["vendor_name"])
+        if parsed.value is None:
+            problems["date"] = f"not a date: {raw_date!r}"
+        else:
+            fixed["date"] = parsed.value
+            if parsed.ambiguous:
+                fixed["date_ambiguous"] = True
+                dates.report_ambiguous(raw_date, fixed["vendor_name"], parsed)
+    return fixed, problems, repaired
+
+
+def _top_level(problems: Dict[str, str]) -> List[str]:
+    return sorted({re.split(r"[.\[]", path, maxsplit=1)[0] for path in problems})
+
+
+def reask_enabled() -> bool:
+    return os.getenv("LLM_REASK", "1").lower() not in ("0", "false", "no", "off")
+
+
+def reask(document_text: str, document_type: str, data: Dict[str, Any], problems: Dict[str, str],
+          model: Optional[str] = None) -> Dict[str, Any]:
+    """Ask again for only the broken fields; returns the new values for them."""
+    fields = _top_level(problems)
+    issues = "\n".join(f"- {path}: {problem}" for path, problem in sorted(problems.items()))
+    current = {field: data.get(field) for field in fields}
+    prompt = f"""Some fields extracted from this {document_type} are wrong:
+{issues}
+
+Current values: {json.dumps(current, default=str)}
+
+Return a JSON object with only these fields: {", ".join(fields)}.
+Numbers must be plain numbers (no currency symbols or thousands separators);
+date is the date printed on the document, or null.
+
+Document:
+{document_text}
+
+JSON Response:"""
+    metrics.inc("llm_reasks_total", document_type=document_type)
+    with metrics.span("llm", document_type=document_type, reask="true"):
+        raw = get_client().complete(prompt, model=model, **response_format(json_schema(fields), "fields"))
+    with metrics.span("parse"):
+        reply = parse_reply(raw)
+    return {field: reply[field] for field in fields if field in reply}
+
+
+def finalize(data: Any, document_type: str, document_text: Optional[str] = None,
+             model: Optional[str] = None):
+    """
+    Turn a parsed reply into ExtractedData: repair locally, re-ask for what is
+    still broken (when the document text is given), validate. Raises
+    ExtractionError when the fields cannot be made valid.
+    """
+    ExtractedData, _ = _models()
+    if not isinstance(data, dict):
+        raise ExtractionError(f"expected a JSON object, got {type(data).__name__}")
+    with metrics.span("validation", document_type=document_type):
+        fixed, problems, repaired = repair(data)
+    if problems and document_text is not None and reask_enabled():
+        print(f"⚠️ Re-asking the LLM for {', '.join(_top_level(problems))}: {problems}")
+        merged = copy.deepcopy(data)
+        merged.update(reask(document_text, document_type, data, problems, model))
+        with metrics.span("validation", document_type=document_type):
+            fixed, problems, repaired = repair(merged)
+    if problems:
+        metrics.inc("validation_failures_total", document_type=document_type)
+        raise ExtractionError(f"LLM reply has invalid fields: {problems}", problems)
+    if repaired:
+        metrics.inc("extraction_repairs_total", len(repaired), document_type=document_type)
+    return ExtractedData(document_type=document_type, **fixed)
+
+
+def as_cache_entry(extracted) -> Dict[str, Any]:
+    """The validated fields in JSON-ready form, for the LLM cache."""
+    fields = extracted.model_dump(mode="json") if hasattr(extracted, "model_dump") else json.loads(extracted.json())
+    fields.pop("document_type", None)
+    return fields
@@ -0,0 +1,487 @@
+"""
+Vendor templates: extract repeat vendors' documents without the LLM.
+
+After an LLM extraction has passed validation and been saved, ``learn``
+records where each field sat in the OCR text, as anchors (the label text in
+front of the value on its line):
+
+    "Total Due: $1,234.50"    -> total_amount: anchor "total due"
+    "Date: 05/01/2024"        -> date: anchor "date", dayfirst
+    "Widget  2  10.00  20.00" -> products: 3 trailing numbers (qty, unit, total)
+
+The vendor is recognised from the words of its name, looked up in an inverted
+keyword index over all templates. ``try_extract`` applies the template when
+the vendor is identified and the template has agreed with the LLM on at
+least TEMPLATE_MIN_SAMPLES documents; the result is cross-checked (line totals
+add up to the amount, quantity x unit price = line total) and anything less
+than TEMPLATE_MIN_CONFIDENCE goes to the LLM instead. A template that stops
+agreeing with the LLM is re-learned from the newer layout. Results read by a
+template are never learned from, and documents that go to review (numbers
+that do not reconcile, ambiguous dates) are not learned from either.
+
+Template hits are counted in memory and written by ``flush_hits``, which the
+DB writers (src.main after each document, src.batch after each flush) call,
+so the LLM threads never open a write transaction for them.
+
+    TEMPLATES=0                  turn the fast path off (nothing is learned either)
+    TEMPLATE_MIN_SAMPLES=2       agreeing LLM extractions before a template is used
+    TEMPLATE_MIN_CONFIDENCE=0.9
+"""
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select, update
+
+from src.database.connection import SessionLocal
+from src.database.models import VendorTemplateModel
+from src.utils import dates, metrics
+
+NUMBER_RE = re.compile(r"(?<![\w.,])(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?![\w,]|\.\d)")
+DATE_RE = re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b"
+    r"|\b\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}\b"
+    r"|\b\d{1,2}\s+[A-Za-z]{3,9}\.?,?\s+\d{4}\b"
+    r"|\b[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}\b"
+)
+WORD_RE = re.compile(r"[a-z0-9]+")
+# words too common in vendor names to identify one
+STOP_WORDS = {
+    "the", "and", "ltd", "limited", "inc", "llc", "plc", "gmbh", "co", "corp", "company",
+    "store", "shop", "services", "group",
+}
+SCALAR_FIELDS = ("amount", "total_amount")
+LABEL_STRIP = " \t:;#-=*$€£¥₦|"
+
+
+def enabled() -> bool:
+    return os.getenv("TEMPLATES", "1").lower() not in ("0", "false", "no", "off")
+
+
+def _words(text: str) -> List[str]:
+    return WORD_RE.findall((text or "").lower())
+
+
+def vendor_key(name: Any) -> str:
+    return " ".join(_words(str(name or "")))
+
+
+def _label(prefix: str) -> str:
+    """Normalized text in front of a value on its line: the anchor."""
+    return re.sub(r"\s+", " ", prefix).strip(LABEL_STRIP).lower()
+
+
+def _numbers(line: str) -> List[Tuple[int, int, float]]:
+    return [(m.start(), m.end(), float(m.group().replace(",", ""))) for m in NUMBER_RE.finditer(line)]
+
+
+def _close(a: Any, b: Any) -> bool:
+    try:
+        a, b = float(a), float(b)
+    except (TypeError, ValueError):
+        return False
+    return abs(a - b) <= max(0.01, abs(b) * 0.001)
+
+
+def _parse_date_token(token: str, dayfirst: bool) -> Optional[datetime]:
+    return dates.parse_date(token, order="dmy" if dayfirst else "mdy")
+
+
+def _lines(text: str) -> List[str]:
+    return [line.strip() for line in (text or "").splitlines() if line.strip()]
+
+
+def _as_dict(data: Any) -> Dict[str, Any]:
+    from src.agents.processing_agent import _field
+
+    products = []
+    for p in _field(data, "products", []) or []:
+        p = p.model_dump() if hasattr(p, "model_dump") else p
+        if isinstance(p, dict):
+            products.append(p)
+    return {
+        "vendor_name": _field(data, "vendor_name"),
+        "amount": _field(data, "amount"),
+        "total_amount": _field(data, "total_amount"),
+        "date": dates.parse_date(_field(data, "date"), vendor=_field(data, "vendor_name")),
+        "products": products,
+    }
+
+
+# --- learning ---------------------------------------------------------------
+
+def _learn_scalar(lines: List[str], value: Any) -> Optional[str]:
+    """Anchor of the last labelled occurrence of value (totals sit below the items)."""
+    anchor = None
+    for line in lines:
+        for start, _, number in _numbers(line):
+            label = _label(line[:start])
+            if _close(number, value) and re.search(r"[a-z]", label):
+                anchor = label
+    return anchor
+
+
+def _learn_date(lines: List[str], value: Optional[datetime]) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    for line in lines:
+        for match in DATE_RE.finditer(line):
+            for dayfirst in (False, True):
+                parsed = _parse_date_token(match.group(), dayfirst)
+                if parsed is not None and parsed.date() == value.date():
+                    return {"anchor": _label(line[:match.start()]), "dayfirst": dayfirst}
+    return None
+
+
+def _learn_products(lines: List[str], products: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Column layout shared by every product line: how many trailing numbers, and which is which."""
+    if not products:
+        return {"count": 0}
+    layout, first_line = None, None
+    for product in products:
+        name = str(product.get("name") or "").lower().strip()
+        found = None
+        for index, line in enumerate(lines):
+            position = line.lower().find(name) if name else -1
+            if position < 0:
+                continue
+            trailing = [n for s, _, n in _numbers(line) if s >= position + len(name)]
+            columns = {}
+            # totals and prices are the rightmost columns, quantities sit left of them
+            for field, order in (("total", -1), ("unit_price", -1), ("quantity", 1)):
+                for i in list(range(len(trailing)))[::order]:
+                    if i not in columns.values() and _close(trailing[i], product.get(field)):
+                        columns[field] = i
+                        break
+            if "total" in columns:
+                found = (index, dict(columns, count=len(trailing)))
+                break
+        if found is None or (layout is not None and found[1] != layout):
+            return None
+        layout = found[1]
+        first_line = found[0] if first_line is None else min(first_line, found[0])
+    # the line above the items (usually the column headings) marks where they start
+    if first_line:
+        heading = _label(lines[first_line - 1])
+        if re.search(r"[a-z]", heading):
+            layout["after"] = heading
+    return layout
+
+
+def learn_locators(text: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Locators for every field of data in text, or None if any field cannot be found."""
+    lines = _lines(text)
+    locators: Dict[str, Any] = {}
+    for field in SCALAR_FIELDS:
+        anchor = _learn_scalar(lines, data.get(field))
+        if anchor is None:
+            return None
+        locators[field] = anchor
+    if data.get("date") is not None:
+        locators["date"] = _learn_date(lines, data["date"])
+        if locators["date"] is None:
+            return None
+    locators["products"] = _learn_products(lines, data.get("products") or [])
+    if locators["products"] is None:
+        return None
+    return locators
+
+
+def _keywords(vendor_name: str, text: str) -> List[str]:
+    """Words of the vendor name that actually appear in the document."""
+    present = set(_words(text))
+    words = [w for w in _words(vendor_name) if w in present and w not in STOP_WORDS and len(w) > 1]
+    return sorted(set(words)) or sorted(set(w for w in _words(vendor_name) if w in present))
+
+
+# --- applying -----------------------------------------------------------------
+
+def _find_scalar(lines: List[str], anchor: str) -> Optional[Tuple[int, float]]:
+    for index, line in enumerate(lines):
+        for start, _, number in _numbers(line):
+            if _label(line[:start]) == anchor:
+                return index, number
+    return None
+
+
+def _find_date(lines: List[str], locator: Dict[str, Any]) -> Optional[Tuple[int, datetime]]:
+    for index, line in enumerate(lines):
+        for match in DATE_RE.finditer(line):
+            if _label(line[:match.start()]) == locator["anchor"]:
+                parsed = _parse_date_token(match.group(), locator.get("dayfirst", False))
+                if parsed is not None:
+                    return index, parsed
+    return None
+
+
+def _find_products(lines: List[str], layout: Dict[str, Any], skip: Set[int],
+                   stop: int) -> List[Dict[str, Any]]:
+    count = layout.get("count", 0)
+    if not count:
+        return []
+    start = 0
+    if layout.get("after"):
+        start = next((i + 1 for i, line in enumerate(lines) if _label(line) == layout["after"]), 0)
+    products = []
+    for index in range(start, stop):
+        if index in skip:
+            continue
+        numbers = _numbers(lines[index])
+        if len(numbers) < count:
+            continue
+        trailing = numbers[-count:]
+        name = lines[index][:trailing[0][0]].strip(LABEL_STRIP + "x×@")
+        if not re.search(r"[A-Za-z]", name):
+            continue
+        values = [n for _, _, n in trailing]
+        total = values[layout["total"]]
+        quantity = values[layout["quantity"]] if "quantity" in layout else 1.0
+        unit_price = values[layout["unit_price"]] if "unit_price" in layout else total / (quantity or 1)
+        products.append({"name": name, "quantity": quantity, "unit_price": unit_price, "total": total})
+    return products
+
+
+def apply_template(template: Dict[str, Any], text: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    """(extracted fields, confidence 0..1) for text, or None when a field is missing."""
+    locators = template["locators"]
+    lines = _lines(text)
+    found: Dict[str, Any] = {"vendor_name": template["vendor_name"], "date": None}
+    totals_lines = set()
+    for field in SCALAR_FIELDS:
+        hit = _find_scalar(lines, locators[field])
+        if hit is None:
+            return None
+        totals_lines.add(hit[0])
+        found[field] = hit[1]
+    skip = set(totals_lines)
+    if locators.get("date"):
+        hit = _find_date(lines, locators["date"])
+        if hit is None:
+            return None
+        skip.add(hit[0])
+        found["date"] = hit[1]
+    # items end at the first totals line
+    found["products"] = _find_products(lines, locators["products"], skip, min(totals_lines))
+    if locators["products"].get("count") and not found["products"]:
+        return None
+
+    # cross-check the numbers the way a reviewer would
+    confidence = min(1.0, template["samples"] / max(1, _min_samples()))
+    if found["products"]:
+        line_sum = sum(p["total"] for p in found["products"])
+        rows_ok = all(_close(p["quantity"] * p["unit_price"], p["total"]) for p in found["products"])
+        if not rows_ok or not (_close(line_sum, found["amount"]) or _close(line_sum, found["total_amount"])):
+            confidence = 0.0
+    elif found["amount"] > found["total_amount"] * 1.5:
+        confidence *= 0.5
+    return found, confidence
+
+
+# --- registry ---------------------------------------------------------------
+
+def _min_samples() -> int:
+    return int(os.getenv("TEMPLATE_MIN_SAMPLES", "2"))
+
+
+def _row_dict(row: VendorTemplateModel) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "document_type": row.document_type,
+        "vendor_key": row.vendor_key,
+        "vendor_name": row.vendor_name,
+        "keywords": list(row.keywords or []),
+        "locators": row.locators,
+        "samples": row.samples,
+    }
+
+
+class TemplateRegistry:
+    """All templates in memory with a keyword -> template inverted index; writes go to the DB."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._index: Dict[str, Set[Tuple[str, str]]] = {}
+        self._hits: Dict[int, int] = {}  # template id -> hits not yet written
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with SessionLocal() as db:
+            rows = db.execute(select(VendorTemplateModel)).scalars().all()
+            for row in rows:
+                self._put(_row_dict(row))
+        self._loaded = True
+
+    def _put(self, template: Dict[str, Any]) -> None:
+        key = (template["document_type"], template["vendor_key"])
+        old = self._templates.get(key)
+        if old:
+            for word in old["keywords"]:
+                self._index.get(word, set()).discard(key)
+        self._templates[key] = template
+        for word in template["keywords"]:
+            self._index.setdefault(word, set()).add(key)
+
+    def identify(self, text: str, document_type: str) -> Optional[Dict[str, Any]]:
+        """The template whose vendor keywords all appear in text; None if none or ambiguous."""
+        with self._lock:
+            self._ensure_loaded()
+            words = set(_words(text))
+            counts: Dict[Tuple[str, str], int] = {}
+            for word in words:
+                for key in self._index.get(word, ()):
+                    if key[0] == document_type:
+                        counts[key] = counts.get(key, 0) + 1
+            complete = [key for key, n in counts.items() if n == len(self._templates[key]["keywords"])]
+            if not complete:
+                return None
+            # prefer the most specific name ("acme foods" over "acme")
+            complete.sort(key=lambda k: len(self._templates[k]["keywords"]), reverse=True)
+            if len(complete) > 1 and len(self._templates[complete[0]]["keywords"]) == len(
+                    self._templates[complete[1]]["keywords"]):
+                return None
+            return dict(self._templates[complete[0]])
+
+    def save(self, template: Dict[str, Any]) -> None:
+        with SessionLocal() as db:
+            row = db.execute(
+                select(VendorTemplateModel).where(
+                    VendorTemplateModel.document_type == template["document_type"],
+                    VendorTemplateModel.vendor_key == template["vendor_key"],
+                )
+            ).scalar_one_or_none()
+            if row is None:
+                row = VendorTemplateModel(document_type=template["document_type"],
+                                          vendor_key=template["vendor_key"])
+                db.add(row)
+            row.vendor_name = template["vendor_name"]
+            row.keywords = template["keywords"]
+            row.locators = template["locators"]
+            row.samples = template["samples"]
+            db.commit()
+            template["id"] = row.id
+        with self._lock:
+            self._put(template)
+
+    def record_hit(self, template: Dict[str, Any]) -> None:
+        with self._lock:
+            self._hits[template["id"]] = self._hits.get(template["id"], 0) + 1
+
+    def flush_hits(self) -> int:
+        """Write the buffered hit counts in one transaction; returns how many templates were updated."""
+        with self._lock:
+            hits, self._hits = self._hits, {}
+        if not hits:
+            return 0
+        try:
+            with SessionLocal() as db:
+                for template_id, count in hits.items():
+                    db.execute(update(VendorTemplateModel).where(VendorTemplateModel.id == template_id)
+                               .values(hits=func.coalesce(VendorTemplateModel.hits, 0) + count))
+                db.commit()
+        except Exception:
+            with self._lock:  # keep them for the next flush
+                for template_id, count in hits.items():
+                    self._hits[template_id] = self._hits.get(template_id, 0) + count
+            raise
+        return len(hits)
+
+    def get(self, document_type: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            template = self._templates.get((document_type, key))
+            return dict(template) if template else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._templates.clear()
+            self._index.clear()
+            self._hits.clear()
+            self._loaded = False
+
+
+_registry = TemplateRegistry()
+
+
+def get_registry() -> TemplateRegistry:
+    return _registry
+
+
+def _agrees(found: Dict[str, Any], data: Dict[str, Any]) -> bool:
+    if not (_close(found["amount"], data.get("amount")) and _close(found["total_amount"], data.get("total_amount"))):
+        return False
+    if data.get("date") is not None and (found["date"] is None or found["date"].date() != data["date"].date()):
+        return False
+    expected = data.get("products") or []
+    if len(found["products"]) != len(expected):
+        return False
+    return all(_close(a["total"], b.get("total")) for a, b in zip(found["products"], expected))
+
+
+def try_extract(document_text: str, document_type: str) -> Optional[Dict[str, Any]]:
+    """Extracted fields from a learned template, or None when the LLM should be used."""
+    if not enabled() or not isinstance(document_text, str):
+        return None  # text spilled to disk (src.utils.limits) is too large to scan line by line
+    with metrics.span("template", document_type=document_type):
+        template = _registry.identify(document_text, document_type)
+        result = apply_template(template, document_text) if template else None
+    min_confidence = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "0.9"))
+    if result is None or result[1] < min_confidence:
+        metrics.inc("template_misses_total", document_type=document_type)
+        return None
+    _registry.record_hit(template)
+    metrics.inc("template_hits_total", document_type=document_type)
+    return dict(result[0], document_type=document_type)
+
+
+def learn(document_text: str, extracted_data: Any, document_type: str) -> None:
+    """Confirm, create or re-learn the vendor's template from a validated LLM extraction."""
+    if not enabled() or not isinstance(document_text, str) or getattr(extracted_data, "_from_template", False):
+        return
+    data = _as_dict(extracted_data)
+    key = vendor_key(data["vendor_name"])
+    if not key or data["total_amount"] is None or data["amount"] is None:
+        return
+    template = _registry.get(document_type, key)
+    if template is not None:
+        applied = apply_template(template, document_text)
+        if applied is not None and _agrees(applied[0], data):
+            template["samples"] += 1
+            _registry.save(template)
+            return
+    locators = learn_locators(document_text, data)
+    keywords = _keywords(str(data["vendor_name"]), document_text)
+    if locators is None or not keywords:
+        if template is not None and template["samples"]:
+            # the layout changed in a way we cannot learn: stop trusting the old one
+            template["samples"] = 0
+            _registry.save(template)
+        return
+    _registry.save({
+        "document_type": document_type,
+        "vendor_key": key,
+        "vendor_name": data["vendor_name"],
+        "keywords": keywords,
+        "locators": locators,
+        "samples": 1,
+    })
+
+
+def learn_validated(document_text: str, extracted_data: Any, document_type: str) -> None:
+    """``learn`` for a document that passed validation and was saved; never fails the document."""
+    try:
+        learn(document_text, extracted_data, document_type)
+    except Exception as e:
+        # a template is only an optimisation
+        print(f"Could not update vendor template: {e}")
+
+
+def flush_hits() -> None:
+    try:
+        _registry.flush_hits()
+    except Exception as e:
+        print(f"Could not record vendor template hits: {e}")
@@ -0,0 +1,262 @@
+"""
+Shared asyncio LLM client used by all extractors.
+
+One ``AsyncOpenAI`` client (and so one pooled HTTP connection set) lives on a
+background event loop for the whole process. Requests are limited by a
+concurrency semaphore plus request- and token-per-minute buckets, and 429/5xx
+or connection errors are retried with jittered exponential backoff.
+
+Synchronous callers (the extractors, batch worker threads) use ``complete()``,
+which hands the request to the shared loop, so many threads can keep several
+requests in flight over the same connections.
+
+Configuration (environment):
+    OPENAI_API_KEY, OPENAI_BASE_URL   the key may be left out only with a custom base URL
+    LLM_MAX_CONCURRENCY   concurrent in-flight requests (default 8)
+    LLM_RPM / LLM_TPM     request and token limits per minute (default 500 / 200000)
+    LLM_MAX_RETRIES       retries on 429/5xx/connection errors (default 5)
+    LLM_TIMEOUT           per-request timeout in seconds (default 60)
+    LLM_FAKE=1            serve responses from a local fake server (offline testing)
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from src.utils import metrics
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# rough completion size reserved from the token bucket before the reply arrives
+_RESERVED_COMPLETION_TOKENS = 512
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for rate limiting."""
+    return max(1, len(text or "") // 4)
+
+
+class RateLimiter:
+    """Token buckets for requests/minute and tokens/minute."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.rpm = float(requests_per_minute)
+        self.tpm = float(tokens_per_minute)
+        self._requests = self.rpm
+        self._tokens = self.tpm
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens: int) -> None:
+        tokens = min(tokens, self.tpm)  # a single huge prompt must still get through
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait_requests = (1 - self._requests) * 60.0 / self.rpm if self._requests < 1 else 0
+                wait_tokens = (tokens - self._tokens) * 60.0 / self.tpm if self._tokens < tokens else 0
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+    def refund(self, tokens: int) -> None:
+        """Give back reserved tokens the request did not actually use."""
+        self._tokens = min(self.tpm, self._tokens + max(0, tokens))
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    try:
+        import openai
+        return isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError))
+    except Exception:
+        return False
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """Pooled, rate-limited chat completion client running on a background event loop."""
+
+    def __init__(
+        self,
+        model: str = DEFAULT_MODEL,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200000,
+        max_retries: int = 5,
+        timeout: float = 60.0,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+    ):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_url = base_url
+        self.api_key = api_key
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._rpm = requests_per_minute
+        self._tpm = tokens_per_minute
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiter: Optional[RateLimiter] = None
+        self.stats: Dict[str, int] = {"requests": 0, "retries": 0, "failures": 0, "tokens": 0}
+
+    # --- event loop plumbing --------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-client", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+        return self._loop
+
+    def _setup(self) -> None:
+        # must run on the loop that will use the client, semaphore and limiter
+        if self._client is not None:
+            return
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            timeout=self.timeout,
+        )
+        api_key = self.api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            if not self.base_url:
+                raise RuntimeError("OPENAI_API_KEY is not set (set it in the environment or .env, "
+                                   "or point OPENAI_BASE_URL at a server that needs no key)")
+            api_key = "not-needed"  # local/self-hosted servers usually ignore the key
+        self._client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            max_retries=0,  # retries are handled here, with our own backoff
+            timeout=self.timeout,
+            http_client=http_client,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._limiter = RateLimiter(self._rpm, self._tpm)
+
+    # --- public API ------------------------------------------------------
+
+    async def acomplete(self, prompt: str, model: Optional[str] = None, **kwargs: Any) -> str:
+        """Send one user prompt and return the reply text."""
+        messages: List[Dict[str, str]] = [{"role": "user", "content": prompt}]
+        return await self.achat(messages, model=model, **kwargs)
+
+    async def achat(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs: Any) -> str:
+        self._setup()
+        kwargs.setdefault("temperature", 0)
+        reserved = sum(estimate_tokens(m["content"]) for m in messages) + _RESERVED_COMPLETION_TOKENS
+        attempt = 0
+        while True:
+            await self._limiter.acquire(reserved)
+            try:
+                async with self._semaphore:
+                    resp = await self._client.chat.completions.create(
+                        model=model or self.model, messages=messages, **kwargs
+                    )
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self.stats["failures"] += 1
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                metrics.inc("llm_retries_total", status=getattr(e, "status_code", None) or type(e).__name__)
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                await asyncio.sleep(delay)
+                continue
+
+            self.stats["requests"] += 1
+            metrics.inc("llm_requests_total")
+            usage = getattr(resp, "usage", None)
+            used = getattr(usage, "total_tokens", None)
+            if used:
+                self.stats["tokens"] += used
+                metrics.inc("llm_tokens_total", used)
+                self._limiter.refund(reserved - used)
+            return resp.choices[0].message.content or ""
+
+    def complete(self, prompt: str, model: Optional[str] = None, **kwargs: Any) -> str:
+        """Blocking wrapper around acomplete() for synchronous callers."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self.acomplete(prompt, model=model, **kwargs), loop)
+        return future.result()
+
+    def complete_many(self, prompts: List[str], model: Optional[str] = None, **kwargs: Any) -> List[Any]:
+        """Send several prompts concurrently; each item is the reply text or the exception raised."""
+        loop = self._ensure_loop()
+
+        async def gather():
+            return await asyncio.gather(
+                *(self.acomplete(p, model=model, **kwargs) for p in prompts), return_exceptions=True
+            )
+
+        return asyncio.run_coroutine_threadsafe(gather(), loop).result()
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = self._thread = self._client = None
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> LLMClient:
+    """Return the process-wide client, configured from the environment on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            base_url = os.getenv("OPENAI_BASE_URL")
+            if os.getenv("LLM_FAKE", "0").lower() in ("1", "true", "yes", "on"):
+                from src.llm.fake_server import start_fake_server
+                base_url = start_fake_server().base_url
+            _client = LLMClient(
+                model=DEFAULT_MODEL,
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                requests_per_minute=float(os.getenv("LLM_RPM", "500")),
+                tokens_per_minute=float(os.getenv("LLM_TPM", "200000")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+                timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+                base_url=base_url,
+            )
+        return _client
@@ -0,0 +1,157 @@
+"""
+Local OpenAI-compatible fake server for offline testing and throughput checks.
+
+Serves ``POST /v1/chat/completions`` with a canned extraction JSON (or the
+output of a custom ``responder``) after a configurable latency, and can inject
+429/500 responses to exercise the client's retry path.
+
+Measure client throughput without network access or API spend:
+    python -m src.llm.fake_server --requests 200 --latency 0.2 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+CANNED_EXTRACTION = {
+    "vendor_name": "Fake Vendor Ltd",
+    "amount": 100.0,
+    "products": [{"name": "Widget", "quantity": 2, "unit_price": 50.0, "total": 100.0}],
+    "total_amount": 107.5,
+    "date": "2024-01-15",
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 resets bursts of new connections
+
+
+class FakeLLMServer:
+    """Threaded HTTP server mimicking the chat completions endpoint."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.05,
+        error_rate: float = 0.0,
+        responder: Optional[Callable[[str], str]] = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.responder = responder or (lambda prompt: json.dumps(CANNED_EXTRACTION))
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "0.05")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    status = random.choice((429, 500))
+                    self._send(status, {"error": {"message": "injected failure", "code": status}})
+                    return
+                prompt = "\n".join(m.get("content", "") for m in request.get("messages", []))
+                content = server.responder(prompt)
+                prompt_tokens = max(1, len(prompt) // 4)
+                completion_tokens = max(1, len(content) // 4)
+                self._send(200, {
+                    "id": f"fake-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def start_fake_server(**kwargs) -> FakeLLMServer:
+    """Start a fake server in a background thread (used when LLM_FAKE=1)."""
+    return FakeLLMServer(**kwargs).start()
+
+
+async def _run_benchmark(client, requests: int) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(client.acomplete(f"document {i}") for i in range(requests)))
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    from src.llm.client import LLMClient
+
+    parser = argparse.ArgumentParser(description="Measure LLM client throughput against a fake server.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 429/500 replies")
+    args = parser.parse_args()
+
+    server = start_fake_server(latency=args.latency, error_rate=args.error_rate)
+    client = LLMClient(max_concurrency=args.concurrency, base_url=server.base_url,
+                       requests_per_minute=1e9, tokens_per_minute=1e12, backoff_base=0.05)
+    try:
+        loop = client._ensure_loop()
+        elapsed = asyncio.run_coroutine_threadsafe(_run_benchmark(client, args.requests), loop).result()
+    finally:
+        client.close()
+        server.stop()
+    print(f"{args.requests} requests in {elapsed:.2f}s "
+          f"({args.requests / elapsed:.1f} req/s, concurrency={args.concurrency}, "
+          f"server hits={server.requests}, retries={client.stats['retries']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,26 @@
 # ...existing code...
 import os
 import sys
-import shutil
-from dotenv import load_dotenv
-from src.database.connection import init_db
-from src.agents.extraction_agent import extraction_agent
-from src.agents.processing_agent import processing_agent
-from src.utils.helpers import extract_text_from_pdf, extract_text_from_image
+import threading
+from src.utils import metrics
+from src.utils.cache import get_cache, sha256_file
 
-load_dotenv()
-init_db()
+# Heavy modules (SQLAlchemy, pydantic, the extractors, Tesseract) are imported
+# inside the functions that use them, and nothing touches the DB or the disk
+# at import time: bootstrap() does that once, when the first document arrives.
 
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+def bootstrap() -> None:
+    """Load .env and create the DB tables (once per process)."""
+    global _bootstrapped
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        from src.database.connection import init_db
+        init_db()  # loads .env before the engine is created
+        _bootstrapped = True
 
 def _get_field(obj, name, default=None):
     try:
@@ -23,45 +31,190 @@ def _get_field(obj, name, default=None):
         except Exception:
             return default
 
+def store_upload(file_path: str, file_hash: str = None) -> str:
+    """Put an uploaded file in the content-addressed store (see src.utils.storage) and return its path."""
+    from src.utils.storage import get_store
+
+    dest, _ = get_store().put(file_path, file_hash)
+    return dest
+
+def extract_text_cached(file_path: str, file_hash: str = None) -> str:
+    """Extract text, reusing the OCR result of any earlier file with the same bytes."""
+    from src.utils.helpers import extract_document_text
+
+    cache = get_cache()
+    if cache is None:
+        return extract_document_text(file_path)
+    file_hash = file_hash or sha256_file(file_path)
+    text = cache.get_text(file_hash)
+    if text is None:
+        text = extract_document_text(file_path)
+        if isinstance(text, str):  # text spilled to disk is too large to cache
+            cache.put_text(file_hash, text)
+    else:
+        print("Reusing cached text extraction")
+    return text
+
 def process_document(file_path: str, document_type: str):
     """Main pipeline: extract text → extract data → save to database"""
+    bootstrap()
+    metrics.start_exporters_from_env()
+    status = "error"
+    with metrics.profile(os.path.basename(file_path)), metrics.span("document", document_type=document_type):
+        try:
+            result = _process_document(file_path, document_type)
+            status = result.get("status", "error")
+            return result
+        finally:
+            from src.extractors import templates
+
+            templates.flush_hits()  # hits counted while extracting, written here rather than per LLM thread
+            metrics.inc("documents_total", document_type=document_type, status=status)
+
+def _process_document(file_path: str, document_type: str):
+    from src.agents.extraction_agent import extraction_agent
+    from src.utils import dedup
+
     file_path = os.path.abspath(file_path)
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Document not found: {file_path}")
+    document_type = document_type.lower()
+
+    # Step 0: skip exact/near-identical re-uploads before paying for OCR or the LLM
+    mode = dedup.policy()
+    file_hash, phash, duplicate = dedup.check_file(file_path, document_type)
+    if duplicate and mode in ("skip", "link"):
+        print(f"⚠️ Duplicate of {duplicate['document_type']} #{duplicate['record_id']} "
+              f"({duplicate['reason']} match), action: {mode}")
+        return dedup.resolve_duplicate(duplicate, mode, file_hash, document_type,
+                                       file_path=file_path, phash=phash)
 
-    # optional: copy uploaded file to uploads/ and use that copy
-    dest = os.path.join(UPLOAD_DIR, f"{int(os.path.getmtime(file_path))}_{os.path.basename(file_path)}")
-    shutil.copy2(file_path, dest)
+    # keep the original in the upload store and work from the stored copy
+    dest = store_upload(file_path, file_hash)
     print(f"Stored uploaded file at: {dest}")
 
     print(f"Processing {document_type}...")
     
     # Step 1: Extract text from document
-    if dest.lower().endswith(".pdf"):
-        document_text = extract_text_from_pdf(dest)
-    else:
-        document_text = extract_text_from_image(dest)
+    document_text = extract_text_cached(dest, file_hash)
+
+    # Step 1b: with "auto", classify locally and split multi-document scans
+    if document_type == "auto":
+        from src.extractors.classifier import segment_document
+
+        with metrics.span("classify"):
+            segments = segment_document(document_text)
+        if len(segments) > 1:
+            return _process_segments(segments, dest, file_hash, phash, mode)
+        document_type = segments[0].document_type
+        print(f"Classified as {document_type} (confidence {segments[0].confidence:.2f})")
     
     # Step 2: Extract structured data
     extracted_data = extraction_agent(document_text, document_type)
+    return _save_extracted(extracted_data, document_type, dest, file_hash, phash, duplicate, mode, document_text)
+
+def _save_extracted(extracted_data, document_type: str, dest: str, file_hash: str, phash, duplicate, mode: str,
+                    document_text: str = None):
+    """Reconcile, content dedup check, DB insert and fingerprint registration for one extracted document."""
+    from src.agents.processing_agent import processing_agent
+    from src.agents.validation_agent import date_review, queue_for_review, review_mode, validation_agent
+    from src.extractors import templates
+    from src.utils import dedup
+
+    # Step 2b: check the arithmetic; one targeted retry, then the review queue
+    extracted_data, check = validation_agent(extracted_data, document_text, document_type)
+    if not check.passed and review_mode() == "hold":
+        check = date_review(extracted_data, check) or check
+        review_id = queue_for_review([(extracted_data, check, document_type, dest, None)])[0]
+        print(f"⚠️ Held for review as #{review_id}")
+        return {"status": "review", "review_id": review_id, "confidence": check.confidence, "issues": check.issues}
 
     # safe access for both pydantic models and dicts
     vendor = _get_field(extracted_data, "vendor_name", "<unknown>")
     total = _get_field(extracted_data, "total_amount", _get_field(extracted_data, "amount", "<unknown>"))
     print(f"✅ Extracted: {vendor} - ${total}")
+
+    # a re-scan or new photo of a document we already have
+    content_fp = dedup.content_fingerprint(extracted_data)
+    if duplicate is None and mode != "off":
+        duplicate = dedup.find_content_duplicate(content_fp, document_type)
+        if duplicate and mode in ("skip", "link"):
+            print(f"⚠️ Duplicate of {duplicate['document_type']} #{duplicate['record_id']} "
+                  f"({duplicate['reason']} match), action: {mode}")
+            return dedup.resolve_duplicate(duplicate, mode, file_hash, document_type,
+                                           file_path=dest, phash=phash, content_fp=content_fp)
     
     # Step 3: Process and save to database
     result = processing_agent(extracted_data, source_file_path=dest if 'source_file_path' in processing_agent.__code__.co_varnames else None)
     print(f"✅ Saved to database: {result}")
+
+    if result.get("status") == "success":
+        dedup.register(file_hash, document_type, record_id=result["id"], file_path=dest,
+                       phash=phash, content_fp=content_fp,
+                       status="flagged" if duplicate else "unique",
+                       duplicate_of=duplicate["fingerprint_id"] if duplicate else None)
+        if duplicate:
+            print(f"⚠️ Flagged as possible duplicate of {duplicate['document_type']} #{duplicate['record_id']}")
+            result["duplicate_of"] = duplicate
+        if _get_field(extracted_data, "date_ambiguous"):
+            result["date_ambiguous"] = True
+        review = date_review(extracted_data, check) or (None if check.passed else check)
+        if review is not None:
+            result["review_id"] = queue_for_review([(extracted_data, review, document_type, dest, result["id"])])[0]
+            print(f"⚠️ Queued for review as #{result['review_id']}: {'; '.join(review.issues)}")
+        else:
+            templates.learn_validated(document_text, extracted_data, document_type)
     
     return result
 
+def _process_segments(segments, dest: str, file_hash: str, phash, mode: str):
+    """
+    A file holding several documents: extract them in parallel (SEGMENT_WORKERS
+    threads; the LLM client enforces its own rate limits), then save each one
+    as its own row. The result lists every document with its page range.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from src.agents.extraction_agent import extraction_agent
+
+    print(f"Found {len(segments)} documents: " + ", ".join(
+        f"{s.document_type} (pages {s.first_page}-{s.last_page})" for s in segments))
+    workers = max(1, min(len(segments), int(os.getenv("SEGMENT_WORKERS", "4"))))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extraction_agent, s.text, s.document_type) for s in segments]
+
+    documents = []
+    for segment, future in zip(segments, futures):
+        try:
+            result = _save_extracted(future.result(), segment.document_type, dest, file_hash, phash, None, mode,
+                                     segment.text)
+        except Exception as e:
+            print(f"❌ Pages {segment.first_page}-{segment.last_page} failed: {e}")
+            result = {"status": "error", "message": str(e)}
+        result["pages"] = [segment.first_page, segment.last_page]
+        result.setdefault("type", segment.document_type)
+        documents.append(result)
+
+    failed = sum(1 for r in documents if r.get("status") == "error")
+    held = sum(1 for r in documents if r.get("status") == "review")
+    status = "success" if not failed + held else ("error" if failed == len(documents) else "partial")
+    result = {"status": status, "type": "auto", "documents": documents}
+    if failed or held:
+        result["message"] = ", ".join(part for part in (
+            f"{failed} of {len(documents)} documents failed" if failed else "",
+            f"{held} held for review" if held else "") if part)
+    return result
+
 if __name__ == "__main__":
     # Usage:
-    # python -m src.main <path-to-file> <invoice|receipt>
+    # python -m src.main <path-to-file> <invoice|receipt|auto>
+    # For many files at once see src.batch:
+    # python -m src.batch <dir|glob|manifest> <invoice|receipt|auto>
     if len(sys.argv) >= 3:
         path = sys.argv[1]
         doc_type = sys.argv[2]
+    elif len(sys.argv) == 2 and sys.argv[1] in ("-h", "--help"):
+        print("Usage: python -m src.main <path-to-file> <invoice|receipt|auto>")
+        sys.exit(0)
     else:
         # fallback example (you can remove these defaults)
         path = "invoice.pdf"
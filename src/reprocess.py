@@ -0,0 +1,409 @@
+"""
+Re-extract documents that are already in the database, e.g. after a prompt
+or model change.
+
+Existing invoices/receipts are walked in id order. Each stored upload
+(``file_path``) is re-run from a chosen stage onwards, and the result is
+written to ``document_versions`` under a version label. The original rows
+are left untouched:
+
+    --from-stage ocr         text extraction again (ignores the OCR cache), then llm, normalize
+    --from-stage llm         text from the OCR cache, a fresh LLM extraction, then normalize (default)
+    --from-stage normalize   no file access: re-normalize the stored fields (dates, products)
+
+The llm stage always asks the model (``--model``, default the extractors'
+MODEL_NAME) and never answers from the LLM cache; its replies still refresh
+the cache. The prompt is the one in the extractors; change it there (and
+bump PROMPT_VERSION) before reprocessing.
+
+Documents run on ``--workers`` threads (the shared LLM client enforces its
+own rate limits), with at most twice that many in flight. Results are saved
+by the main thread every CHECKPOINT_ROWS documents or CHECKPOINT_SECONDS.
+Each save is one transaction that also moves the run's checkpoint
+(``reprocess_checkpoints``) to the highest id with every document before it
+done. After a crash or Ctrl+C, running the same command again continues from
+there. Documents already finished past the checkpoint are skipped.
+
+    python -m src.reprocess --types invoice --workers 8
+    python -m src.reprocess --model gpt-4o                 # version prompt2-gpt-4o
+    python -m src.reprocess --dry-run --limit 50 --report diff.jsonl   # compare, write nothing
+    python -m src.reprocess --status
+
+The version defaults to the extractors' prompt version and the model
+(``prompt2-gpt-4o-mini``), with the first stage appended when it is not llm
+(``prompt2-gpt-4o-mini-ocr``, ``normalize``). ``--version`` only sets that
+label. A version keeps the stages it was started with: continuing it from a
+different stage is refused. ``--restart`` starts the version again from the
+first id (with the new stages) and overwrites its earlier results.
+
+A row extracted from a multi-document scan (document type ``auto``) points
+at the whole file. Its pages are found again by splitting the file and
+matching the row's total and vendor.
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from src.main import bootstrap, extract_text_cached
+from src.utils import metrics
+
+STAGES = ("ocr", "llm", "normalize")
+CHECKPOINT_ROWS = 50
+CHECKPOINT_SECONDS = 10.0
+FIELDS = ("vendor_name", "amount", "total_amount", "date", "products")
+
+
+def default_version(document_type: str, from_stage: str = "llm", model: Optional[str] = None) -> str:
+    """Label for results of the current extractor: its prompt version and model, and the first stage."""
+    if from_stage == "normalize":
+        return "normalize"  # neither prompt nor model is involved
+    if document_type == "invoice":
+        from src.extractors import invoice_extractor as extractor
+    else:
+        from src.extractors import receipt_extractor as extractor
+    version = f"prompt{extractor.PROMPT_VERSION}-{model or extractor.MODEL_NAME}"
+    return version if from_stage == "llm" else f"{version}-{from_stage}"
+
+
+def _stages(from_stage: str) -> str:
+    return ",".join(STAGES[STAGES.index(from_stage):])
+
+
+def _products(value: Any) -> List[Dict[str, Any]]:
+    if isinstance(value, str):
+        value = json.loads(value or "[]")
+    return [{k: p.get(k) for k in ("name", "quantity", "unit_price", "total")} for p in value or []]
+
+
+def _plain(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def diff(row: Any, values: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """Fields that differ between a stored row and its re-extraction: field -> [old, new]."""
+    changes = {}
+    for name in FIELDS:
+        old, new = getattr(row, name), values.get(name)
+        if name == "products":
+            old, new = _products(old), _products(new)
+            same = old == new
+        elif name == "date":
+            same = (old.date() if old else None) == (new.date() if new else None)
+        elif name in ("amount", "total_amount"):
+            same = old is not None and new is not None and abs(old - new) < 0.005 or old == new
+        else:
+            same = (old or "").strip().lower() == (new or "").strip().lower()
+        if not same:
+            changes[name] = [_plain(old), _plain(new)]
+    return changes
+
+
+def _document_text(row: Any, document_type: str, fresh_ocr: bool) -> str:
+    """The row's text: its whole file or, for multi-document scans, the pages the row came from."""
+    from src.extractors.classifier import segment_document
+
+    if fresh_ocr:
+        from src.utils.cache import get_cache, sha256_file
+        from src.utils.helpers import extract_document_text
+
+        text = extract_document_text(row.file_path)
+        cache = get_cache()
+        if cache is not None and isinstance(text, str):
+            cache.put_text(sha256_file(row.file_path), text)
+    else:
+        text = extract_text_cached(row.file_path)
+    segments = [s for s in segment_document(text) if s.document_type == document_type]
+    if len(segments) <= 1:
+        return text
+    total, vendor = f"{row.total_amount:.2f}", (row.vendor_name or "").lower()
+    matches = [s for s in segments if total in s.text.replace(",", "")] or segments
+    if len(matches) > 1:
+        matches = [s for s in matches if vendor and vendor in s.text.lower()] or matches
+    if len(matches) > 1:
+        raise ValueError(f"{len(segments)} {document_type}s in {row.file_path}; cannot tell which one this row is")
+    return matches[0].text
+
+
+def reprocess_one(row: Any, document_type: str, from_stage: str, model: Optional[str] = None) -> Dict[str, Any]:
+    """Re-run one stored document from `from_stage`; the values for its document_versions row."""
+    from src.agents import validation_agent as validation
+    from src.agents.processing_agent import _build_record
+    from src.extractors.invoice_extractor import extract_invoice_data
+    from src.extractors.receipt_extractor import extract_receipt_data
+    from src.utils import dates
+
+    result: Dict[str, Any] = {"record_id": row.id, "document_type": document_type, "stages": _stages(from_stage)}
+    try:
+        if from_stage == "normalize":
+            data = {name: getattr(row, name) for name in ("vendor_name", "amount", "total_amount", "date")}
+            data["products"] = _products(row.products)
+        elif not row.file_path or not os.path.exists(row.file_path):
+            return dict(result, status="missing", error=f"Stored file not found: {row.file_path}")
+        else:
+            text = _document_text(row, document_type, fresh_ocr=from_stage == "ocr")
+            extract = extract_invoice_data if document_type == "invoice" else extract_receipt_data
+            with metrics.span("reprocess", document_type=document_type):
+                data = extract(text, model=model, use_cache=False)
+            data = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+            if validation.enabled():
+                result["confidence"] = validation.validate(data).confidence
+        data["document_type"] = document_type
+        _, _, values = _build_record(data, row.file_path)
+        if dates.parse_date(data.get("date")) is None:
+            values["date"] = None  # _build_record would fill in today
+    except Exception as e:
+        return dict(result, status="error", error=str(e))
+    values["products"] = _products(values["products"])
+    values.pop("file_path", None)
+    changes = diff(row, values)
+    return dict(result, **values, changes=changes, status="changed" if changes else "unchanged")
+
+
+class _Progress:
+    """Results waiting to be saved, and the contiguous id watermark they allow."""
+
+    def __init__(self, checkpoint: Dict[str, Any]):
+        self.checkpoint = checkpoint
+        self.submitted: deque = deque()
+        self.finished = set()
+        self.buffer: List[Dict[str, Any]] = []
+        self.saved_at = time.monotonic()
+
+    def add(self, result: Dict[str, Any]) -> None:
+        self.buffer.append(result)
+        self.finished.add(result["record_id"])
+        self.checkpoint["processed"] += 1
+        self.checkpoint["changed"] += result["status"] == "changed"
+        self.checkpoint["failed"] += result["status"] in ("error", "missing")
+
+    def watermark(self) -> int:
+        while self.submitted and self.submitted[0] in self.finished:
+            self.finished.discard(self.submitted[0])
+            self.checkpoint["last_id"] = self.submitted.popleft()
+        return self.checkpoint["last_id"]
+
+    def due(self) -> bool:
+        return len(self.buffer) >= CHECKPOINT_ROWS or (
+            bool(self.buffer) and time.monotonic() - self.saved_at >= CHECKPOINT_SECONDS)
+
+
+def _load_checkpoint(version: str, document_type: str, stages: str, restart: bool) -> Dict[str, Any]:
+    from src.database.connection import SessionLocal
+    from src.database.models import ReprocessCheckpointModel
+
+    with SessionLocal() as db:
+        row = db.query(ReprocessCheckpointModel).filter_by(version=version, document_type=document_type).first()
+        if row is not None and not restart:
+            if row.stages != stages:
+                raise ValueError(f"{document_type} {version} was run with stages {row.stages}, not {stages}; "
+                                 f"use another --version, or --restart to redo it")
+            return {"last_id": row.last_id, "processed": row.processed, "changed": row.changed,
+                    "failed": row.failed, "stages": row.stages, "resumed": row.last_id > 0}
+    return {"last_id": 0, "processed": 0, "changed": 0, "failed": 0, "stages": stages, "resumed": False}
+
+
+def _save(version: str, document_type: str, progress: _Progress, finished: bool = False) -> None:
+    """Write buffered results and move the checkpoint, in one transaction."""
+    from sqlalchemy import delete, insert
+
+    from src.database.connection import SessionLocal
+    from src.database.models import DocumentVersionModel, ReprocessCheckpointModel
+
+    results, progress.buffer = progress.buffer, []
+    progress.saved_at = time.monotonic()
+    state = progress.checkpoint
+    state["last_id"] = progress.watermark()
+    columns = {c.name for c in DocumentVersionModel.__table__.columns}
+    with SessionLocal() as db, metrics.span("db_commit", mode="reprocess"):
+        if results:
+            db.execute(delete(DocumentVersionModel).where(
+                DocumentVersionModel.version == version,
+                DocumentVersionModel.document_type == document_type,
+                DocumentVersionModel.record_id.in_([r["record_id"] for r in results])))
+            db.execute(insert(DocumentVersionModel),
+                       [{k: v for k, v in dict(r, version=version).items() if k in columns} for r in results])
+        row = db.query(ReprocessCheckpointModel).filter_by(version=version, document_type=document_type).first()
+        if row is None:
+            row = ReprocessCheckpointModel(version=version, document_type=document_type)
+            db.add(row)
+        row.stages = state["stages"]  # a resumed run keeps the stages it was started with
+        for name in ("last_id", "processed", "changed", "failed"):
+            setattr(row, name, state[name])
+        row.finished_at = datetime.now() if finished else None
+        db.commit()
+
+
+def _already_done(version: str, document_type: str, ids: List[int]) -> set:
+    """Ids past the checkpoint that an interrupted run had already saved."""
+    from sqlalchemy import select
+
+    from src.database.connection import SessionLocal
+    from src.database.models import DocumentVersionModel
+
+    with SessionLocal() as db:
+        return set(db.execute(select(DocumentVersionModel.record_id).where(
+            DocumentVersionModel.version == version, DocumentVersionModel.document_type == document_type,
+            DocumentVersionModel.record_id.in_(ids))).scalars())
+
+
+def reprocess(document_type: str, version: Optional[str] = None, from_stage: str = "llm", workers: int = 8,
+              dry_run: bool = False, limit: Optional[int] = None, restart: bool = False, model: Optional[str] = None,
+              on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Re-extract the stored `document_type` documents into document_versions,
+    resuming from the last checkpoint of `version`. With dry_run nothing is
+    written (and the checkpoint is ignored); every result goes to on_result.
+    Raises ValueError when `version` was started from another stage.
+    """
+    from src.database.export import iter_chunks
+
+    bootstrap()
+    version = version or default_version(document_type, from_stage, model)
+    stages = _stages(from_stage)
+    checkpoint = ({"last_id": 0, "processed": 0, "changed": 0, "failed": 0, "stages": stages, "resumed": False}
+                  if dry_run else _load_checkpoint(version, document_type, stages, restart))
+    if checkpoint["resumed"]:
+        print(f"Resuming {document_type} {version} after #{checkpoint['last_id']} "
+              f"({checkpoint['processed']} done before)")
+    progress = _Progress(checkpoint)
+    started, count = time.perf_counter(), 0
+    window = max(1, workers) * 2
+    pending: Dict[Any, Any] = {}
+
+    def collect(return_when=FIRST_COMPLETED) -> None:
+        done, _ = wait(list(pending), return_when=return_when)
+        for future in done:
+            row = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:  # reprocess_one reports its own errors; this is a bug guard
+                result = {"record_id": row.id, "document_type": document_type, "stages": stages,
+                          "status": "error", "error": str(e)}
+            metrics.inc("reprocessed_documents_total", document_type=document_type, status=result["status"])
+            progress.add(result)
+            if on_result:
+                on_result(result)
+        if progress.due() and not dry_run:
+            _save(version, document_type, progress)
+            rate = count / max(time.perf_counter() - started, 1e-9)
+            print(f"✅ {document_type} {version}: through #{checkpoint['last_id']}, {checkpoint['processed']} done "
+                  f"({checkpoint['changed']} changed, {checkpoint['failed']} failed), {rate:.1f} docs/s")
+        elif dry_run:
+            progress.buffer.clear()
+            progress.watermark()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="reprocess")
+    try:
+        for rows in iter_chunks(document_type, checkpoint["last_id"], size=max(window, 200)):
+            skip = set() if dry_run or restart else _already_done(version, document_type, [r.id for r in rows])
+            for row in rows:
+                if limit is not None and count >= limit:
+                    break
+                if row.id in skip:
+                    continue
+                while len(pending) >= window:
+                    collect()
+                progress.submitted.append(row.id)
+                pending[pool.submit(reprocess_one, row, document_type, from_stage, model)] = row
+                count += 1
+            if limit is not None and count >= limit:
+                break
+        while pending:
+            collect()
+        if not dry_run:
+            _save(version, document_type, progress, finished=limit is None or count < limit)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        if not dry_run:
+            _save(version, document_type, progress)
+            print(f"⚠️ Interrupted; checkpoint saved at #{checkpoint['last_id']}. Run the same command to resume.")
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return {"version": version, "documents": count, "last_id": checkpoint["last_id"],
+            "processed": checkpoint["processed"], "changed": checkpoint["changed"], "failed": checkpoint["failed"],
+            "seconds": round(time.perf_counter() - started, 1)}
+
+
+def status() -> List[Dict[str, Any]]:
+    """Every reprocessing run's checkpoint, newest first."""
+    from src.database.connection import SessionLocal
+    from src.database.models import ReprocessCheckpointModel
+
+    with SessionLocal() as db:
+        rows = db.query(ReprocessCheckpointModel).order_by(ReprocessCheckpointModel.updated_at.desc()).all()
+        return [{"version": r.version, "document_type": r.document_type, "stages": r.stages, "last_id": r.last_id,
+                 "processed": r.processed, "changed": r.changed, "failed": r.failed,
+                 "finished": r.finished_at is not None} for r in rows]
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    name = f"{result['document_type']} #{result['record_id']}"
+    if result["status"] == "changed":
+        for field, (old, new) in result["changes"].items():
+            if field == "products":
+                old, new = f"{len(old)} lines", f"{len(new)} lines"
+            print(f"~ {name} {field}: {old!r} -> {new!r}")
+    elif result["status"] in ("error", "missing"):
+        print(f"❌ {name}: {result['error']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-extract stored invoices/receipts into a new version.")
+    parser.add_argument("--types", nargs="+", choices=("invoice", "receipt"), default=["invoice", "receipt"])
+    parser.add_argument("--version", help="label for the new results (default: prompt<N>-<model>[-<stage>])")
+    parser.add_argument("--model", help="LLM for the llm stage (default: the extractors' MODEL_NAME)")
+    parser.add_argument("--from-stage", choices=STAGES, default="llm",
+                        help="first stage to re-run; the stages after it always run")
+    parser.add_argument("--workers", type=int, default=8, help="documents processed concurrently")
+    parser.add_argument("--dry-run", action="store_true", help="print what would change, write nothing")
+    parser.add_argument("--limit", type=int, help="stop after this many documents per type")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and redo the version")
+    parser.add_argument("--report", help="write per-document results (with diffs) as JSON lines to this path")
+    parser.add_argument("--status", action="store_true", help="show the checkpoints of earlier runs")
+    args = parser.parse_args(argv)
+
+    bootstrap()
+    if args.status:
+        for run in status():
+            state = "finished" if run["finished"] else f"stopped after #{run['last_id']}"
+            print(f"{run['version']} {run['document_type']} ({run['stages']}): {run['processed']} done, "
+                  f"{run['changed']} changed, {run['failed']} failed, {state}")
+        return 0
+
+    metrics.start_exporters_from_env()
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+
+    def on_result(result: Dict[str, Any]) -> None:
+        if args.dry_run or result["status"] in ("error", "missing"):
+            _print_result(result)
+        if report:
+            report.write(json.dumps({k: _plain(v) for k, v in result.items()}) + "\n")
+
+    failed = 0
+    try:
+        for document_type in args.types:
+            summary = reprocess(document_type, args.version, args.from_stage, args.workers, dry_run=args.dry_run,
+                                limit=args.limit, restart=args.restart, model=args.model, on_result=on_result)
+            failed += summary["failed"]
+            print(f"Done {document_type} {summary['version']}{' (dry run)' if args.dry_run else ''}: "
+                  f"{summary['documents']} documents in {summary['seconds']}s; {summary['processed']} total, "
+                  f"{summary['changed']} changed, {summary['failed']} failed")
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if report:
+            report.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
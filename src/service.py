@@ -0,0 +1,405 @@
+"""
+Long-running service: warm workers behind a local HTTP API and a SQLite job queue.
+
+Imports, the DB engine, the LLM client and its connection pool are set up once,
+so a submitted document only pays for its own OCR/LLM/DB work.
+
+    python -m src.service serve [--host 127.0.0.1] [--port 8080] [--workers 4]
+
+HTTP API (JSON):
+    POST /jobs                      {"file_path": "...", "document_type": "invoice"}  (invoice | receipt | auto)
+    POST /jobs?document_type=receipt&filename=r.jpg   raw file bytes, streamed into the upload store
+                                    -> 202 {"id": "...", "status": "queued"}
+    GET  /jobs/<id>                 status, and the pipeline result once done
+    GET  /health                    worker count and queue depth
+    GET  /metrics                   Prometheus text format
+
+The ``jobs`` table is the queue, so other processes can submit without HTTP:
+
+    python -m src.service submit path/to/invoice.pdf invoice
+    python -m src.service status <job id>
+
+Workers claim queued jobs with a conditional UPDATE, so several service
+processes can share one database. A claimed job records the claiming process
+(host:pid:nonce) and that process refreshes the job's heartbeat while it runs.
+Any service re-queues running jobs whose heartbeat is older than
+SERVICE_STALE_AFTER seconds (their process died); jobs a live process is
+working on are left alone. On SIGINT/SIGTERM the service stops taking
+requests, lets running jobs finish (up to SERVICE_SHUTDOWN_TIMEOUT seconds)
+and exits; jobs it leaves running go stale and are picked up again.
+
+    SERVICE_WORKERS=4              documents processed concurrently
+    SERVICE_POLL_INTERVAL=1.0      seconds between queue checks when idle
+    SERVICE_HEARTBEAT_INTERVAL=15  seconds between heartbeats for running jobs
+    SERVICE_STALE_AFTER=120        heartbeat age after which a running job is re-queued
+    SERVICE_SHUTDOWN_TIMEOUT=60
+    SERVICE_MAX_UPLOAD_MB=50
+
+Databases whose jobs table predates worker_id/heartbeat_at need
+``python -m src.database.migrations`` once.
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from sqlalchemy import func, select, update
+
+from src.database.connection import SessionLocal, init_db
+from src.database.models import JobModel
+from src.utils import metrics
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+def _job_dict(job: JobModel) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "file_path": job.file_path,
+        "document_type": job.document_type,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "worker_id": job.worker_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def submit_job(file_path: str, document_type: str) -> str:
+    """Queue a document and return its job id."""
+    document_type = document_type.lower()
+    if document_type not in ("invoice", "receipt", "auto"):
+        raise ValueError(f"Unknown document type: {document_type}")
+    file_path = os.path.abspath(file_path)
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Document not found: {file_path}")
+    job_id = uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(JobModel(id=job_id, file_path=file_path, document_type=document_type, status="queued"))
+        db.commit()
+    metrics.inc("service_jobs_total", status="queued")
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with SessionLocal() as db:
+        job = db.get(JobModel, job_id)
+        return _job_dict(job) if job is not None else None
+
+
+def queue_depth() -> Dict[str, int]:
+    with SessionLocal() as db:
+        rows = db.execute(select(JobModel.status, func.count()).group_by(JobModel.status)).all()
+    counts = {status: 0 for status in JOB_STATUSES}
+    counts.update({status: n for status, n in rows})
+    return counts
+
+
+def claim_job(worker_id: str) -> Optional[JobModel]:
+    """Atomically move the oldest queued job to running for `worker_id`; None when the queue is empty."""
+    with SessionLocal() as db:
+        while True:
+            job_id = db.execute(
+                select(JobModel.id).where(JobModel.status == "queued")
+                .order_by(JobModel.created_at).limit(1)
+            ).scalar_one_or_none()
+            if job_id is None:
+                return None
+            now = datetime.now()
+            claimed = db.execute(
+                update(JobModel)
+                .where(JobModel.id == job_id, JobModel.status == "queued")
+                .values(status="running", started_at=now, heartbeat_at=now, worker_id=worker_id,
+                        attempts=JobModel.attempts + 1)
+            ).rowcount
+            db.commit()
+            if claimed:
+                job = db.get(JobModel, job_id)
+                db.expunge(job)
+                return job
+            # another worker got it first; try the next one
+
+
+def finish_job(job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+               worker_id: Optional[str] = None) -> bool:
+    """Record a job's outcome. With `worker_id`, only if that worker still owns the job; False otherwise."""
+    status = "failed" if error is not None else "done"
+    condition = [JobModel.id == job_id]
+    if worker_id is not None:
+        # re-queued as stale and claimed elsewhere: the newer run's outcome wins
+        condition += [JobModel.worker_id == worker_id, JobModel.status == "running"]
+    with SessionLocal() as db:
+        finished = db.execute(
+            update(JobModel).where(*condition).values(
+                status=status,
+                # round-trip through JSON so dates and pydantic values are stored as strings
+                result=json.loads(json.dumps(result, default=str)) if result is not None else None,
+                error=error,
+                finished_at=datetime.now(),
+            )
+        ).rowcount
+        db.commit()
+    if finished:
+        metrics.inc("service_jobs_total", status=status)
+    return bool(finished)
+
+
+def heartbeat(worker_id: str) -> int:
+    """Mark every job `worker_id` is running as still alive."""
+    with SessionLocal() as db:
+        count = db.execute(
+            update(JobModel).where(JobModel.status == "running", JobModel.worker_id == worker_id)
+            .values(heartbeat_at=datetime.now())
+        ).rowcount
+        db.commit()
+    return count
+
+
+def requeue_stale(stale_after: float) -> int:
+    """Running jobs whose process stopped heartbeating `stale_after` seconds ago go back to the queue."""
+    cutoff = datetime.now() - timedelta(seconds=stale_after)
+    with SessionLocal() as db:
+        count = db.execute(
+            update(JobModel)
+            .where(JobModel.status == "running",
+                   (JobModel.heartbeat_at < cutoff) | JobModel.heartbeat_at.is_(None))
+            .values(status="queued", started_at=None, heartbeat_at=None, worker_id=None)
+        ).rowcount
+        db.commit()
+    return count
+
+
+class Service:
+    """Worker threads pulling from the jobs table, plus the HTTP front end."""
+
+    def __init__(self, workers: int = 4, poll_interval: float = 1.0, upload_dir: Optional[str] = None,
+                 heartbeat_interval: float = 15.0, stale_after: float = 120.0):
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.upload_dir = upload_dir
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = max(stale_after, 2 * heartbeat_interval)  # never outrun our own heartbeat
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    # --- workers ------------------------------------------------------------
+
+    def start_workers(self) -> None:
+        from src.main import process_document  # the warm pipeline, imported once
+
+        self._process_document = process_document
+        for i in range(self.workers):
+            # daemon: a job still running after the shutdown timeout must not keep the process alive
+            thread = threading.Thread(target=self._worker, name=f"service-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._heartbeat, name="service-heartbeat", daemon=True).start()
+
+    def _heartbeat(self) -> None:
+        """Keep this process's running jobs fresh and re-queue those of processes that died."""
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                heartbeat(self.worker_id)
+                requeued = requeue_stale(self.stale_after)
+                if requeued:
+                    print(f"Re-queued {requeued} jobs from a service that stopped heartbeating")
+            except Exception as e:
+                print(f"❌ Could not update the job queue: {e}")
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = claim_job(self.worker_id)
+            except Exception as e:
+                print(f"❌ Could not read the job queue: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self._lock:
+                self._busy += 1
+            try:
+                result = self._process_document(job.file_path, job.document_type)
+                if result.get("status") == "error":
+                    finish_job(job.id, result=result, error=result.get("message") or "processing failed",
+                               worker_id=self.worker_id)
+                else:
+                    finish_job(job.id, result=result, worker_id=self.worker_id)
+                print(f"✅ Job {job.id} ({os.path.basename(job.file_path)}): {result.get('status')}")
+            except Exception as e:
+                finish_job(job.id, error=str(e), worker_id=self.worker_id)
+                print(f"❌ Job {job.id} ({os.path.basename(job.file_path)}) failed: {e}")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def notify(self) -> None:
+        """Wake idle workers after a submission instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    # --- HTTP ----------------------------------------------------------------
+
+    def _save_upload(self, stream, length: int, filename: str) -> str:
+        """Stream a request body into the upload store, hashing as it is written."""
+        from src.utils.storage import UploadStore, get_store
+
+        store = UploadStore(self.upload_dir) if self.upload_dir else get_store()
+        suffix = re.sub(r"[^A-Za-z0-9.]+", "", os.path.splitext(os.path.basename(filename or ""))[1])[:10]
+        path, _ = store.put_stream(stream, suffix, length=length)
+        return path
+
+    def _handler_class(self):
+        service = self
+        max_upload = int(float(os.getenv("SERVICE_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: Any, content_type: str = "application/json") -> None:
+                body = payload if isinstance(payload, bytes) else json.dumps(payload, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip("/")
+                if path == "/health":
+                    self._send(200, {"status": "stopping" if service._stop.is_set() else "ok",
+                                     "workers": service.workers, "busy": service._busy,
+                                     "jobs": queue_depth()})
+                elif path == "/metrics":
+                    self._send(200, metrics.render_prometheus().encode("utf-8"),
+                               "text/plain; version=0.0.4; charset=utf-8")
+                elif path.startswith("/jobs/"):
+                    job = get_job(path.rsplit("/", 1)[1])
+                    self._send(200 if job else 404, job or {"error": "unknown job id"})
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path.rstrip("/") != "/jobs":
+                    self._send(404, {"error": "not found"})
+                    return
+                if service._stop.is_set():
+                    self._send(503, {"error": "service is shutting down"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > max_upload:
+                    self._send(413, {"error": f"upload larger than {max_upload} bytes"})
+                    return
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                try:
+                    if (self.headers.get("Content-Type") or "").startswith("application/json"):
+                        request = json.loads(self.rfile.read(length) or b"{}")
+                        file_path = request["file_path"]
+                        document_type = request.get("document_type", "invoice")
+                    else:
+                        file_path = service._save_upload(self.rfile, length, query.get("filename", "upload"))
+                        document_type = query.get("document_type", "invoice")
+                    job_id = submit_job(file_path, document_type)
+                except (KeyError, ValueError, OSError) as e:
+                    self._send(400, {"error": str(e)})
+                    return
+                service.notify()
+                self._send(202, {"id": job_id, "status": "queued", "url": f"/jobs/{job_id}"})
+
+        return Handler
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """Run until SIGINT/SIGTERM, then shut down gracefully."""
+        from src.main import bootstrap
+
+        bootstrap()
+        requeued = requeue_stale(self.stale_after)
+        if requeued:
+            print(f"Re-queued {requeued} jobs from a service that stopped heartbeating")
+        self.start_workers()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="service-http", daemon=True).start()
+        print(f"Serving on http://{host}:{self._httpd.server_address[1]} with {self.workers} workers")
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self._stop.set())
+        while not self._stop.is_set():
+            self._stop.wait(1.0)
+        self.shutdown(float(os.getenv("SERVICE_SHUTDOWN_TIMEOUT", "60")))
+
+    def shutdown(self, timeout: float = 60.0) -> None:
+        """Stop accepting work and wait for running jobs to finish."""
+        print("Shutting down: waiting for running jobs...")
+        self._stop.set()
+        self._wakeup.set()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        unfinished = sum(t.is_alive() for t in self._threads)
+        if unfinished:
+            print(f"⚠️ {unfinished} jobs still running after {timeout:.0f}s; they will be re-queued once stale")
+        else:
+            print("All workers stopped")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Invoice/receipt extraction service.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="run the HTTP API and workers")
+    serve.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    serve.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    serve.add_argument("--workers", type=int, default=int(os.getenv("SERVICE_WORKERS", "4")))
+    serve.add_argument("--poll-interval", type=float,
+                       default=float(os.getenv("SERVICE_POLL_INTERVAL", "1.0")))
+    serve.add_argument("--heartbeat-interval", type=float,
+                       default=float(os.getenv("SERVICE_HEARTBEAT_INTERVAL", "15")))
+    serve.add_argument("--stale-after", type=float,
+                       default=float(os.getenv("SERVICE_STALE_AFTER", "120")))
+    submit = sub.add_parser("submit", help="queue a document without going through HTTP")
+    submit.add_argument("file_path")
+    submit.add_argument("document_type", nargs="?", default="invoice")
+    status = sub.add_parser("status", help="show a job")
+    status.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        metrics.start_exporters_from_env()
+        Service(workers=args.workers, poll_interval=args.poll_interval,
+                heartbeat_interval=args.heartbeat_interval, stale_after=args.stale_after).serve(args.host, args.port)
+        return 0
+    init_db()
+    if args.command == "submit":
+        print(submit_job(args.file_path, args.document_type))
+        return 0
+    job = get_job(args.job_id)
+    print(json.dumps(job, indent=2, default=str) if job else f"Unknown job: {args.job_id}")
+    return 0 if job else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
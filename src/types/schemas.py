@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import List, Optional
 from datetime import datetime
 
@@ -15,6 +15,8 @@ class ExtractedData(BaseModel):
     total_amount: float
     date: Optional[datetime]
     document_type: str  # "invoice" or "receipt"
+    date_ambiguous: bool = False  # dd/mm or mm/dd could not be told apart (src.utils.dates)
+    _from_template: bool = PrivateAttr(default=False)  # read by a vendor template, not the LLM
 
 class Invoice(BaseModel):
     id: Optional[int] = None
@@ -0,0 +1,192 @@
+"""
+Persistent, content-addressed cache for extraction results.
+
+Two layers share one SQLite file:
+
+- ``ocr``: document text keyed by the SHA-256 of the file bytes
+- ``llm``: parsed LLM JSON keyed by the SHA-256 of the document text plus the
+  document type, model name and prompt template version
+
+Entries expire after ``EXTRACTION_CACHE_MAX_AGE_DAYS`` and the least recently
+used ones are evicted once the file holds more than ``EXTRACTION_CACHE_MAX_MB``.
+Set ``EXTRACTION_CACHE=0`` to turn the cache off.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from src.utils import metrics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".cache", "extraction_cache.db")
+
+LAYERS = ("ocr", "llm")
+_EVICT_EVERY = 64  # puts between eviction sweeps
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file in chunks so large scans never sit in memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed key/value store with per-layer hit/miss counters."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_seconds: float = 90 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._counters = {layer: {"hits": 0, "misses": 0} for layer in LAYERS}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " layer TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (layer, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread; batch workers share the cache safely
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, layer: str, hit: bool) -> None:
+        with self._lock:
+            self._counters[layer]["hits" if hit else "misses"] += 1
+        metrics.inc("cache_hits_total" if hit else "cache_misses_total", layer=layer)
+
+    def get(self, layer: str, key: str) -> Optional[str]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, created_at FROM entries WHERE layer = ? AND key = ?", (layer, key)
+        ).fetchone()
+        if row is None or now - row[1] > self.max_age_seconds:
+            self._count(layer, False)
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE layer = ? AND key = ?", (now, layer, key)
+            )
+        self._count(layer, True)
+        return row[0]
+
+    def put(self, layer: str, key: str, value: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (layer, key, value, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (layer, key, value, len(value.encode("utf-8")), now, now),
+            )
+        with self._lock:
+            self._puts += 1
+            sweep = self._puts % _EVICT_EVERY == 0
+        if sweep:
+            self.evict()
+
+    # --- layer helpers -------------------------------------------------
+
+    def get_text(self, file_hash: str) -> Optional[str]:
+        return self.get("ocr", file_hash)
+
+    def put_text(self, file_hash: str, text: str) -> None:
+        self.put("ocr", file_hash, text or "")
+
+    @staticmethod
+    def llm_key(document_text: str, document_type: str, model: str, prompt_version: str) -> str:
+        return f"{sha256_text(document_text)}:{document_type}:{model}:{prompt_version}"
+
+    def get_llm(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.get("llm", key)
+        return json.loads(value) if value is not None else None
+
+    def put_llm(self, key: str, data: Dict[str, Any]) -> None:
+        self.put("llm", key, json.dumps(data, default=str))
+
+    # --- maintenance ---------------------------------------------------
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        conn = self._conn()
+        removed = 0
+        with conn:
+            cur = conn.execute(
+                "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            removed += cur.rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                victims = []
+                for layer, key, size in conn.execute(
+                    "SELECT layer, key, size FROM entries ORDER BY accessed_at"
+                ):
+                    victims.append((layer, key))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM entries WHERE layer = ? AND key = ?", victims)
+                removed += len(victims)
+        return removed
+
+    def clear(self) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        rows = self._conn().execute(
+            "SELECT layer, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY layer"
+        ).fetchall()
+        sizes = {layer: (count, size) for layer, count, size in rows}
+        with self._lock:
+            return {
+                layer: dict(self._counters[layer],
+                            entries=sizes.get(layer, (0, 0))[0],
+                            bytes=sizes.get(layer, (0, 0))[1])
+                for layer in LAYERS
+            }
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ExtractionCache]:
+    """Return the process-wide cache, or None when EXTRACTION_CACHE=0."""
+    global _cache
+    if os.getenv("EXTRACTION_CACHE", "1").lower() in ("0", "false", "no", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache(
+                path=os.getenv("EXTRACTION_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_bytes=int(float(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024),
+                max_age_seconds=float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "90")) * 24 * 3600,
+            )
+        return _cache
@@ -0,0 +1,365 @@
+"""
+Shrink OCR/pdfminer text before it goes into an LLM prompt.
+
+Steps, cheapest first:
+
+1. normalize whitespace (trailing spaces, runs of spaces/tabs, blank-line runs)
+2. drop page headers/footers repeated on most pages (page numbers are ignored
+   when comparing, so "Page 2 of 9" matches "Page 3 of 9") and other repeated
+   lines without amounts or dates; the first copy stays
+3. drop low-information blocks: paragraphs with no amounts or dates that
+   read like terms and conditions or other prose (never the document header)
+4. if still over LLM_TOKEN_BUDGET, keep every line with an amount or a date
+   (totals, tax, dates, line items), then the document header, then the
+   best-scoring remaining lines, all in their original order. Lines with
+   amounts or dates are never dropped: if they alone exceed the budget, this
+   step is skipped and the text is sent as steps 1-3 left it
+
+Text spilled to disk by src.utils.limits (very large documents) is compacted
+as a stream: the same steps, but it is read page by page and only the lines
+kept for the prompt are held in memory. It cannot be sent whole, so there
+every amount/date line is kept and the other lines fill what is left of the
+budget.
+
+Tokens saved are counted in the llm_tokens_saved_total metric. To see what
+compaction does to one document:
+
+    python -m src.utils.compaction path/to/invoice.pdf
+
+    COMPACTION=0           send the text unchanged
+    LLM_TOKEN_BUDGET=3000  estimated prompt tokens allowed for the document text
+"""
+import heapq
+import os
+import re
+import sys
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from src.llm.client import estimate_tokens
+from src.utils import metrics
+
+if TYPE_CHECKING:
+    from src.utils.limits import SpilledText, Text
+
+AMOUNT_RE = re.compile(r"\d[\d,]*[.,]\d{2}\b|[$€£¥₦]\s?\d")
+DATE_RE = re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b|\b\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}\b"
+    r"|\b\d{1,2}\s+[A-Za-z]{3,9}\.?,?\s+\d{4}\b|\b[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}\b"
+)
+FIELD_WORDS = {
+    "invoice", "receipt", "total", "subtotal", "tax", "vat", "amount", "due", "date", "qty",
+    "quantity", "price", "unit", "bill", "sold", "vendor", "supplier", "balance", "paid", "item",
+    "description", "discount", "shipping",
+}
+BOILERPLATE_WORDS = {
+    "terms", "conditions", "liability", "warranty", "privacy", "policy", "agreement", "governed",
+    "jurisdiction", "hereby", "shall", "pursuant", "disclaimer", "copyright", "rights", "reserved",
+    "unsubscribe", "confidential", "refund", "returns",
+}
+HEADER_LINES = 12  # first lines of the document: vendor name, address, document number
+EDGE_LINES = 3  # lines at the top/bottom of a page checked for repeated headers/footers
+MAX_SEEN_LINES = 200000  # distinct long lines remembered when streaming a spilled text
+WORD_RE = re.compile(r"[a-z]+")
+
+
+def enabled() -> bool:
+    return os.getenv("COMPACTION", "1").lower() not in ("0", "false", "no", "off")
+
+
+def token_budget() -> int:
+    return int(os.getenv("LLM_TOKEN_BUDGET", "3000"))
+
+
+def _normalize_page(page: str) -> List[str]:
+    """Whitespace-normalized lines of one page, blank runs collapsed."""
+    lines: List[str] = []
+    for raw in page.splitlines():
+        line = re.sub(r"[ \t ]{2,}", "  ", raw.replace("\t", "  ")).strip()
+        line = re.sub(r"[\x00-\x08\x0b-\x1f]", "", line)
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _normalize(text: str) -> List[List[str]]:
+    """Pages (split on form feeds) as lists of whitespace-normalized lines, blank runs collapsed."""
+    pages = (_normalize_page(page) for page in (text or "").split("\f"))
+    return [lines for lines in pages if lines]
+
+
+def _edge_shapes(lines: List[str]) -> Set[str]:
+    content = [l for l in lines if l]
+    return {_shape(l) for l in content[:EDGE_LINES] + content[-EDGE_LINES:]}
+
+
+def _shape(line: str) -> str:
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def _is_key_line(line: str) -> bool:
+    return bool(AMOUNT_RE.search(line) or DATE_RE.search(line))
+
+
+def _drop_repeated_edges(pages: List[List[str]]) -> Tuple[List[List[str]], int]:
+    """Remove header/footer lines that recur on most pages, keeping the first occurrence."""
+    if len(pages) < 2:
+        return pages, 0
+    counts: Dict[str, int] = {}
+    for lines in pages:
+        for shape in _edge_shapes(lines):
+            counts[shape] = counts.get(shape, 0) + 1
+    threshold = max(2, (len(pages) + 1) // 2)
+    repeated = {shape for shape, n in counts.items() if n >= threshold}
+    seen = set()
+    removed = 0
+    result = []
+    for lines in pages:
+        kept = []
+        for line in lines:
+            shape = _shape(line)
+            if line and shape in repeated:
+                if shape in seen:
+                    removed += 1
+                    continue
+                seen.add(shape)
+            kept.append(line)
+        result.append(kept)
+    return result, removed
+
+
+def _drop_repeated_lines(lines: List[str]) -> Tuple[List[str], int]:
+    """Drop later copies of longer lines without amounts or dates (repeated notices, boilerplate)."""
+    seen = set()
+    kept = []
+    for line in lines:
+        if len(line) >= 20 and not _is_key_line(line):
+            shape = _shape(line)
+            if shape in seen:
+                continue
+            seen.add(shape)
+        kept.append(line)
+    return kept, len(lines) - len(kept)
+
+
+def _blocks(lines: List[str]) -> List[List[str]]:
+    blocks, current = [], []
+    for line in lines:
+        if line:
+            current.append(line)
+        elif current:
+            blocks.append(current)
+            current = []
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def score_block(block: List[str]) -> float:
+    """Rough information value per word: amounts, dates and field labels up; legal prose down."""
+    words = WORD_RE.findall(" ".join(block).lower())
+    key_lines = sum(1 for line in block if _is_key_line(line))
+    digits = sum(ch.isdigit() for line in block for ch in line)
+    fields = sum(1 for w in words if w in FIELD_WORDS)
+    boilerplate = sum(1 for w in words if w in BOILERPLATE_WORDS)
+    return (3 * key_lines + fields + digits / 10 - 2 * boilerplate) / max(1.0, len(words) / 10)
+
+
+def _is_low_information(block: List[str], order: int) -> bool:
+    """Prose without amounts or dates; `order` is the block's first line in the document."""
+    if order < HEADER_LINES:
+        return False  # vendor name and address, even next to "all rights reserved"
+    if any(_is_key_line(line) for line in block):
+        return False
+    words = WORD_RE.findall(" ".join(block).lower())
+    boilerplate = sum(1 for w in words if w in BOILERPLATE_WORDS)
+    return score_block(block) < 0.5 and (len(words) >= 25 or boilerplate >= 2)
+
+
+def _priority(order: int, line: str, block_score: float) -> float:
+    if order < HEADER_LINES:
+        return 4.0e9  # vendor, document number
+    if _is_key_line(line) and set(WORD_RE.findall(line.lower())) & FIELD_WORDS:
+        return 3.0e9  # totals, tax, dates
+    if _is_key_line(line):
+        return 2.0e9  # line items
+    return block_score
+
+
+def _trim(blocks: List[List[str]], budget: int) -> Optional[List[List[str]]]:
+    """
+    Keep every amount/date line, then the header and the best blocks, within
+    budget. None when the amount/date lines alone do not fit.
+    """
+    entries = []  # (priority, order, block index, line)
+    order = 0
+    for block_index, block in enumerate(blocks):
+        score = score_block(block)
+        for line in block:
+            entries.append((_priority(order, line, score), order, block_index, line))
+            order += 1
+    kept = set()
+    used = 0
+    for _, order, _, line in entries:
+        if _is_key_line(line):
+            kept.add(order)
+            used += estimate_tokens(line) + 1
+    if used > budget:
+        return None
+    for priority, order, _, line in sorted(entries, key=lambda e: (-e[0], e[1])):
+        cost = estimate_tokens(line) + 1
+        if order in kept or used + cost > budget:
+            continue
+        kept.add(order)
+        used += cost
+    trimmed: Dict[int, List[str]] = {}
+    for _, order, block_index, line in entries:
+        if order in kept:
+            trimmed.setdefault(block_index, []).append(line)
+    return [trimmed[i] for i in sorted(trimmed)]
+
+
+def compact_text(text: str, budget: int = 0) -> Tuple[str, Dict[str, int]]:
+    """Compacted text plus stats: tokens_before, tokens_after, tokens_saved, lines/blocks dropped."""
+    budget = budget or token_budget()
+    pages = _normalize(text)
+    pages, repeated = _drop_repeated_edges(pages)
+    lines: List[str] = []
+    for page in pages:
+        if lines and lines[-1]:
+            lines.append("")
+        lines.extend(page)
+    lines, duplicates = _drop_repeated_lines(lines)
+    repeated += duplicates
+    blocks = _blocks(lines)
+    kept, order = [], 0
+    for block in blocks:
+        if not _is_low_information(block, order):
+            kept.append(block)
+        order += len(block)
+    dropped = len(blocks) - len(kept)
+    compacted = "\n\n".join("\n".join(b) for b in kept)
+    trimmed = 0
+    if estimate_tokens(compacted) > budget:
+        trimmed_blocks = _trim(kept, budget)
+        if trimmed_blocks is not None:  # None: the amounts and dates alone are over budget
+            trimmed = sum(len(b) for b in kept) - sum(len(b) for b in trimmed_blocks)
+            compacted = "\n\n".join("\n".join(b) for b in trimmed_blocks)
+    before, after = estimate_tokens(text), estimate_tokens(compacted)
+    return compacted, {
+        "tokens_before": before,
+        "tokens_after": after,
+        "tokens_saved": max(0, before - after),
+        "repeated_lines_dropped": repeated,
+        "blocks_dropped": dropped,
+        "lines_trimmed": trimmed,
+    }
+
+
+def compact_spilled(text: "SpilledText", budget: int = 0) -> Tuple[str, Dict[str, int]]:
+    """
+    compact_text for text too large to hold in memory (src.utils.limits.SpilledText).
+    The file is read page by page twice: once to find the repeated
+    headers/footers, and once to keep the best lines within budget with a
+    heap. Amount/date lines are all kept, outside the heap; only they and
+    about `budget` tokens of other lines are held at any time.
+    """
+    budget = budget or token_budget()
+    counts: Dict[str, int] = {}
+    pages = 0
+    for page in text.pages():
+        lines = _normalize_page(page)
+        if lines:
+            pages += 1
+            for shape in _edge_shapes(lines):
+                counts[shape] = counts.get(shape, 0) + 1
+    threshold = max(2, (pages + 1) // 2)
+    repeated = {shape for shape, n in counts.items() if n >= threshold} if pages >= 2 else set()
+    del counts
+
+    heap: List[Tuple[float, int, int, str, int]] = []  # (priority, -order, block index, line, cost)
+    key_lines: List[Tuple[float, int, int, str, int]] = []  # same shape, never dropped
+    stats = {"repeated_lines_dropped": 0, "blocks_dropped": 0, "lines_trimmed": 0}
+    seen_edges: Set[str] = set()
+    seen_lines: Set[int] = set()
+    position = {"order": 0, "block": 0, "used": 0}
+
+    def finish(block: List[str]) -> None:
+        if not block:
+            return
+        if _is_low_information(block, position["order"]):
+            stats["blocks_dropped"] += 1
+            return
+        score = score_block(block)
+        for line in block:
+            cost = estimate_tokens(line) + 1
+            entry = (_priority(position["order"], line, score), -position["order"], position["block"], line, cost)
+            if _is_key_line(line):
+                key_lines.append(entry)
+            else:
+                heapq.heappush(heap, entry)
+            position["order"] += 1
+            position["used"] += cost
+            while position["used"] > budget and heap:
+                position["used"] -= heapq.heappop(heap)[4]
+                stats["lines_trimmed"] += 1
+        position["block"] += 1
+
+    block: List[str] = []
+    for page in text.pages():
+        finish(block)  # a page break ends a block, as in compact_text
+        block = []
+        for line in _normalize_page(page):
+            if not line:
+                finish(block)
+                block = []
+                continue
+            shape = _shape(line)
+            if shape in repeated:
+                if shape in seen_edges:
+                    stats["repeated_lines_dropped"] += 1
+                    continue
+                seen_edges.add(shape)
+            elif len(line) >= 20 and not _is_key_line(line):
+                if hash(shape) in seen_lines:
+                    stats["repeated_lines_dropped"] += 1
+                    continue
+                if len(seen_lines) < MAX_SEEN_LINES:
+                    seen_lines.add(hash(shape))
+            block.append(line)
+    finish(block)
+
+    kept: Dict[int, List[str]] = {}
+    for _, _, block_index, line, _ in sorted(heap + key_lines, key=lambda entry: -entry[1]):
+        kept.setdefault(block_index, []).append(line)
+    compacted = "\n\n".join("\n".join(kept[i]) for i in sorted(kept))
+    before, after = estimate_tokens(text), estimate_tokens(compacted)
+    return compacted, dict(tokens_before=before, tokens_after=after, tokens_saved=max(0, before - after), **stats)
+
+
+def compact_for_llm(text: "Text", document_type: str = "") -> str:
+    """
+    Compacted text for a prompt (unchanged when COMPACTION=0), counting the
+    tokens saved. Text spilled to disk is always compacted, as a stream.
+    """
+    spilled = not isinstance(text, str)
+    if not spilled and (not enabled() or not text):
+        return text
+    with metrics.span("compaction"):
+        compacted, stats = compact_spilled(text) if spilled else compact_text(text)
+    metrics.inc("llm_tokens_saved_total", stats["tokens_saved"], document_type=document_type)
+    return compacted
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m src.utils.compaction <file.pdf|image>")
+        raise SystemExit(1)
+    from src.utils.helpers import extract_document_text
+
+    text = extract_document_text(sys.argv[1])
+    compacted, stats = compact_text(text) if isinstance(text, str) else compact_spilled(text)
+    print(compacted)
+    print("-" * 40)
+    print(stats)
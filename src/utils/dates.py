@@ -0,0 +1,327 @@
+"""
+Date normalization for extracted documents.
+
+Dates arrive as whatever the document printed ("05/01/2024", "5 Jan 2024",
+"2024-01-05T10:22", "Jan 5, 2024"). Each supported shape is a precompiled
+regex whose groups are turned into a datetime directly, so the common cases
+cost a regex match instead of a chain of strptime/dateutil attempts raising
+exceptions. dateutil (and a numeric timestamp) are only the last resort.
+
+- the formats that succeeded for a vendor are tried first for that vendor
+- parsed strings are memoized in an LRU cache (DATE_CACHE_SIZE entries)
+- numeric dates that read both ways (05/01/2024: 5 Jan or May 1) are
+  resolved with the vendor's learned day/month order when there is one, and
+  otherwise parsed in DATE_ORDER and flagged ``ambiguous`` with both readings
+- ``normalize_series`` parses a whole pandas Series with vectorized string
+  extraction, for backfills and re-normalization of historical rows
+
+    from src.utils.dates import get_normalizer
+    parsed = get_normalizer().parse("05/01/2024", vendor="ACME Ltd")
+    parsed.value, parsed.format, parsed.ambiguous, parsed.alternatives
+
+    DATE_ORDER=mdy          order for ambiguous numeric dates with no vendor history (mdy | dmy)
+    DATE_CACHE_SIZE=50000
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from dateutil import parser as date_parser  # type: ignore
+except Exception:
+    date_parser = None
+
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        (("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",),
+         ("jun", "june"), ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"),
+         ("oct", "october"), ("nov", "november"), ("dec", "december")),
+        start=1,
+    )
+    for name in names
+}
+TIME = r"(?:[T\s]+(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?\s*([AaPp][Mm])?)?(?:\s*(?:Z|[+-]\d{2}:?\d{2}))?"
+SUFFIX = r"(?:st|nd|rd|th)?"
+TIMESTAMP_RE = re.compile(r"\d{9,11}(?:\.\d+)?")
+
+# name -> (regex, order of the date groups): y=year, m=month number, b=month name, d=day
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "ymd": (r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})" + TIME, "ymd"),
+    "dmy": (r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})" + TIME, "dmy"),
+    "mdy": (r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})" + TIME, "mdy"),
+    "d_b_y": (r"(\d{1,2})" + SUFFIX + r"[\s\-]+([A-Za-z]{3,9})\.?,?[\s\-]+(\d{4}|\d{2})" + TIME, "dby"),
+    "b_d_y": (r"([A-Za-z]{3,9})\.?\s+(\d{1,2})" + SUFFIX + r",?\s+(\d{4})" + TIME, "bdy"),
+}
+COMPILED = {name: re.compile(pattern) for name, (pattern, _) in FORMATS.items()}
+NUMERIC_ORDERS = ("dmy", "mdy")  # same regex, read both ways
+
+
+class ParsedDate(NamedTuple):
+    value: Optional[datetime]
+    format: Optional[str] = None  # FORMATS key, "dateutil" or "timestamp"
+    ambiguous: bool = False
+    alternatives: Tuple[datetime, ...] = ()  # every reading when ambiguous
+
+
+def default_order() -> str:
+    order = os.getenv("DATE_ORDER", "mdy").lower()
+    return order if order in NUMERIC_ORDERS else "mdy"
+
+
+def _year(text: str) -> int:
+    year = int(text)
+    if len(text) == 2:
+        year += 2000 if year < 70 else 1900
+    return year
+
+
+def _build(groups: Tuple[Optional[str], ...], order: str) -> Optional[datetime]:
+    """datetime from regex groups (three date parts, then hour, minute, second, am/pm), None if invalid."""
+    parts = dict(zip(order, groups[:3]))
+    if "b" in parts:
+        month = MONTHS.get(parts["b"].lower())
+        if month is None:
+            return None
+    else:
+        month = int(parts["m"])
+    year, day = _year(parts["y"]), int(parts["d"])
+    hour, minute, second, meridiem = groups[3:7]
+    hour, minute, second = int(hour or 0), int(minute or 0), int(second or 0)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    if not (1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2200 and hour < 24 and minute < 60 and second < 60):
+        return None
+    try:
+        return datetime(year, month, day, hour, minute, second)
+    except ValueError:  # 31 April, 29 Feb in a common year
+        return None
+
+
+def _candidates(text: str, names) -> List[Tuple[str, datetime]]:
+    """Readings of text in the first format (in `names` order) that fits; both readings for dd/mm/yyyy."""
+    found = []
+    for name in names:
+        match = COMPILED[name].fullmatch(text)
+        if match:
+            value = _build(match.groups(), FORMATS[name][1])
+            if value is not None:
+                found.append((name, value))
+                if name not in NUMERIC_ORDERS:
+                    return found
+    return found
+
+
+@lru_cache(maxsize=int(os.getenv("DATE_CACHE_SIZE", "50000")))
+def _parse_text(text: str, formats: Tuple[str, ...], order: Optional[str]) -> ParsedDate:
+    """Parse one normalized string, trying `formats` in that order; `order` settles dd/mm vs mm/dd."""
+    found = _candidates(text, formats)
+    if found:
+        name, value = found[0]
+        if name in NUMERIC_ORDERS:
+            readings = {n: v for n, v in found if n in NUMERIC_ORDERS}
+            if len(readings) == 2 and readings["dmy"] != readings["mdy"]:
+                chosen = order or default_order()
+                return ParsedDate(readings[chosen], chosen, ambiguous=order is None,
+                                  alternatives=(readings[chosen], readings[NUMERIC_ORDERS[chosen == "dmy"]]))
+        return ParsedDate(value, name)
+    if date_parser is not None:
+        try:
+            return ParsedDate(date_parser.parse(text, dayfirst=order == "dmy"), "dateutil")
+        except (ValueError, OverflowError, TypeError):
+            pass
+    if TIMESTAMP_RE.fullmatch(text):
+        return ParsedDate(datetime.fromtimestamp(float(text)), "timestamp")
+    return ParsedDate(None)
+
+
+class DateNormalizer:
+    """Parses dates, learning per vendor which formats (and which day/month order) it prints."""
+
+    def __init__(self, max_vendors: int = 10000):
+        self.max_vendors = max_vendors
+        self._vendors: "OrderedDict[str, Dict[str, int]]" = OrderedDict()  # vendor -> format -> successes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(vendor: Any) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", str(vendor or "").lower()))
+
+    def _history(self, vendor: Any) -> Dict[str, int]:
+        key = self._key(vendor)
+        with self._lock:
+            counts = self._vendors.get(key)
+            if counts is not None:
+                self._vendors.move_to_end(key)
+            return dict(counts or {})
+
+    def formats_for(self, vendor: Any = None) -> Tuple[str, ...]:
+        """Format names in the order to try them: this vendor's successes first, most frequent first."""
+        counts = self._history(vendor)
+        learned = sorted(counts, key=lambda name: -counts[name])
+        return tuple(learned) + tuple(name for name in FORMATS if name not in counts)
+
+    def order_for(self, vendor: Any = None) -> Optional[str]:
+        """The day/month order seen in this vendor's unambiguous numeric dates, if any."""
+        counts = self._history(vendor)
+        dmy, mdy = counts.get("dmy", 0), counts.get("mdy", 0)
+        if dmy == mdy:
+            return None
+        return "dmy" if dmy > mdy else "mdy"
+
+    def learn(self, vendor: Any, parsed: ParsedDate) -> None:
+        if not vendor or parsed.value is None or parsed.ambiguous or parsed.format not in FORMATS:
+            return
+        key = self._key(vendor)
+        with self._lock:
+            counts = self._vendors.setdefault(key, {})
+            counts[parsed.format] = counts.get(parsed.format, 0) + 1
+            self._vendors.move_to_end(key)
+            while len(self._vendors) > self.max_vendors:
+                self._vendors.popitem(last=False)
+
+    def parse(self, value: Any, vendor: Any = None, order: Optional[str] = None) -> ParsedDate:
+        """Parse and learn. `order` ("dmy"/"mdy") forces how ambiguous numeric dates are read."""
+        if value is None:
+            return ParsedDate(None)
+        if isinstance(value, datetime):
+            return ParsedDate(value, "datetime")
+        if isinstance(value, date):
+            return ParsedDate(datetime.combine(value, datetime.min.time()), "datetime")
+        if isinstance(value, (int, float)):
+            value = repr(value)
+        text = " ".join(str(value).split())
+        if not text:
+            return ParsedDate(None)
+        parsed = _parse_text(text, self.formats_for(vendor), order or self.order_for(vendor))
+        if parsed.format in NUMERIC_ORDERS and not parsed.ambiguous and not parsed.alternatives:
+            # unambiguous only if the other reading is impossible (day > 12)
+            other = "mdy" if parsed.format == "dmy" else "dmy"
+            if not _candidates(text, (other,)):
+                self.learn(vendor, parsed)
+        elif not parsed.alternatives:
+            self.learn(vendor, parsed)
+        return parsed
+
+
+def normalize_series(values, vendors=None, order: Optional[str] = None):
+    """
+    Vectorized parse of a pandas Series of date strings.
+
+    Returns a DataFrame with ``value`` (datetime64, NaT if unparseable),
+    ``format`` and ``ambiguous`` columns, aligned with the input. Numeric
+    dates that read both ways use the vendor's learned order (``vendors`` is
+    an optional Series of vendor names), else `order`/DATE_ORDER, and are
+    flagged. Each distinct (string, order) pair is parsed once; strings no
+    pattern matches fall back to the scalar parser.
+    """
+    import pandas as pd
+
+    text = values.astype(str).where(values.notna()).str.strip().str.replace(r"\s+", " ", regex=True)
+    normalizer = get_normalizer()
+    if vendors is not None:
+        vendor_orders = vendors.map(normalizer.order_for)
+    else:
+        vendor_orders = pd.Series(None, index=values.index, dtype="object")
+    settled = vendor_orders.notna() | (order is not None)  # these are not ambiguous
+    learned = vendor_orders.fillna(order or default_order())
+
+    key = text.fillna("") + "|" + learned + "|" + settled.astype(str)
+    first = ~key.duplicated()
+    unique = _parse_unique(text[first], learned[first], settled[first])
+    return unique.set_axis(key[first]).reindex(key).set_axis(values.index)
+
+
+def _parse_unique(text, learned, settled):
+    import numpy as np
+    import pandas as pd
+
+    out = pd.DataFrame({"value": pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]"),
+                        "format": pd.Series(None, index=text.index, dtype="object"),
+                        "ambiguous": False}, index=text.index)
+
+    def groups(name: str, rows: pd.Series) -> pd.DataFrame:
+        parts = rows.str.extract("^" + FORMATS[name][0] + "$")
+        parts.columns = range(parts.shape[1])
+        return parts
+
+    def frame(parts: pd.DataFrame, date_order: str) -> pd.Series:
+        """datetime64 from extracted groups (3 date parts + time), NaT where invalid."""
+        named = dict(zip(date_order, range(3)))
+        year = pd.to_numeric(parts[named["y"]], errors="coerce")
+        two_digit = parts[named["y"]].str.len().eq(2).fillna(False).astype(bool)
+        year = year.where(~two_digit, year + np.where(year.fillna(0) < 70, 2000, 1900))
+        if "b" in named:
+            month = parts[named["b"]].str.lower().map(MONTHS)
+        else:
+            month = pd.to_numeric(parts[named["m"]], errors="coerce")
+        hour = pd.to_numeric(parts[3], errors="coerce").fillna(0)
+        meridiem = parts[6].str.lower()
+        is_pm = meridiem.eq("pm").fillna(False).astype(bool)
+        hour = hour.where(meridiem.isna(), hour % 12 + np.where(is_pm, 12, 0))
+        return pd.to_datetime(
+            pd.DataFrame({"year": year, "month": month, "day": pd.to_numeric(parts[named["d"]], errors="coerce"),
+                          "hour": hour, "minute": pd.to_numeric(parts[4], errors="coerce").fillna(0),
+                          "second": pd.to_numeric(parts[5], errors="coerce").fillna(0)}),
+            errors="coerce",
+        )
+
+    remaining = text.notna()
+    for name in ("ymd", "d_b_y", "b_d_y"):
+        parsed = frame(groups(name, text[remaining]), FORMATS[name][1])
+        hit = parsed[parsed.notna()]
+        out.loc[hit.index, "value"] = hit
+        out.loc[hit.index, "format"] = name
+        remaining &= out["value"].isna()
+
+    rows = text[remaining]
+    parts = groups("dmy", rows)
+    as_dmy, as_mdy = frame(parts, "dmy"), frame(parts, "mdy")
+    both = as_dmy.notna() & as_mdy.notna() & (as_dmy != as_mdy)
+    use_dmy = as_dmy.notna() & (as_mdy.isna() | (both & (learned[rows.index] == "dmy")))
+    chosen = as_mdy.where(~use_dmy, as_dmy)
+    hit = chosen.notna()
+    out.loc[hit[hit].index, "value"] = chosen[hit]
+    out.loc[hit[hit].index, "format"] = np.where(use_dmy[hit], "dmy", "mdy")
+    flagged = both & ~settled[rows.index]
+    out.loc[flagged[flagged].index, "ambiguous"] = True
+    remaining &= out["value"].isna()
+
+    for index in remaining[remaining].index:  # odd strings: the scalar path (dateutil, timestamps)
+        parsed = _parse_text(text[index], tuple(FORMATS), learned[index] if settled[index] else None)
+        if parsed.value is not None:
+            out.at[index, "value"] = parsed.value
+            out.at[index, "format"] = parsed.format
+            out.at[index, "ambiguous"] = parsed.ambiguous
+    return out
+
+
+_normalizer: Optional[DateNormalizer] = None
+_normalizer_lock = threading.Lock()
+
+
+def get_normalizer() -> DateNormalizer:
+    global _normalizer
+    with _normalizer_lock:
+        if _normalizer is None:
+            _normalizer = DateNormalizer()
+        return _normalizer
+
+
+def report_ambiguous(value: Any, vendor: Any, parsed: ParsedDate, **labels: str) -> None:
+    """Warn that a date could be read either way, and count it."""
+    from src.utils import metrics
+
+    first, second = parsed.alternatives
+    print(f"⚠️ Ambiguous date {value!r} for {vendor!r}: stored {first:%Y-%m-%d}, "
+          f"could be {second:%Y-%m-%d} (set DATE_ORDER to change the default)")
+    metrics.inc("dates_ambiguous_total", **labels)
+
+
+def parse_date(value: Any, vendor: Any = None, order: Optional[str] = None) -> Optional[datetime]:
+    """Just the datetime (None if unparseable)."""
+    return get_normalizer().parse(value, vendor, order).value
@@ -0,0 +1,230 @@
+"""
+Duplicate-document detection at ingest time.
+
+Three signals are stored per ingested document in ``document_fingerprints``:
+
+- the SHA-256 of the file bytes (exact re-submissions), checked before OCR
+- a 64-bit difference hash of JPG/PNG uploads (re-encoded or resized copies of
+  the same photo), also checked before OCR
+- a fingerprint of (vendor, date, total, line items) from the extracted data
+  (re-scans or new photos of the same paper document), checked after the LLM
+  but before the DB insert
+
+DEDUP_POLICY decides what happens to a match:
+    skip  (default) drop the duplicate and report the original
+    link  record the upload against the original record, no new invoice/receipt row
+    flag  process and save it anyway, marked as a suspected duplicate
+    off   no duplicate checks
+"""
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, or_, select
+
+from src.database.connection import SessionLocal
+from src.database.models import DocumentFingerprintModel
+from src.utils import limits
+from src.utils.cache import sha256_file
+
+POLICIES = ("skip", "link", "flag", "off")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PHASH_MAX_DISTANCE = 3  # highest distance the 4-band index is guaranteed to find
+
+
+def policy() -> str:
+    value = os.getenv("DEDUP_POLICY", "skip").lower()
+    if value not in POLICIES:
+        raise ValueError(f"DEDUP_POLICY must be one of {POLICIES}, got {value!r}")
+    return value
+
+
+def perceptual_hash(image_path: str) -> Optional[int]:
+    """
+    64-bit difference hash (dHash): robust to resizing, recompression and small edits.
+    None for images over IMAGE_MAX_PIXELS, which are not decoded here (text extraction reports them).
+    """
+    if not image_path.lower().endswith(IMAGE_EXTENSIONS) or not limits.image_fits(image_path):
+        return None
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        image.draft("L", (64, 64))  # let the JPEG decoder downscale instead of decoding full size
+        small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def _bands(phash: int):
+    return [(phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+def _norm_text(value: Any) -> str:
+    return re.sub(r"[^a-z0-9]+", "", str(value or "").lower())
+
+
+def _norm_amount(value: Any) -> str:
+    try:
+        return f"{float(value):.2f}"
+    except (TypeError, ValueError):
+        return ""
+
+
+def content_fingerprint(extracted_data: Any) -> Optional[str]:
+    """Hash of the normalized vendor, date, total and line items, or None if too sparse to trust."""
+    from src.agents.processing_agent import _field, _parse_date
+
+    vendor = _norm_text(_field(extracted_data, "vendor_name"))
+    total = _norm_amount(_field(extracted_data, "total_amount"))
+    if not vendor or not total:
+        return None
+    parsed = _parse_date(_field(extracted_data, "date"))
+    day = parsed.strftime("%Y-%m-%d") if parsed else ""
+    lines = []
+    for p in _field(extracted_data, "products", []) or []:
+        p = p.model_dump() if hasattr(p, "model_dump") else p
+        if isinstance(p, dict):
+            lines.append(f"{_norm_text(p.get('name'))}|{_norm_amount(p.get('quantity'))}|{_norm_amount(p.get('total'))}")
+    key = "\n".join([vendor, day, total] + sorted(lines))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _as_match(row: DocumentFingerprintModel, reason: str) -> Dict[str, Any]:
+    original = row.duplicate_of or row.id
+    return {
+        "fingerprint_id": original,
+        "record_id": row.record_id,
+        "document_type": row.document_type,
+        "file_path": row.file_path,
+        "reason": reason,
+    }
+
+
+def find_file_duplicate(file_hash: str, phash: Optional[int] = None,
+                        document_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Look up an earlier upload with the same bytes or a near-identical image."""
+    type_filter = [DocumentFingerprintModel.document_type == document_type] if document_type else []
+    with SessionLocal() as db:
+        row = db.execute(
+            select(DocumentFingerprintModel)
+            .where(DocumentFingerprintModel.file_sha256 == file_hash, *type_filter)
+            .order_by(DocumentFingerprintModel.id)
+            .limit(1)
+        ).scalar_one_or_none()
+        if row is not None:
+            return _as_match(row, "file")
+        if phash is None:
+            return None
+        b0, b1, b2, b3 = _bands(phash)
+        candidates = db.execute(
+            select(DocumentFingerprintModel)
+            .where(
+                or_(
+                    DocumentFingerprintModel.phash_band0 == b0,
+                    DocumentFingerprintModel.phash_band1 == b1,
+                    DocumentFingerprintModel.phash_band2 == b2,
+                    DocumentFingerprintModel.phash_band3 == b3,
+                ),
+                *type_filter,
+            )
+            .order_by(DocumentFingerprintModel.id)
+        ).scalars()
+        for candidate in candidates:
+            if phash_distance(int(candidate.phash, 16), phash) <= PHASH_MAX_DISTANCE:
+                return _as_match(candidate, "image")
+    return None
+
+
+def find_content_duplicate(fingerprint: Optional[str],
+                           document_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Look up an earlier document with the same vendor, date, total and line items."""
+    if not fingerprint:
+        return None
+    type_filter = [DocumentFingerprintModel.document_type == document_type] if document_type else []
+    with SessionLocal() as db:
+        row = db.execute(
+            select(DocumentFingerprintModel)
+            .where(DocumentFingerprintModel.content_fingerprint == fingerprint, *type_filter)
+            .order_by(DocumentFingerprintModel.id)
+            .limit(1)
+        ).scalar_one_or_none()
+    return _as_match(row, "content") if row is not None else None
+
+
+def phash_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def fingerprint_row(file_hash: str, document_type: Optional[str], record_id: Optional[int] = None,
+                    file_path: Optional[str] = None, phash: Optional[int] = None,
+                    content_fp: Optional[str] = None, status: str = "unique",
+                    duplicate_of: Optional[int] = None) -> Dict[str, Any]:
+    """Column values for one document_fingerprints row."""
+    bands = _bands(phash) if phash is not None else [None] * 4
+    return dict(
+        document_type=document_type,
+        record_id=record_id,
+        file_path=file_path,
+        file_sha256=file_hash,
+        phash=f"{phash:016x}" if phash is not None else None,
+        phash_band0=bands[0],
+        phash_band1=bands[1],
+        phash_band2=bands[2],
+        phash_band3=bands[3],
+        content_fingerprint=content_fp,
+        status=status,
+        duplicate_of=duplicate_of,
+    )
+
+
+def register_many(rows: List[Dict[str, Any]]) -> None:
+    """Store fingerprints for many documents in one transaction."""
+    if not rows:
+        return
+    with SessionLocal() as db:
+        db.execute(insert(DocumentFingerprintModel), rows)
+        db.commit()
+
+
+def register(file_hash: str, document_type: Optional[str], **kwargs: Any) -> None:
+    """Store the fingerprints of one ingested document (see fingerprint_row for the fields)."""
+    register_many([fingerprint_row(file_hash, document_type, **kwargs)])
+
+
+def resolve_duplicate(match: Dict[str, Any], mode: str, file_hash: str, document_type: Optional[str],
+                      file_path: Optional[str] = None, phash: Optional[int] = None,
+                      content_fp: Optional[str] = None) -> Dict[str, Any]:
+    """Apply the skip/link policy to a match and return the pipeline result for it."""
+    if document_type in (None, "auto"):
+        document_type = match["document_type"]
+    if mode == "link":
+        register(file_hash, document_type, record_id=match["record_id"], file_path=file_path,
+                 phash=phash, content_fp=content_fp, status="linked",
+                 duplicate_of=match["fingerprint_id"])
+    return {
+        "status": "duplicate",
+        "action": mode,
+        "type": match["document_type"],
+        "id": match["record_id"],
+        "reason": match["reason"],
+    }
+
+
+def check_file(file_path: str, document_type: Optional[str] = None, file_hash: Optional[str] = None):
+    """Hash a file and look for an earlier copy; returns (file_hash, phash, match or None)."""
+    file_hash = file_hash or sha256_file(file_path)
+    try:
+        phash = perceptual_hash(file_path)
+    except Exception:
+        phash = None  # unreadable image: let OCR report the real error
+    if policy() == "off":
+        return file_hash, phash, None
+    # a file of unknown type ("auto") matches an earlier copy of any type
+    return file_hash, phash, find_file_duplicate(file_hash, phash, None if document_type == "auto" else document_type)
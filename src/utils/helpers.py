@@ -1,58 +1,232 @@
 # ...existing code...
+import io
 import os
-from PIL import Image
-import pytesseract
+import re
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple
+from src.utils import limits, metrics
+
+@lru_cache(maxsize=None)
+def _tesseract():
+    """
+    Import pytesseract (which pulls in PIL and, when installed, pandas) only
+    when something is actually OCR'd; text PDFs never need it.
+    """
+    import pytesseract
+
+    tesseract_cmd = os.getenv("TESSERACT_CMD")
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return pytesseract
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Try pdfminer (text PDFs) first; if empty, fall back to pdf2image+Tesseract OCR."""
+    buffer = io.StringIO()
+    _write_pdf_text(pdf_path, buffer, limits.Budget(pdf_path))
+    return buffer.getvalue()
+
+def _write_pdf_text(pdf_path: str, out, budget: limits.Budget, text_layer: bool = True,
+                    ocr: bool = True) -> Optional[int]:
+    """
+    Write a PDF's text to `out` page by page (pdfminer, else OCR); returns the page count.
+    None when the PDF has no text layer and `ocr` is off.
+    """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF not found: {os.path.abspath(pdf_path)}")
+    limits.check_pdf(pdf_path, budget)
 
     # try fast text extraction (no external binaries)
-    try:
-        from pdfminer.high_level import extract_text as pdfminer_extract_text
-        text = pdfminer_extract_text(pdf_path)
-        if text and text.strip():
-            return text
-    except Exception:
-        pass
+    if text_layer:
+        start = out.tell()
+        try:
+            pages, found = _write_pdfminer_text(pdf_path, out, budget)
+            if found:
+                return pages
+        except limits.ResourceLimitError:
+            raise
+        except Exception:
+            pass
+        out.seek(start)
+        out.truncate()
+        budget.pages = 0
+    if not ocr:
+        return None
 
     # set TESSERACT_CMD or POPPLER_PATH via env if needed
-    tesseract_cmd = os.getenv("TESSERACT_CMD")
-    if tesseract_cmd:
-        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-
+    from pdf2image.exceptions import PDFInfoNotInstalledError
+    pages = 0
     try:
-        import pdf2image
-        poppler_path = os.getenv("POPPLER_PATH")
-        if poppler_path:
-            images = pdf2image.convert_from_path(pdf_path, poppler_path=poppler_path)
-        else:
-            images = pdf2image.convert_from_path(pdf_path)
-    except pdf2image.exceptions.PDFInfoNotInstalledError:
+        for page_text in iter_pdf_ocr_pages(pdf_path, budget=budget):
+            out.write(page_text)
+            pages += 1
+        return pages
+    except PDFInfoNotInstalledError:
         raise RuntimeError(
             "Poppler not found. Install poppler and add to PATH or set POPPLER_PATH.\n"
             "Conda (recommended): conda install -c conda-forge poppler\n"
             "Download: https://github.com/oschwartz10612/poppler-windows/releases"
         )
+    except limits.ResourceLimitError:
+        raise
     except Exception as e:
-        raise RuntimeError(f"Failed to convert PDF to images: {e}") from e
+        raise RuntimeError(f"Failed to OCR PDF pages: {e}") from e
 
-    text = ""
-    for image in images:
-        text += pytesseract.image_to_string(image)
-    return text
+def _write_pdfminer_text(pdf_path: str, out, budget: limits.Budget) -> Tuple[int, bool]:
+    """pdfminer text of each page, written as soon as the page is laid out; (pages, any text found)."""
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    manager = PDFResourceManager(caching=True)
+    pages, found = 0, False
+    with open(pdf_path, "rb") as fh:
+        for page in PDFPage.get_pages(fh):
+            budget.add_pages()
+            buffer = io.StringIO()
+            device = TextConverter(manager, buffer, laparams=LAParams())
+            PDFPageInterpreter(manager, device).process_page(page)
+            device.close()
+            text = buffer.getvalue()
+            found = found or bool(text.strip())
+            out.write(text)
+            pages += 1
+    return pages, found
+
+def _ocr_page_file(image_path: str) -> str:
+    # pytesseract hands a path straight to the tesseract binary without decoding it here
+    return _tesseract().image_to_string(image_path)
+
+def iter_pdf_ocr_pages(pdf_path: str, dpi: Optional[int] = None, chunk_pages: Optional[int] = None,
+                       workers: Optional[int] = None, budget: Optional[limits.Budget] = None) -> Iterator[str]:
+    """
+    OCR a scanned PDF page by page, yielding each page's text in order.
+
+    Pages are rendered `chunk_pages` at a time to temp files (pdf2image
+    `output_folder`/`paths_only`), so at most two chunks exist on disk and no
+    page image is held in memory. Tesseract runs as a subprocess per page, so
+    a thread pool is enough to keep every core busy. The next chunk renders
+    while the current one is being OCRed. Pages count against `budget`: the
+    page size is checked before rendering and each rendered image before OCR.
+
+    Defaults come from OCR_DPI (200), OCR_CHUNK_PAGES (4) and OCR_WORKERS (CPU count).
+    """
+    import pdf2image
+
+    dpi = dpi or int(os.getenv("OCR_DPI", "200"))
+    chunk_pages = max(1, chunk_pages or int(os.getenv("OCR_CHUNK_PAGES", "4")))
+    workers = max(1, workers or int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1)
+
+    _tesseract()  # resolve the binary before worker threads start
+    poppler_kwargs = {}
+    if os.getenv("POPPLER_PATH"):
+        poppler_kwargs["poppler_path"] = os.getenv("POPPLER_PATH")
+
+    budget = budget or limits.Budget(pdf_path)
+    info = pdf2image.pdfinfo_from_path(pdf_path, **poppler_kwargs)
+    page_count = int(info["Pages"])
+    size = re.match(r"\s*([\d.]+) x ([\d.]+) pts", info.get("Page size", ""))
+    if size:  # refuse a poster-sized page before pdftoppm allocates it
+        budget.add_image(int(float(size.group(1)) * dpi / 72), int(float(size.group(2)) * dpi / 72))
+        budget.pixels = 0
+
+    in_flight = deque()  # (temp dir, [futures]) per rendered chunk, oldest first
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for first in range(1, page_count + 1, chunk_pages):
+                tmp_dir = tempfile.TemporaryDirectory(prefix="ocr_pages_")
+                paths = pdf2image.convert_from_path(
+                    pdf_path,
+                    dpi=dpi,
+                    first_page=first,
+                    last_page=min(first + chunk_pages - 1, page_count),
+                    output_folder=tmp_dir.name,
+                    paths_only=True,
+                    grayscale=True,
+                    thread_count=min(workers, chunk_pages),
+                    **poppler_kwargs,
+                )
+                for path in paths:
+                    budget.add_pages()
+                    budget.add_image(*_image_size(path))
+                # already in page order; the file names are not (one uuid prefix per pdftoppm thread)
+                in_flight.append((tmp_dir, [pool.submit(_ocr_page_file, path) for path in paths]))
+                if len(in_flight) > 1:
+                    yield from _finish_chunk(*in_flight.popleft(), budget)
+            while in_flight:
+                yield from _finish_chunk(*in_flight.popleft(), budget)
+        finally:
+            for tmp_dir, futures in in_flight:
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+                tmp_dir.cleanup()
+
+def _image_size(path: str) -> Tuple[int, int]:
+    from PIL import Image
+
+    with Image.open(path) as image:  # header only
+        return image.size
+
+def _finish_chunk(tmp_dir, futures, budget: limits.Budget) -> Iterator[str]:
+    try:
+        for future in futures:
+            budget.check_time()
+            yield future.result()
+    finally:
+        wait(futures)
+        tmp_dir.cleanup()
 
 # ...existing code...
-def extract_text_from_image(image_path: str) -> str:
+def extract_text_from_image(image_path: str, budget: Optional[limits.Budget] = None) -> str:
     """Extract text from an image file using Tesseract OCR."""
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image not found: {os.path.abspath(image_path)}")
 
-    tesseract_cmd = os.getenv("TESSERACT_CMD")
-    if tesseract_cmd:
-        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    from PIL import Image
+    from src.utils import preprocess
 
+    # size and frame count from the header first: a decompression bomb never gets decoded
+    limits.check_image(image_path, budget or limits.Budget(image_path))
     image = Image.open(image_path)
-    return pytesseract.image_to_string(image)
-# ...existing code...
\ No newline at end of file
+    config = ""
+    if preprocess.enabled():
+        # crop, deskew, downscale and binarize: Tesseract time grows with pixel count
+        with metrics.span("preprocess"):
+            image, info = preprocess.preprocess_image(image)
+        config = preprocess.tesseract_config(info["layout"])
+    return _tesseract().image_to_string(image, config=config)
+# ...existing code...
+SUPPORTED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+def write_document_text(file_path: str, out, text_layer: bool = True, ocr: bool = True) -> Optional[int]:
+    """
+    Write a document's text to the text file `out` within its limits.Budget; returns the page count.
+    text_layer=False skips pdfminer; ocr=False returns None (nothing written) for documents that need OCR.
+    """
+    budget = limits.Budget(file_path)
+    if file_path.lower().endswith(".pdf"):
+        return _write_pdf_text(file_path, out, budget, text_layer, ocr)
+    if not ocr:
+        return None
+    text = extract_text_from_image(file_path, budget)
+    out.write(text)
+    return max(1, text.count("\f"))
+
+def extract_document_text(file_path: str) -> limits.Text:
+    """
+    Pick the PDF or image extractor based on the file extension. Runs under
+    the page/pixel/time/memory limits of src.utils.limits; text over
+    TEXT_SPILL_MB comes back as a limits.SpilledText instead of a str.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Document not found: {os.path.abspath(file_path)}")
+    kind = "pdf" if file_path.lower().endswith(".pdf") else "image"
+    with metrics.span("text", kind=kind):
+        text, pages = limits.extract(file_path)
+    # pdfminer and tesseract both end every page with a form feed
+    metrics.inc("pages_total", max(1, pages), kind=kind)
+    return text
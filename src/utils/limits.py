@@ -0,0 +1,402 @@
+"""
+Resource limits for text extraction, so one bad upload cannot take a worker
+(or a whole batch run) down with it.
+
+Before anything is decoded, a document is checked against per-document budgets:
+
+- pages: PDF page count from the document catalog, TIFF frame count
+- pixels: any one image or rendered PDF page, and the document's total. The
+  per-image limit is also Pillow's decompression-bomb limit, so a PNG that
+  lies about its size fails too.
+- time: checked between pages
+
+The text layer of a PDF is read in the calling process (pdfminer, with the
+budgets checked page by page), so text PDFs run on warm workers. OCR of
+scanned PDFs and images runs in a child process (``python -m
+src.utils.limits``) that is killed when the time budget runs out. It is also
+killed when its resident memory goes over OCR_MAX_RSS_MB. That figure
+includes the tesseract/pdftoppm processes it starts. Memory is measured with
+psutil when installed, otherwise from /proc on Linux; on Windows without
+psutil only the time limit applies. A document over a limit fails with
+ResourceLimitError and the run carries on.
+
+The child writes the text to a temp file page by page. Text over TEXT_SPILL_MB
+stays there as a SpilledText: the file's path, which moves between processes
+without copying the text. It is removed when the last reference goes away.
+Compaction streams it page by page into the LLM prompt
+(src.utils.compaction). The OCR cache and vendor templates skip it, and with
+document type ``auto`` it is classified from its first pages and not split.
+
+    DOC_MAX_PAGES=500
+    DOC_MAX_PIXELS=300000000    pixels OCR'd per document (all pages/frames)
+    IMAGE_MAX_PIXELS=90000000   pixels of one image or rendered page
+    DOC_TIMEOUT=300             seconds of text extraction per document
+    OCR_MAX_RSS_MB=2048
+    TEXT_ISOLATION=1            0: OCR in-process too (budgets still checked, no kill)
+    TEXT_SPILL_MB=4
+    TEXT_SPILL_DIR=             default: the system temp directory
+"""
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import weakref
+from typing import Iterator, Optional, Tuple, Union
+
+from src.utils import metrics
+
+LIMIT_EXIT = 3  # child exit code for "over a budget"
+POLL_SECONDS = 0.2
+READ_CHUNK = 1 << 20
+HEAD_CHARS = 20000  # text used to classify a spilled document
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ResourceLimitError(RuntimeError):
+    """A document went over its page, pixel, time or memory budget."""
+
+
+def max_pages() -> int:
+    return int(os.getenv("DOC_MAX_PAGES", "500"))
+
+
+def max_pixels() -> int:
+    return int(os.getenv("DOC_MAX_PIXELS", "300000000"))
+
+
+def image_max_pixels() -> int:
+    return int(os.getenv("IMAGE_MAX_PIXELS", "90000000"))
+
+
+def timeout() -> float:
+    return float(os.getenv("DOC_TIMEOUT", "300"))
+
+
+def max_rss() -> int:
+    return int(float(os.getenv("OCR_MAX_RSS_MB", "2048")) * 1024 * 1024)
+
+
+def isolated() -> bool:
+    return os.getenv("TEXT_ISOLATION", "1").lower() not in ("0", "false", "no", "off")
+
+
+def spill_bytes() -> int:
+    return int(float(os.getenv("TEXT_SPILL_MB", "4")) * 1024 * 1024)
+
+
+def spill_dir() -> Optional[str]:
+    return os.getenv("TEXT_SPILL_DIR") or None
+
+
+class Budget:
+    """Pages, pixels and time used so far by one document."""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.pages = 0
+        self.pixels = 0
+        self.deadline = time.monotonic() + timeout()
+
+    def _fail(self, what: str) -> None:
+        metrics.inc("resource_limits_total", limit=what.split()[0])
+        raise ResourceLimitError(f"{os.path.basename(self.name) or 'document'}: {what}")
+
+    def check_time(self) -> None:
+        if time.monotonic() > self.deadline:
+            self._fail(f"time over DOC_TIMEOUT={timeout():g}s")
+
+    def add_pages(self, count: int = 1) -> None:
+        self.pages += count
+        if self.pages > max_pages():
+            self._fail(f"pages over DOC_MAX_PAGES={max_pages()}")
+        self.check_time()
+
+    def add_image(self, width: int, height: int) -> None:
+        if width * height > image_max_pixels():
+            self._fail(f"pixels {width}x{height} over IMAGE_MAX_PIXELS={image_max_pixels()}")
+        self.pixels += width * height
+        if self.pixels > max_pixels():
+            self._fail(f"pixels over DOC_MAX_PIXELS={max_pixels()}")
+
+
+def check_image(image_path: str, budget: Budget) -> None:
+    """Size and frame count from the image header, before any pixel is decoded."""
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = image_max_pixels()  # Pillow raises DecompressionBombError past 2x this
+    try:
+        with Image.open(image_path) as image:
+            for frame in range(getattr(image, "n_frames", 1)):
+                if frame:
+                    image.seek(frame)  # multi-page TIFF: reads the next header only
+                budget.add_pages()
+                budget.add_image(*image.size)
+    except Image.DecompressionBombError as e:
+        budget._fail(f"pixels over IMAGE_MAX_PIXELS={image_max_pixels()} ({e})")
+
+
+def image_fits(image_path: str) -> bool:
+    """Whether one image is within IMAGE_MAX_PIXELS, from its header alone (nothing raised or counted)."""
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = image_max_pixels()
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return False
+    return width * height <= image_max_pixels()
+
+
+def check_pdf(pdf_path: str, budget: Budget) -> int:
+    """Page count from the PDF's page tree, without parsing any page."""
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    try:
+        with open(pdf_path, "rb") as fh:
+            count = int(resolve1(PDFDocument(PDFParser(fh)).catalog["Pages"])["Count"])
+    except Exception:
+        return 0  # damaged page tree: pages are still counted as they are read
+    if count > max_pages():
+        budget.add_pages(count)
+    return count
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpilledText:
+    """
+    Extracted text kept in a UTF-8 temp file. Pickling hands the file over
+    (a process-pool worker returns it to the parent); the file is removed
+    when the last owner drops it.
+    """
+
+    def __init__(self, path: str, page_count: int = 0):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.page_count = page_count
+        self._cleanup = weakref.finalize(self, _remove, path)
+
+    def __len__(self) -> int:
+        return self.size  # about one byte per character: good enough for token estimates
+
+    def __repr__(self) -> str:
+        return f"SpilledText({self.path!r}, {self.size} bytes, {self.page_count} pages)"
+
+    def __getstate__(self):
+        self._cleanup.detach()  # the receiving process owns the file now
+        return {"path": self.path, "size": self.size, "page_count": self.page_count}
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self._cleanup = weakref.finalize(self, _remove, self.path)
+
+    def pages(self) -> Iterator[str]:
+        """Each page's text (split on form feeds), reading the file a chunk at a time."""
+        rest = ""
+        with open(self.path, encoding="utf-8") as fh:
+            for chunk in iter(lambda: fh.read(READ_CHUNK), ""):
+                parts = (rest + chunk).split("\f")
+                rest = parts.pop()
+                yield from parts
+        if rest.strip():
+            yield rest
+
+    def head(self, chars: int = HEAD_CHARS) -> str:
+        with open(self.path, encoding="utf-8") as fh:
+            return fh.read(chars)
+
+
+Text = Union[str, SpilledText]
+
+
+def load_text(path: str, page_count: int = 0) -> Text:
+    """The text written to `path`: a str (file removed) or, over TEXT_SPILL_MB, a SpilledText."""
+    if os.path.getsize(path) > spill_bytes():
+        metrics.inc("text_spilled_total")
+        return SpilledText(path, page_count)
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return fh.read()
+    finally:
+        _remove(path)
+
+
+def head(text: Text, chars: int = HEAD_CHARS) -> str:
+    """The start of a text, whether it is a str or spilled to disk."""
+    return text[:chars] if isinstance(text, str) else text.head(chars)
+
+
+def _temp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(prefix="text_", suffix=suffix, dir=spill_dir())
+    os.close(fd)
+    return path
+
+
+def _group_rss(pid: int) -> int:
+    """Resident bytes of the child and everything it started."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            total = parent.memory_info().rss
+            for child in parent.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total
+        except psutil.Error:
+            return 0
+    if not os.path.isdir("/proc"):
+        return 0
+    total, page = 0, os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="ascii", errors="replace") as fh:
+                fields = fh.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pid:  # process group: the child started its own session
+            total += int(fields[21]) * page
+    return total
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    if os.name == "posix":
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        try:
+            import psutil
+
+            for child in psutil.Process(proc.pid).children(recursive=True):
+                child.kill()
+        except Exception:
+            pass
+        proc.kill()
+    proc.wait()
+
+
+def _last_line(fh) -> str:
+    fh.seek(0)
+    lines = [line.strip() for line in fh.read().decode("utf-8", "replace").splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+def extract_isolated(file_path: str) -> Tuple[Text, int]:
+    """OCR a document in a child process under the time and memory limits; (text, pages)."""
+    out_path = _temp_path(".txt")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])))
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen([sys.executable, "-m", "src.utils.limits", file_path, out_path],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr,
+                                env=env, start_new_session=os.name == "posix")
+        deadline, limit = time.monotonic() + timeout(), max_rss()
+        try:
+            while True:
+                try:
+                    code = proc.wait(timeout=POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if time.monotonic() > deadline:
+                    _kill(proc)
+                    metrics.inc("resource_limits_total", limit="time")
+                    raise ResourceLimitError(f"{os.path.basename(file_path)}: killed after "
+                                             f"DOC_TIMEOUT={timeout():g}s")
+                rss = _group_rss(proc.pid)
+                if rss > limit:
+                    _kill(proc)
+                    metrics.inc("resource_limits_total", limit="memory")
+                    raise ResourceLimitError(f"{os.path.basename(file_path)}: killed at {rss >> 20} MB, "
+                                             f"over OCR_MAX_RSS_MB={limit >> 20}")
+        except BaseException:
+            if proc.poll() is None:
+                _kill(proc)
+            _remove(out_path)
+            _remove(out_path + ".meta")
+            raise
+        message = _last_line(stderr) if code else ""
+    meta = {"pages": 0, "metrics": {}}
+    if os.path.exists(out_path + ".meta"):
+        with open(out_path + ".meta", "rb") as fh:
+            meta = pickle.load(fh)
+        _remove(out_path + ".meta")
+    metrics.merge(meta["metrics"])
+    if code != 0:
+        _remove(out_path)
+        message = message or f"exit code {code}"
+        if code == LIMIT_EXIT:
+            raise ResourceLimitError(message)
+        if code < 0:
+            metrics.inc("resource_limits_total", limit="killed")
+            raise ResourceLimitError(f"{os.path.basename(file_path)}: text extraction killed by signal {-code}")
+        raise RuntimeError(message)
+    return load_text(out_path, meta["pages"]), meta["pages"]
+
+
+def extract(file_path: str) -> Tuple[Text, int]:
+    """
+    Text and page count of a document, within its budgets. A PDF text layer
+    is read here; OCR runs in a child process with TEXT_ISOLATION.
+    """
+    from src.utils.helpers import write_document_text
+
+    out_path = _temp_path(".txt")
+    try:
+        with open(out_path, "w", encoding="utf-8") as out:
+            pages = write_document_text(file_path, out, ocr=not isolated())
+    except BaseException:
+        _remove(out_path)
+        raise
+    if pages is None:  # scanned PDF or image
+        _remove(out_path)
+        return extract_isolated(file_path)
+    return load_text(out_path, pages), pages
+
+
+def _child_main(file_path: str, out_path: str) -> int:
+    from src.utils.helpers import write_document_text
+
+    metrics.reset()
+    pages, code = 0, 0
+    try:
+        with open(out_path, "w", encoding="utf-8") as out:
+            pages = write_document_text(file_path, out, text_layer=False)  # the parent found none
+    except ResourceLimitError as e:
+        print(e, file=sys.stderr)
+        code = LIMIT_EXIT
+    except Exception as e:
+        print(e, file=sys.stderr)
+        code = 1
+    with open(out_path + ".meta", "wb") as fh:
+        pickle.dump({"pages": pages, "metrics": metrics.snapshot()}, fh)
+    return code
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m src.utils.limits <document> <output.txt>  (used by extract_isolated)")
+        raise SystemExit(2)
+    # run the imported module's copy, so ResourceLimitError is the class the helpers raise
+    from src.utils.limits import _child_main as child_main
+
+    raise SystemExit(child_main(sys.argv[1], sys.argv[2]))
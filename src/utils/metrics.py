@@ -0,0 +1,244 @@
+"""
+In-process metrics: per-stage timing spans and counters, exported in the
+Prometheus text format.
+
+    with metrics.span("llm", document_type="invoice"):
+        ...
+    metrics.inc("llm_tokens_total", 812)
+
+Stages timed by the pipeline: document, text, preprocess, classify, template, compaction, llm,
+parse, validation, reconcile, reprocess, db_commit.
+Counters: documents_total, pages_total, llm_requests_total, llm_tokens_total,
+llm_retries_total, llm_batched_documents_total, llm_batch_retries_total,
+llm_tokens_saved_total, llm_reasks_total, extraction_repairs_total, cache_hits_total, cache_misses_total, template_hits_total,
+template_misses_total, documents_classified_total, service_jobs_total, uploads_stored_total,
+upload_bytes_copied_total, export_rows_total, db_rows_total, dates_ambiguous_total,
+stage_errors_total, validation_failures_total, documents_validated_total,
+reprocessed_documents_total, resource_limits_total, text_spilled_total.
+
+Export (environment):
+    METRICS_PORT=9108        serve /metrics on localhost for Prometheus to scrape
+    METRICS_FILE=path.prom   write the text format at exit (node_exporter textfile style)
+    PROFILE_DIR=profiles/    dump a cProfile .prof file per processed document
+"""
+import atexit
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {
+    "stage_seconds": "Time spent per pipeline stage.",
+    "documents_total": "Documents finished, by type and status.",
+    "pages_total": "Pages of text extracted, by method.",
+    "llm_requests_total": "LLM requests that returned a reply.",
+    "llm_tokens_total": "LLM tokens used (prompt + completion).",
+    "llm_retries_total": "LLM requests retried after 429/5xx/connection errors.",
+    "llm_batched_documents_total": "Documents sent to the LLM packed with others in one request.",
+    "llm_batch_retries_total": "Documents re-sent alone after a batched reply missed or garbled them.",
+    "llm_reasks_total": "Short LLM requests re-asking only for fields that could not be repaired locally.",
+    "extraction_repairs_total": "Fields of LLM replies fixed locally (numeric strings, currency symbols, derived line values).",
+    "llm_tokens_saved_total": "Estimated prompt tokens removed by text compaction before the LLM.",
+    "cache_hits_total": "Extraction cache hits, by layer.",
+    "cache_misses_total": "Extraction cache misses, by layer.",
+    "template_hits_total": "Documents extracted from a learned vendor template, without the LLM.",
+    "template_misses_total": "Documents the vendor templates could not extract confidently.",
+    "documents_classified_total": "Documents found by the local classifier in \"auto\" files, by type.",
+    "service_jobs_total": "Service jobs by status transition (queued, done, failed).",
+    "uploads_stored_total": "Uploads put in the store, by method (existing, reflink, hardlink, copy).",
+    "upload_bytes_copied_total": "Bytes written to the upload store by streaming copies.",
+    "export_rows_total": "Documents written by the incremental Parquet/CSV export.",
+    "db_rows_total": "Invoice/receipt rows written.",
+    "dates_ambiguous_total": "Dates that read both as dd/mm and mm/dd, stored in the default order.",
+    "stage_errors_total": "Exceptions raised inside a pipeline stage.",
+    "validation_failures_total": "LLM replies that did not fit the ExtractedData schema.",
+    "resource_limits_total": "Documents stopped by a text-extraction limit, by limit (pages, pixels, time, memory, killed).",
+    "text_spilled_total": "Extracted texts over TEXT_SPILL_MB kept in a temp file and streamed into compaction.",
+    "reprocessed_documents_total": "Stored documents re-extracted by src.reprocess, by status (changed, unchanged, error, missing).",
+    "documents_validated_total": "Documents whose line items and totals were reconciled, by result (passed, retried, review).",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+# histogram name -> labels -> [bucket counts..., sum, count]
+_histograms: Dict[str, Dict[LabelKey, list]] = {}
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[None]:
+    """Time a pipeline stage; exceptions are counted per stage and re-raised."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", stage=stage)
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+
+def snapshot() -> dict:
+    """Copy of all series, e.g. to ship from a worker process to the parent."""
+    with _lock:
+        return {
+            "counters": {n: dict(s) for n, s in _counters.items()},
+            "histograms": {n: {k: list(v) for k, v in s.items()} for n, s in _histograms.items()},
+        }
+
+
+def merge(data: dict) -> None:
+    """Add a snapshot() taken elsewhere into this process's metrics."""
+    with _lock:
+        for name, series in data.get("counters", {}).items():
+            target = _counters.setdefault(name, {})
+            for key, value in series.items():
+                target[key] = target.get(key, 0) + value
+        for name, series in data.get("histograms", {}).items():
+            target = _histograms.setdefault(name, {})
+            for key, values in series.items():
+                current = target.setdefault(key, [0] * len(BUCKETS) + [0.0, 0])
+                for i, value in enumerate(values):
+                    current[i] += value
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus(prefix: str = "invoice_agent_") -> str:
+    """All metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name in sorted(data["counters"]):
+        full = prefix + name
+        lines.append(f"# HELP {full} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full} counter")
+        for key, value in sorted(data["counters"][name].items()):
+            lines.append(f"{full}{_labels(key)} {value:g}")
+    for name in sorted(data["histograms"]):
+        full = prefix + name
+        lines.append(f"# HELP {full} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full} histogram")
+        for key, values in sorted(data["histograms"][name].items()):
+            for bound, count in zip(BUCKETS, values):
+                lines.append(f"{full}_bucket{_labels(key, ('le', f'{bound:g}'))} {count}")
+            lines.append(f"{full}_bucket{_labels(key, ('le', '+Inf'))} {values[-1]}")
+            lines.append(f"{full}_sum{_labels(key)} {values[-2]:.6f}")
+            lines.append(f"{full}_count{_labels(key)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: str) -> None:
+    """Write atomically so a scraper never reads a half-written file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    # imported here: every entry point imports this module, few serve /metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("/metrics", ""):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+@contextmanager
+def profile(name: str) -> Iterator[None]:
+    """cProfile the block into PROFILE_DIR/<name>-<timestamp>.prof when PROFILE_DIR is set."""
+    directory = os.getenv("PROFILE_DIR")
+    if not directory:
+        yield
+        return
+    import cProfile
+
+    os.makedirs(directory, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)[:80]
+        profiler.dump_stats(os.path.join(directory, f"{safe}-{int(time.time() * 1000)}.prof"))
+
+
+_exporters_started = False
+
+
+def start_exporters_from_env() -> None:
+    """Start the /metrics endpoint and/or the at-exit file writer once, per METRICS_PORT/METRICS_FILE."""
+    global _exporters_started
+    with _lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    port = os.getenv("METRICS_PORT")
+    if port:
+        start_metrics_server(int(port))
+        print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    path = os.getenv("METRICS_FILE")
+    if path:
+        atexit.register(write_metrics_file, path)
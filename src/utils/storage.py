@@ -0,0 +1,281 @@
+"""
+Content-addressed upload store.
+
+Uploads are kept once per distinct content, under a sharded tree so no
+directory grows huge:
+
+    uploads/objects/3f/a9/3fa9c2...e1.pdf    (SHA-256 of the bytes + original extension)
+
+Storing a file costs as little I/O as the filesystem allows:
+
+- already stored (same hash): nothing is written
+- same filesystem: reflink (copy-on-write clone) where supported, else a hard link
+- otherwise: one streaming pass that copies in chunks and hashes as it goes
+
+Hard links share the inode with the source, so a file edited in place after
+upload would change the stored copy too; set UPLOAD_LINK_MODE=copy (or
+reflink) if sources may be modified.
+
+Every put (including one that finds the content already stored) sets the
+object's mtime to the time it was stored, so the garbage collector's grace
+period counts from the last upload rather than from the source file's age
+(links and reflinks would otherwise keep the source's mtime).
+
+Files no longer referenced by any file_path row (invoices, receipts,
+document_fingerprints, jobs, review_queue) are deleted by the garbage collector once they
+are older than UPLOAD_RETENTION_DAYS:
+
+    python -m src.utils.storage gc [--dry-run] [--retention-days 7] [--legacy]
+    python -m src.utils.storage stats
+
+    UPLOAD_DIR=uploads             store root (objects/ lives inside it)
+    UPLOAD_LINK_MODE=auto          auto (reflink, then hard link, then copy) | reflink | hardlink | copy
+    UPLOAD_RETENTION_DAYS=7        grace period before unreferenced files are collected
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, Iterable, Optional, Set, Tuple
+
+from src.utils import metrics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_UPLOAD_DIR = os.path.join(PROJECT_ROOT, "uploads")
+CHUNK_SIZE = 1024 * 1024
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+FICLONE = 0x40049409  # Linux ioctl: share the source's extents (btrfs, xfs, bcachefs)
+
+
+def _touch(path: str) -> None:
+    """Mark `path` as stored now; collect_garbage measures the grace period from this mtime."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass  # removed concurrently: nothing to protect
+
+
+def _reflink(src: str, dest: str) -> None:
+    import fcntl
+
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class UploadStore:
+    """Sharded, content-addressed file store rooted at `root`/objects."""
+
+    def __init__(self, root: str = DEFAULT_UPLOAD_DIR, link_mode: str = "auto"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"UPLOAD_LINK_MODE must be one of {LINK_MODES}, got {link_mode!r}")
+        self.root = os.path.abspath(root)
+        self.objects = os.path.join(self.root, "objects")
+        self.link_mode = link_mode
+        os.makedirs(self.objects, exist_ok=True)
+
+    def path_for(self, sha256: str, suffix: str = "") -> str:
+        return os.path.join(self.objects, sha256[:2], sha256[2:4], sha256 + suffix.lower())
+
+    def contains(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.objects + os.sep)
+
+    def _same_filesystem(self, path: str) -> bool:
+        try:
+            return os.stat(path).st_dev == os.stat(self.objects).st_dev
+        except OSError:
+            return False
+
+    def _place(self, src: str, dest: str) -> str:
+        """Reflink or hard-link src to dest; returns the method used, or "" if neither worked."""
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if self.link_mode in ("auto", "reflink"):
+            tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                _reflink(src, tmp)
+                os.replace(tmp, dest)
+                return "reflink"
+            except (OSError, ImportError):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        if self.link_mode in ("auto", "hardlink"):
+            try:
+                os.link(src, dest)
+                return "hardlink"
+            except FileExistsError:
+                return "existing"  # another worker stored the same content first
+            except OSError:
+                pass
+        return ""
+
+    def put(self, src: str, sha256: Optional[str] = None) -> Tuple[str, str]:
+        """Store a file; returns (stored path, sha256). Files already in the store are returned as-is."""
+        src = os.path.abspath(src)
+        if not os.path.exists(src):
+            raise FileNotFoundError(f"Document not found: {src}")
+        suffix = os.path.splitext(src)[1]
+        if self.contains(src):
+            return src, sha256 or os.path.basename(src)[:64]
+
+        linkable = self.link_mode != "copy" and self._same_filesystem(src)
+        if sha256 is None and linkable:
+            from src.utils.cache import sha256_file
+            sha256 = sha256_file(src)  # read once, then link: no bytes written
+        if sha256 is not None:
+            dest = self.path_for(sha256, suffix)
+            if os.path.exists(dest):
+                _touch(dest)
+                metrics.inc("uploads_stored_total", method="existing")
+                return dest, sha256
+            if linkable:
+                method = self._place(src, dest)
+                if method:
+                    _touch(dest)
+                    metrics.inc("uploads_stored_total", method=method)
+                    return dest, sha256
+        with open(src, "rb") as fh:
+            return self.put_stream(fh, suffix, expected_sha256=sha256)
+
+    def put_stream(self, stream: BinaryIO, suffix: str = "", length: Optional[int] = None,
+                   expected_sha256: Optional[str] = None) -> Tuple[str, str]:
+        """Copy a stream into the store in chunks, hashing in the same pass; returns (path, sha256)."""
+        digest = hashlib.sha256()
+        incoming = os.path.join(self.root, "incoming")
+        os.makedirs(incoming, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=incoming, suffix=".part")
+        copied = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                remaining = length
+                while remaining is None or remaining > 0:
+                    chunk = stream.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    copied += len(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+            if length is not None and copied != length:
+                raise IOError(f"upload truncated: got {copied} of {length} bytes")
+            sha256 = digest.hexdigest()
+            if expected_sha256 and sha256 != expected_sha256:
+                raise IOError("file changed while it was being stored")
+            dest = self.path_for(sha256, suffix)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.exists(dest):
+                os.remove(tmp)
+                metrics.inc("uploads_stored_total", method="existing")
+            else:
+                os.replace(tmp, dest)
+                metrics.inc("uploads_stored_total", method="copy")
+                metrics.inc("upload_bytes_copied_total", copied)
+            _touch(dest)
+            return dest, sha256
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def iter_files(self, legacy: bool = False) -> Iterable[str]:
+        """Stored objects, plus (legacy=True) files left in the flat uploads/ folder by older versions."""
+        for directory, _, files in os.walk(self.objects):
+            for name in files:
+                yield os.path.join(directory, name)
+        if legacy:
+            for entry in os.scandir(self.root):
+                if entry.is_file():
+                    yield entry.path
+
+    def stats(self) -> Dict[str, int]:
+        files = size = 0
+        for path in self.iter_files():
+            files += 1
+            size += os.path.getsize(path)
+        return {"files": files, "bytes": size}
+
+
+def referenced_paths() -> Set[str]:
+    """Every file_path stored in the database, normalized to absolute paths."""
+    from sqlalchemy import select
+
+    from src.database.connection import SessionLocal
+    from src.database.models import (DocumentFingerprintModel, InvoiceModel, JobModel, ReceiptModel,
+                                     ReviewItemModel)
+
+    paths: Set[str] = set()
+    with SessionLocal() as db:
+        for model in (InvoiceModel, ReceiptModel, DocumentFingerprintModel, JobModel, ReviewItemModel):
+            for (path,) in db.execute(select(model.file_path).where(model.file_path.isnot(None))
+                                      .execution_options(yield_per=5000)):
+                paths.add(os.path.abspath(path))
+    return paths
+
+
+def collect_garbage(store: "UploadStore", retention_days: float = 7.0, dry_run: bool = False,
+                    legacy: bool = False) -> Dict[str, int]:
+    """Delete stored files that no row references and that are older than the retention period."""
+    referenced = referenced_paths()
+    cutoff = time.time() - retention_days * 24 * 3600
+    stats = {"scanned": 0, "referenced": 0, "recent": 0, "deleted": 0, "bytes_freed": 0}
+    for path in list(store.iter_files(legacy=legacy)):
+        stats["scanned"] += 1
+        if path in referenced:
+            stats["referenced"] += 1
+            continue
+        st = os.stat(path)
+        if st.st_mtime > cutoff:
+            stats["recent"] += 1  # may belong to a document still in flight
+            continue
+        stats["deleted"] += 1
+        stats["bytes_freed"] += st.st_size
+        if not dry_run:
+            os.remove(path)
+    if not dry_run:
+        # drop emptied shard directories, deepest first
+        for directory, _, _ in sorted(os.walk(store.objects), key=lambda d: -len(d[0])):
+            if directory != store.objects and not os.listdir(directory):
+                os.rmdir(directory)
+    return stats
+
+
+_store: Optional[UploadStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> UploadStore:
+    """Process-wide store configured from UPLOAD_DIR / UPLOAD_LINK_MODE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UploadStore(
+                root=os.getenv("UPLOAD_DIR", DEFAULT_UPLOAD_DIR),
+                link_mode=os.getenv("UPLOAD_LINK_MODE", "auto").lower(),
+            )
+        return _store
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Upload store maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc = sub.add_parser("gc", help="delete stored files no DB row refers to")
+    gc.add_argument("--retention-days", type=float,
+                    default=float(os.getenv("UPLOAD_RETENTION_DAYS", "7")))
+    gc.add_argument("--dry-run", action="store_true")
+    gc.add_argument("--legacy", action="store_true",
+                    help="also collect unreferenced files in the old flat uploads/ folder")
+    sub.add_parser("stats", help="count stored files and bytes")
+    args = parser.parse_args(argv)
+
+    store = get_store()
+    if args.command == "stats":
+        print(store.stats())
+        return 0
+    stats = collect_garbage(store, args.retention_days, args.dry_run, args.legacy)
+    print(("Would delete" if args.dry_run else "Deleted") + f": {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,34 @@
+import pytest
+
+from src.extractors.classifier import segment_document
+
+DISCLAIMER = (
+    "Your transfer has been successful and the beneficiary's account will be credited. However, this does not\n"
+    "serve as confirmation of credit into the beneficiary's account. Due to the nature of the internet,\n"
+    "transactions may be subject to interruption, transmission blackout, delayed transmission and incorrect\n"
+    "data transmission. The Bank is not liable for malfunctions in communications facilities not within its\n"
+    "control that may affect the accuracy or timeliness of messages and transactions you send to us today.\n"
+    "All transactions are subject to verification and our normal fraud checks before they are completed.\n"
+)
+INVOICE = "ACME SUPPLIES LTD\nINVOICE\nInvoice No: INV-1001\nBill To: Widget Corp\nDue Date: 2024-03-31\n" \
+           "Bolts 4 12.50 50.00\nTotal 50.00\n"
+RECEIPT = "CORNER SHOP\nReceipt\nCashier: Ann\n12:41 PM\nMilk 1.20\nBread 2.10\nTotal 3.30\nCash 5.00\n" \
+           "Change 1.70\nThank you\n"
+TRANSFER = "Receipt\n30 Nov 2025\n84,000.00\nSuccess\nSender\nAhmed\nReceiver\nMicheal\nAccount number\n" \
+            "3198434396\nReference number\n000013251130\n"
+
+# (name, pages, expected (document_type, first_page, last_page) per document)
+CASES = [
+    ("receipt + trailing disclaimer page", [TRANSFER, DISCLAIMER], [("receipt", 1, 2)]),
+    ("invoice + trailing terms page", [INVOICE, DISCLAIMER], [("invoice", 1, 2)]),
+    ("invoice then receipt", [INVOICE, RECEIPT], [("invoice", 1, 1), ("receipt", 2, 2)]),
+    ("two receipts", [RECEIPT, RECEIPT.replace("CORNER", "DELI")], [("receipt", 1, 1), ("receipt", 2, 2)]),
+    ("blank separator", [INVOICE, " ", INVOICE.replace("1001", "1002")], [("invoice", 1, 1), ("invoice", 3, 3)]),
+]
+
+
+@pytest.mark.parametrize("pages, expected", [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_segment_document_splits(pages, expected):
+    found = [(s.document_type, s.first_page, s.last_page) for s in segment_document("\f".join(pages))]
+
+    assert found == expected
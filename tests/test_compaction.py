@@ -0,0 +1,49 @@
+from src.utils import compaction
+from src.utils.limits import SpilledText
+
+HEADER = ["ACME Supplies Ltd", "12 Market Street, Lagos", "Invoice No: INV-2291", "Date: 2024-03-05", ""]
+TERMS = ["Terms and conditions: all goods remain the property of the supplier until paid in full, "
+         "liability is limited to the invoice amount and disputes shall be governed by local law."] * 3
+ITEMS = [f"Item {n:03d}  Widget type {n}  qty {n % 7 + 1}  {n % 7 + 1}.00 x 12.50  {12.5 * (n % 7 + 1):.2f}"
+         for n in range(1, 201)]
+TOTALS = ["", "Subtotal  9,999.00", "VAT 7.5%  749.93", "Total due  10,748.93"]
+
+
+def _document(*notes):
+    return "\n".join(HEADER + ITEMS + TOTALS + ["", *notes, ""] + TERMS)
+
+
+def _item_lines(text):
+    return [line for line in text.splitlines() if line.startswith("Item ")]
+
+
+NOTES = [f"Shipping note: {a} {b} item, unit packed by the supplier." for a in ("boxed", "loose", "sealed", "pallet", "crated")
+           for b in ("fragile", "heavy", "light", "bulky", "cold", "dry", "wet", "small", "large", "long")]
+
+
+def test_trim_keeps_every_line_item():
+    compacted, stats = compaction.compact_text(_document(*NOTES), budget=3000)
+
+    assert _item_lines(compacted) == ITEMS
+    assert "Total due  10,748.93" in compacted
+    assert 0 < stats["lines_trimmed"] <= len(NOTES)
+
+
+def test_line_items_over_budget_skip_the_trim():
+    text = _document("Please remit payment to the account shown on the front page.")
+    compacted, stats = compaction.compact_text(text, budget=500)
+
+    assert _item_lines(compacted) == ITEMS
+    assert "Please remit payment to the account shown on the front page." in compacted
+    assert stats["lines_trimmed"] == 0
+
+
+def test_spilled_text_keeps_every_line_item(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text(_document(*NOTES))
+
+    compacted, stats = compaction.compact_spilled(SpilledText(str(path)), budget=500)
+
+    assert _item_lines(compacted) == ITEMS
+    assert "Total due  10,748.93" in compacted
+    assert stats["lines_trimmed"] > 0
@@ -0,0 +1,37 @@
+import os
+
+import pdf2image
+
+from src.utils import helpers
+
+
+def _fake_convert(pdf_path, first_page, last_page, output_folder, thread_count, **kwargs):
+    """pdftoppm with one output prefix per thread; prefixes deliberately sort against page order."""
+    pages = list(range(first_page, last_page + 1))
+    per_thread = -(-len(pages) // thread_count)
+    paths = []
+    for thread in range(thread_count):
+        prefix = f"{'fedcba'[thread]}0c1e2d"  # uuid4-like: unrelated to the page numbers
+        for page in pages[thread * per_thread:(thread + 1) * per_thread]:
+            path = os.path.join(output_folder, f"{prefix}-{page:02d}.ppm")
+            with open(path, "w") as fh:
+                fh.write(f"page {page}")
+            paths.append(path)
+    return paths
+
+
+def _read(path):
+    with open(path) as fh:
+        return fh.read()
+
+
+def test_ocr_pages_come_back_in_page_order(monkeypatch):
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", lambda *a, **k: {"Pages": 7, "Page size": "612 x 792 pts"})
+    monkeypatch.setattr(pdf2image, "convert_from_path", _fake_convert)
+    monkeypatch.setattr(helpers, "_tesseract", lambda: None)
+    monkeypatch.setattr(helpers, "_image_size", lambda path: (1700, 2200))
+    monkeypatch.setattr(helpers, "_ocr_page_file", _read)
+
+    pages = list(helpers.iter_pdf_ocr_pages("scan.pdf", chunk_pages=4, workers=3))
+
+    assert pages == [f"page {n}" for n in range(1, 8)]